@@ -1,11 +1,41 @@
 # app.py
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, make_response
 from web3 import Web3
-import json
 from datetime import datetime
 import os
-from pathlib import Path
 from flask_cors import CORS
+from nonce_manager import NonceManager, TransactionSender
+from tx_tracker import ReceiptTracker, normalize_hash
+from indexer import EventIndexer
+from cache import TTLCache, SingleFlight
+from rpc_batch import batch_call
+from fee_oracle import FeeOracle, GasEstimator
+from contract_versions import supply_chain_for
+from ingest import Ingestor, read_rows
+from metrics import MetricsRegistry, rpc_metrics_middleware
+from profiling import PROFILE_FORMATS, RequestProfiler, profile_path, sample_process, write_collapsed
+import io
+import time
+import hashlib
+import hmac
+from web3.exceptions import TransactionNotFound
+from signers import SignerLane, SignerRegistry
+from product_filter import RegisteredProductFilter
+from chain_head import ChainHead
+from shared_state import (
+    LeaderLock, SharedEventLog, SharedMarker, SharedMetrics, SharedState, SharedNonceManager,
+    SharedTransactionLog
+)
+from contract_artifacts import load_contract_artifact, prebuild_functions
+from node_connection import NodeConnection
+from rpc_pool import PooledHTTPProvider
+from event_stream import EventHub
+from audit_export import AuditExporter, parse_cursor, parse_date
+from app_common import (
+    MANUFACTURER_PRIVATE_KEY, deployed_address, find_contract_artifact, find_deployable_artifact,
+    format_product_info, format_transfer, registration_args
+)
+from historical import BlockTimeIndex, HistoricalResultCache
 
 app = Flask(__name__)
 
@@ -14,100 +44,594 @@ CORS(app)
 
 # Connect to Ganache
 # w3 = Web3(Web3.HTTPProvider(' https://brief-presently-ladybug.ngrok-free.app'))
-w3 = Web3(Web3.HTTPProvider(' http://127.0.0.1:7545'))
-# Updated path to contract JSON
-contract_path = Path('build/contracts/PharmaSupplyChain.json')
-if not contract_path.exists():
-    raise FileNotFoundError(
-        "Contract JSON not found. Please ensure you have run 'truffle migrate' successfully"
+# CHAIN_BACKEND=eth-tester runs an in-process py-evm chain instead, with the
+# contract deployed from its compiled artifact at startup (tests, benchmarks)
+CHAIN_BACKEND = os.getenv('CHAIN_BACKEND', 'http')
+in_process_chain = None
+rpc_pool = None
+if CHAIN_BACKEND == 'eth-tester':
+    from evm_backend import InProcessChain
+    in_process_chain = InProcessChain()
+    w3 = Web3(in_process_chain.provider)
+elif CHAIN_BACKEND == 'http':
+    # RPC_URLS lists nodes of the same chain, primary first: writes stay on the
+    # primary, eth_call reads are spread over nodes that have caught up
+    RPC_URLS = [
+        url.strip() for url in os.getenv('RPC_URLS', os.getenv('RPC_URL', 'http://127.0.0.1:7545')).split(',')
+        if url.strip()
+    ]
+    rpc_pool = PooledHTTPProvider(
+        RPC_URLS,
+        timeout=float(os.getenv('RPC_TIMEOUT', '10')),
+        pool_size=int(os.getenv('RPC_POOL_SIZE', '32')),
+        health_interval=float(os.getenv('RPC_HEALTH_INTERVAL', '2')),
+        max_read_lag=int(os.getenv('RPC_MAX_READ_LAG', '0'))
     )
+    w3 = Web3(rpc_pool)
+else:
+    raise ValueError(f"Unknown CHAIN_BACKEND {CHAIN_BACKEND!r}, expected 'http' or 'eth-tester'")
+
+# Nothing contacts the node until the first request; while it is unreachable
+# requests fail fast and reconnects back off up to NODE_MAX_BACKOFF seconds
+node = NodeConnection(
+    initial_backoff=float(os.getenv('NODE_INITIAL_BACKOFF', '0.5')),
+    max_backoff=float(os.getenv('NODE_MAX_BACKOFF', '30'))
+)
+w3.middleware_onion.add(node.middleware, 'node_connection')
+
+# Slim ABI/address copies of the truffle artifacts, keyed by artifact hash
+ABI_CACHE_DIR = os.getenv('ABI_CACHE_DIR', 'build/abi_cache')
 
 # Load smart contract ABI and address
-with open(contract_path) as f:
-    contract_json = json.load(f)
+if in_process_chain is not None:
+    contract_path = find_deployable_artifact()
+    contract_json = in_process_chain.deploy(contract_path)
+else:
+    contract_path = find_contract_artifact(ABI_CACHE_DIR)
+    contract_json = load_contract_artifact(contract_path, ABI_CACHE_DIR)
 CONTRACT_ABI = contract_json['abi']
 
 # Get the most recently deployed contract address
-CONTRACT_ADDRESS = contract_json['networks'][list(contract_json['networks'].keys())[-1]]['address']
+CONTRACT_ADDRESS = deployed_address(contract_json)
 
-contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI)
+contract = prebuild_functions(w3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI))
 
-def format_product_info(product_tuple):
-    """Format product information from contract tuple response"""
-    try:
-        return {
-            'product_id': product_tuple[0],
-            'manufacturer': product_tuple[1],
-            'batch_number': product_tuple[2],
-            'manufacture_date': datetime.fromtimestamp(product_tuple[3]).isoformat(),
-            'expiry_date': datetime.fromtimestamp(product_tuple[4]).isoformat(),
-            'current_owner': product_tuple[5],
-            'gtin': product_tuple[6],
-            'serial_number': product_tuple[7]
-        }
-    except Exception as e:
-        app.logger.error(f"Error formatting product info: {e}")
-        return None
+# Version-specific call building and result decoding (v1 strings or v2 bytes32 keys)
+supply_chain = supply_chain_for(contract)
+
+# Account used to sign product registrations (PRIVATE_KEY, see app_common.py)
+manufacturer_account = w3.eth.account.from_key(MANUFACTURER_PRIVATE_KEY)
+
+# Nonces and async transactions shared by all worker processes (SHARED_STATE_PATH,
+# set by gunicorn.conf.py); a single process keeps them in memory
+SHARED_STATE_PATH = os.getenv('SHARED_STATE_PATH')
+shared_state = SharedState(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+
+# Only the worker holding the leader lock follows the chain for the indexer,
+# the product filter and the event feed; the others read what it writes.
+# A single process is always the leader
+leader_lock = LeaderLock(f'{SHARED_STATE_PATH}.lock') if shared_state else None
+is_leader = leader_lock is None or leader_lock.acquire()
+
+# Latest block number as last read by any background loop or request, shared
+# between workers, for code that must not wait on the node for it
+chain_head = ChainHead(
+    w3,
+    max_age=float(os.getenv('CHAIN_HEAD_MAX_AGE', '1.0')),
+    shared=SharedMarker(shared_state, 'chain_head') if shared_state else None
+)
+
+# Tracks the next nonce per sender locally so concurrent writes don't collide
+nonce_manager = SharedNonceManager(w3, shared_state) if shared_state else NonceManager(w3)
+
+# Resolves receipts for transactions submitted in async mode, once per new block
+receipt_tracker = ReceiptTracker(w3, poll_interval=float(os.getenv('RECEIPT_POLL_INTERVAL', '1.0')))
+
+# Lets any worker answer /tx for transactions another worker submitted
+tx_log = None
+if shared_state is not None:
+    tx_log = SharedTransactionLog(shared_state)
+    receipt_tracker.subscribe(tx_log.record)
+
+def track_transaction(tx_hash, **details):
+    """Hand a submitted transaction to the receipt tracker (and the shared log)"""
+    key = receipt_tracker.track(tx_hash, **details)
+    if tx_log is not None:
+        tx_log.record(receipt_tracker.status(key))
+    return key
+
+# Optional off-chain projection of contract events (set INDEXER_ENABLED=true)
+indexer = None
+if os.getenv('INDEXER_ENABLED', '').lower() in ('1', 'true', 'yes'):
+    indexer = EventIndexer(
+        w3,
+        supply_chain,
+        os.getenv('INDEXER_DB', 'indexer.sqlite3'),
+        start_block=int(os.getenv('INDEXER_START_BLOCK', '0')),
+        chunk_size=int(os.getenv('INDEXER_CHUNK_SIZE', '2000')),
+        confirmations=int(os.getenv('INDEXER_CONFIRMATIONS', '0'))
+    )
+    if is_leader:
+        indexer.start(poll_interval=float(os.getenv('INDEXER_POLL_INTERVAL', '2.0')))
 
-def format_transfer(transfer_tuple):
-    """Format transfer information from contract tuple response"""
+# Optional Bloom filter of registered product keys (set PRODUCT_FILTER_ENABLED=true),
+# lets verify reject never-registered serials without an eth_call
+product_filter = None
+if os.getenv('PRODUCT_FILTER_ENABLED', '').lower() in ('1', 'true', 'yes'):
+    product_filter_poll_interval = float(os.getenv('PRODUCT_FILTER_POLL_INTERVAL', '1.0'))
+    product_filter = RegisteredProductFilter(
+        w3,
+        supply_chain,
+        os.getenv('PRODUCT_FILTER_PATH', 'product_filter.bloom'),
+        start_block=int(os.getenv('PRODUCT_FILTER_START_BLOCK', os.getenv('INDEXER_START_BLOCK', '0'))),
+        capacity=int(os.getenv('PRODUCT_FILTER_CAPACITY', '100000')),
+        error_rate=float(os.getenv('PRODUCT_FILTER_ERROR_RATE', '0.001')),
+        persist=is_leader,
+        head=chain_head,
+        max_staleness=float(os.getenv('PRODUCT_FILTER_MAX_STALENESS', '5.0')),
+        shared_cursor=SharedMarker(shared_state, 'product_filter') if shared_state else None
+    )
+    if is_leader:
+        product_filter.start(poll_interval=product_filter_poll_interval)
+
+def known_unregistered(product_id, serial_number):
+    """True when the product filter proves a product was never registered"""
+    return product_filter is not None and product_filter.definitely_absent(product_id, serial_number)
+
+def note_registered(registrations):
+    """Add products we just submitted to the filter so they aren't rejected before it syncs"""
+    if product_filter is not None:
+        for args in registrations:
+            product_filter.add(args[0], args[6])
+
+# Formatted /product/verify results keyed by (product_id, serial_number)
+verify_cache = TTLCache(
+    maxsize=int(os.getenv('VERIFY_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('VERIFY_CACHE_TTL', '30'))
+)
+
+def invalidate_on_transfer_event(event):
+    """Drop cached verify results as soon as any ProductTransferred event is seen"""
+    if event['event'] == 'ProductTransferred':
+        verify_cache.invalidate((event['product_id'], event['serial_number']))
+
+def follow_transfers():
+    """Start the event hub's log feed before a verify result is first cached
+
+    The cached entry must not predate the feed, or a transfer mined in
+    between would leave it stale until the TTL.
+    """
+    if verify_cache.ttl > 0:
+        event_hub.start()
+
+def invalidate_on_transfer_receipt(entry):
+    """Drop cached verify results when a transfer we submitted in async mode is mined"""
+    if entry.get('action') == 'transfer':
+        verify_cache.invalidate((entry['product_id'], entry['serial_number']))
+
+receipt_tracker.subscribe(invalidate_on_transfer_receipt)
+
+# Files the app creates at run time, kept next to app.py rather than in
+# whatever directory it was started from
+STATE_DIR = os.getenv('STATE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state'))
+
+# Verify as of a past block (?at_block= / ?at_time=). Blocks at least
+# HISTORICAL_FINALITY_DEPTH below the head can't be reorged, so their headers
+# are cached in memory and their results in the HISTORICAL_CACHE_DB SQLite
+# file, with no expiry. HISTORICAL_CACHE_DB= (empty) keeps results off disk
+HISTORICAL_FINALITY_DEPTH = int(os.getenv('HISTORICAL_FINALITY_DEPTH', '12'))
+HISTORICAL_CACHE_DB = os.getenv('HISTORICAL_CACHE_DB', os.path.join(STATE_DIR, 'historical_cache.sqlite3'))
+block_times = BlockTimeIndex(w3, finality_depth=HISTORICAL_FINALITY_DEPTH)
+historical_cache = None
+if HISTORICAL_CACHE_DB:
+    os.makedirs(os.path.dirname(os.path.abspath(HISTORICAL_CACHE_DB)), exist_ok=True)
+    historical_cache = HistoricalResultCache(HISTORICAL_CACHE_DB)
+
+# Identical contract reads already in flight are shared instead of repeated
+# (e.g. many handhelds verifying the same product as a shipment arrives)
+coalesced_reads = SingleFlight()
+
+def read_product_info(product_id, serial_number):
+    return coalesced_reads.do(
+        ('product_info', product_id, serial_number),
+        lambda: supply_chain.fetch_product_info(product_id, serial_number)
+    )
+
+def read_transfer_history(product_id, serial_number):
+    return coalesced_reads.do(
+        ('transfer_history', product_id, serial_number),
+        lambda: supply_chain.fetch_transfer_history(product_id, serial_number)
+    )
+
+def read_transfer_count(product_id, serial_number):
+    return coalesced_reads.do(
+        ('transfer_count', product_id, serial_number),
+        lambda: supply_chain.fetch_transfer_count(product_id, serial_number)
+    )
+
+def read_transfer_page(product_id, serial_number, offset, limit):
+    return coalesced_reads.do(
+        ('transfer_page', product_id, serial_number, offset, limit),
+        lambda: supply_chain.fetch_transfer_page(product_id, serial_number, offset, limit)
+    )
+
+def read_latest_transfer(product_id, serial_number):
+    return coalesced_reads.do(
+        ('latest_transfer', product_id, serial_number),
+        lambda: supply_chain.fetch_latest_transfer(product_id, serial_number)
+    )
+
+def read_block_number():
+    return coalesced_reads.do(('block_number',), chain_head.fetch)
+
+# Feed of registration/transfer events that keeps the verify cache current.
+# /events/stream itself is served by asgi_app.py, where an open stream
+# doesn't hold one of the worker's threads
+event_hub = EventHub(
+    w3,
+    supply_chain,
+    chunk_size=int(os.getenv('INDEXER_CHUNK_SIZE', '2000')),
+    poll_interval=float(os.getenv('STREAM_POLL_INTERVAL', '1.0'))
+)
+if not is_leader:
+    event_hub.follow_shared_log(SharedEventLog(shared_state))
+elif indexer is not None:
+    event_hub.attach_indexer(indexer)
+# Transfers made by other clients, processes or workers invalidate through the
+# hub's log feed; verify starts the hub before it first caches a result
+event_hub.listen(invalidate_on_transfer_event)
+if shared_state is not None and is_leader:
+    # The other workers' hubs follow the chain through this log
+    event_hub.listen(SharedEventLog(shared_state).append)
+    event_hub.start()
+
+# Gas price shared across requests until the chain head moves (FEE_MAX_AGE is
+# only used by asgi_app.py) and cached per-function gas estimates
+fee_oracle = FeeOracle(
+    w3,
+    mode=os.getenv('FEE_MODE', 'legacy'),
+    max_age=float(os.getenv('FEE_MAX_AGE', '2.0')),
+    head=chain_head
+)
+gas_estimator = GasEstimator(
+    w3,
+    margin=float(os.getenv('GAS_ESTIMATE_MARGIN', '0.2')),
+    ttl=float(os.getenv('GAS_ESTIMATE_TTL', '300'))
+)
+
+# Prometheus metrics served at /metrics
+metrics = MetricsRegistry()
+http_requests = metrics.counter(
+    'http_requests_total', 'HTTP requests by route, method and status', ('route', 'method', 'status')
+)
+http_latency = metrics.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route', ('route', 'method')
+)
+http_errors = metrics.counter(
+    'http_errors_total', 'Failed HTTP requests by route and error type', ('route', 'type')
+)
+rpc_latency = metrics.histogram(
+    'rpc_request_duration_seconds', 'JSON-RPC request latency by method', ('method',)
+)
+rpc_errors = metrics.counter(
+    'rpc_errors_total', 'Failed JSON-RPC requests by method and error type', ('method', 'type')
+)
+receipt_wait = metrics.histogram(
+    'receipt_wait_seconds', 'Time requests spent blocked in wait_for_transaction_receipt', ('action',)
+)
+tx_confirmation = metrics.histogram(
+    'tx_confirmation_seconds', 'Submit-to-resolution time of async transactions', ('action', 'state')
+)
+verify_phase = metrics.histogram(
+    'verify_phase_seconds', 'Time per phase of a live /product/verify read', ('phase',)
+)
+if rpc_pool is not None:
+    metrics.callback(
+        'rpc_endpoint_up', 'Whether each RPC endpoint passed its last health check',
+        lambda: [((e['uri'], e['role']), int(e['healthy'])) for e in rpc_pool.status()],
+        labelnames=('endpoint', 'role')
+    )
+    metrics.callback(
+        'rpc_endpoint_latency_seconds', 'Smoothed request latency per RPC endpoint',
+        lambda: [((e['uri'],), e['latency_ms'] / 1000 if e['latency_ms'] is not None else None)
+                 for e in rpc_pool.status()],
+        labelnames=('endpoint',)
+    )
+metrics.callback('pending_transactions', 'Async transactions waiting for a receipt', receipt_tracker.pending_count)
+metrics.callback(
+    'verify_cache_events_total', 'Verify cache lookups and removals by outcome',
+    lambda: [((event,), verify_cache.stats()[event])
+             for event in ('hits', 'misses', 'evictions', 'expirations', 'invalidations')],
+    metric_type='counter', labelnames=('event',)
+)
+metrics.callback('verify_cache_entries', 'Entries in the verify cache', lambda: verify_cache.stats()['size'])
+metrics.callback(
+    'contract_reads_total', 'Contract reads executed or coalesced into an identical read in flight',
+    lambda: [((kind, result), count)
+             for kind, counts in coalesced_reads.stats()['reads'].items()
+             for result, count in counts.items()],
+    metric_type='counter', labelnames=('read', 'result')
+)
+metrics.callback(
+    'fee_oracle_lookups_total', 'Fee lookups served from the shared price or refreshed from the node',
+    lambda: [(('hit',), fee_oracle.hits), (('refresh',), fee_oracle.refreshes)],
+    metric_type='counter', labelnames=('result',)
+)
+metrics.callback(
+    'gas_estimate_lookups_total', 'Gas limit lookups by cache outcome',
+    lambda: [(('hit',), gas_estimator.hits), (('miss',), gas_estimator.misses),
+             (('fallback',), gas_estimator.fallbacks)],
+    metric_type='counter', labelnames=('result',)
+)
+if product_filter is not None:
+    metrics.callback(
+        'product_filter_lookups_total', 'Verify lookups the product filter rejected or passed to the node',
+        lambda: [(('rejected',), product_filter.rejected), (('passed',), product_filter.passed)],
+        metric_type='counter', labelnames=('result',)
+    )
+if indexer is not None:
+    metrics.callback('indexer_last_block', 'Last block applied to the event index',
+                     lambda: indexer.last_indexed_block)
+
+w3.middleware_onion.add(rpc_metrics_middleware(rpc_latency, rpc_errors), 'metrics')
+
+# Each gunicorn worker only counts the requests it served. Workers publish
+# their counters and histograms every METRICS_PUBLISH_INTERVAL seconds, so
+# whichever one answers /metrics reports totals for all of them
+shared_metrics = None
+if shared_state is not None:
+    shared_metrics = SharedMetrics(
+        shared_state, metrics, interval=float(os.getenv('METRICS_PUBLISH_INTERVAL', '5'))
+    ).start()
+
+def observe_confirmation(entry):
+    """Record how long an async transaction took from submission to its receipt"""
+    elapsed = datetime.fromisoformat(entry['resolved_at']) - datetime.fromisoformat(entry['submitted_at'])
+    tx_confirmation.observe(elapsed.total_seconds(), entry.get('action', 'unknown'), entry['state'])
+
+receipt_tracker.subscribe(observe_confirmation)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    started = g.get('request_started')
+    if started is not None:
+        http_latency.observe(time.perf_counter() - started, route, request.method)
+    http_requests.inc(route, request.method, str(response.status_code))
+    if response.status_code >= 400:
+        http_errors.inc(route, str(response.status_code))
+    return response
+
+@app.teardown_request
+def record_request_exception(exc):
+    if exc is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_errors.inc(route, type(exc).__name__)
+
+def wait_for_receipt(tx_hash, action):
+    """wait_for_transaction_receipt, timed into receipt_wait_seconds"""
+    with receipt_wait.time(action):
+        return w3.eth.wait_for_transaction_receipt(tx_hash)
+
+# Opt-in profiling (PROFILING_ENABLED=true). Nothing below is registered otherwise,
+# so a disabled profiler costs nothing per request.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+# Profiles slow requests down and write to disk. With PROFILE_TOKEN set a request
+# must send it in X-Profile-Token; without it only loopback clients may profile.
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
+
+def profiling_allowed():
+    """Whether the current request may start a profile"""
+    if PROFILE_TOKEN:
+        sent = request.headers.get('X-Profile-Token', '')
+        return hmac.compare_digest(sent.encode(), PROFILE_TOKEN.encode())
+    return request.remote_addr in LOOPBACK_ADDRESSES
+
+def start_request_profile():
+    # X-Profile: pstats (also 1/true) or collapsed
+    mode = request.headers.get('X-Profile', '').lower()
+    if mode in ('1', 'true', 'yes'):
+        mode = 'pstats'
+    if mode not in PROFILE_FORMATS:
+        return
+    if not profiling_allowed():
+        g.profile_skipped = 'forbidden'
+        return
+    profiler = RequestProfiler(PROFILE_DIR, mode).start()
+    if profiler is None:
+        # Another request is being profiled; this one runs unprofiled
+        g.profile_skipped = 'busy'
+    else:
+        g.profiler = profiler
+
+def finish_request_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        path = profiler.finish(f'{request.method} {request.path}')
+        response.headers['X-Profile-File'] = path
+        app.logger.info(f"Wrote request profile {path}")
+    skipped = g.pop('profile_skipped', None)
+    if skipped is not None:
+        response.headers['X-Profile-Skipped'] = skipped
+    return response
+
+def discard_request_profile(exc):
+    # after_request doesn't run when the view raised, still stop the profiler
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.finish(f'{request.method} {request.path} failed')
+
+def profile_process():
+    """Sample every thread for ?seconds=N and return collapsed stacks"""
+    if not profiling_allowed():
+        return jsonify({'status': 'error', 'message': 'Profiling is not allowed for this client'}), 403
     try:
-        return {
-            'from': transfer_tuple[0],
-            'to': transfer_tuple[1],
-            'timestamp': datetime.fromtimestamp(transfer_tuple[2]).isoformat(),
-            'transfer_type': transfer_tuple[3]
-        }
-    except Exception as e:
-        app.logger.error(f"Error formatting transfer info: {e}")
-        return None
+        seconds = float(request.args.get('seconds', '10'))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'seconds must be a number'}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({
+            'status': 'error',
+            'message': f'seconds must be between 0 and {PROFILE_MAX_SECONDS}'
+        }), 400
+    counts = sample_process(seconds)
+    if counts is None:
+        return jsonify({'status': 'error', 'message': 'Another profile is already running'}), 409
+    path = profile_path(PROFILE_DIR, 'process', 'collapsed')
+    write_collapsed(path, counts)
+    body = ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+    return body, 200, {'Content-Type': 'text/plain; charset=utf-8', 'X-Profile-File': path}
+
+if PROFILING_ENABLED:
+    app.before_request(start_request_profile)
+    app.after_request(finish_request_profile)
+    app.teardown_request(discard_request_profile)
+    app.route('/debug/profile')(profile_process)
+
+# Products per registerProducts transaction on the v2 contract
+REGISTER_BATCH_SIZE = int(os.getenv('REGISTER_BATCH_SIZE', '100'))
+
+# Max transactions in flight during /product/ingest
+INGEST_WINDOW = int(os.getenv('INGEST_WINDOW', '64'))
+# Largest /product/ingest body. The whole file is registered inside one request
+# (and gunicorn's timeout), so bigger files go through the checkpointing CLI
+INGEST_MAX_BYTES = int(os.getenv('INGEST_MAX_BYTES', str(1024 * 1024)))
+
+# Largest transfer history page /product/verify returns for ?limit=
+VERIFY_PAGE_MAX = int(os.getenv('VERIFY_PAGE_MAX', '100'))
+
+# Seconds clients and CDNs may reuse a /product/verify response before
+# revalidating it with If-None-Match
+VERIFY_MAX_AGE = int(os.getenv('VERIFY_MAX_AGE', '0'))
+VERIFY_CACHE_CONTROL = f'public, max-age={VERIFY_MAX_AGE}, must-revalidate'
+# Results as of a finalized block never change
+HISTORICAL_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Upper bound on items accepted by /product/verify/bulk
+BULK_VERIFY_MAX_ITEMS = int(os.getenv('BULK_VERIFY_MAX_ITEMS', '1000'))
+
+# /audit/export reads products in groups of EXPORT_CHUNK_SIZE with at most
+# EXPORT_CONCURRENCY groups in flight, scanning registration logs
+# EXPORT_BLOCK_CHUNK blocks at a time from EXPORT_START_BLOCK
+EXPORT_START_BLOCK = int(os.getenv('EXPORT_START_BLOCK', os.getenv('INDEXER_START_BLOCK', '0')))
+EXPORT_BLOCK_CHUNK = int(os.getenv('EXPORT_BLOCK_CHUNK', os.getenv('INDEXER_CHUNK_SIZE', '2000')))
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '100'))
+EXPORT_CONCURRENCY = int(os.getenv('EXPORT_CONCURRENCY', '4'))
+
+# Nonce, fee and gas handling shared with the ingest command line tool
+transaction_sender = TransactionSender(w3, nonce_manager, fee_oracle, gas_estimator)
+
+def get_chain_id():
+    """Fetch the chain id once and reuse it for every transaction"""
+    return transaction_sender.chain_id()
+
+def send_contract_transaction(contract_function, sender_address, private_key):
+    """Build, sign and send a contract call using a locally managed nonce
+
+    private_key may be a raw key or a LocalAccount.
+    """
+    return transaction_sender.send(contract_function, sender_address, private_key)
+
+def send_as_account(contract_function, account):
+    return send_contract_transaction(contract_function, account.address, account)
+
+# Every registration (single, batch, ingest) is sent on this one lane, so the
+# manufacturer's transactions leave in nonce order whichever route sent them.
+# The manufacturer key is never offered to /product/transfer.
+manufacturer_lane = SignerLane(manufacturer_account, send_as_account)
+
+def send_as_manufacturer(contract_function):
+    """Queue a call on the manufacturer's lane and return its hash once sent"""
+    return manufacturer_lane.submit(contract_function).result()
+
+# Participant accounts decrypted once from KEYSTORE_DIR, each with its own
+# submission lane; a transfer has to present the signer's API token to use one
+signers = SignerRegistry(send_as_account)
+if os.getenv('KEYSTORE_DIR'):
+    keystore_password = os.getenv('KEYSTORE_PASSWORD')
+    if keystore_password is None and os.getenv('KEYSTORE_PASSWORD_FILE'):
+        with open(os.getenv('KEYSTORE_PASSWORD_FILE')) as f:
+            keystore_password = f.read().strip()
+    loaded = signers.load_keystore(os.getenv('KEYSTORE_DIR'), keystore_password or '')
+    app.logger.info(f"Loaded {loaded} signer(s) from {os.getenv('KEYSTORE_DIR')}")
+
+# Accounts the app signs with start with no ether on a fresh in-process chain
+if in_process_chain is not None:
+    for address in [manufacturer_account.address] + [signer['address'] for signer in signers.stats()]:
+        in_process_chain.fund(address)
+
+def wants_async():
+    """Check whether the client opted in to async mode (?async=true)"""
+    return request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+def accepted_response(tx_hash, action, **details):
+    """Hand the transaction to the receipt tracker and answer 202 right away"""
+    key = track_transaction(tx_hash, action=action, **details)
+    return jsonify({
+        'status': 'pending',
+        'transaction_hash': key,
+        'status_url': f'/tx/{key}'
+    }), 202
+
+audit_exporter = AuditExporter(
+    w3,
+    supply_chain,
+    format_product_info,
+    format_transfer,
+    start_block=EXPORT_START_BLOCK,
+    block_chunk=EXPORT_BLOCK_CHUNK,
+    chunk_size=EXPORT_CHUNK_SIZE,
+    concurrency=EXPORT_CONCURRENCY
+)
+
+@app.route('/health/live')
+def liveness_check():
+    """The process is up and serving; never touches the node"""
+    return jsonify({'status': 'alive'})
 
 @app.route('/health')
 def health_check():
+    """Readiness: 200 once the node answers, 503 while it can't be reached"""
+    try:
+        current_block = read_block_number()
+    except Exception as e:
+        app.logger.warning(f"Health check could not reach the node: {e}")
+        current_block = None
+    ready = node.ready and current_block is not None
     return jsonify({
-        'status': 'healthy',
-        'blockchain_connected': w3.is_connected(),
-        'current_block': w3.eth.block_number,
-        'contract_address': CONTRACT_ADDRESS
-    })
+        'status': 'healthy' if ready else 'unavailable',
+        'live': True,
+        'ready': ready,
+        'blockchain_connected': ready,
+        'current_block': current_block,
+        'contract_address': CONTRACT_ADDRESS,
+        'contract_version': supply_chain.version,
+        'node': node.status(),
+        'rpc_endpoints': rpc_pool.status() if rpc_pool is not None else []
+    }), 200 if ready else 503
 
 @app.route('/product/register', methods=['POST'])
 def register_product():
     try:
         data = request.get_json()
         
-        # Get transaction sender address
-        sender_address = w3.eth.accounts[0]
-        
-        # Build transaction
-        nonce = w3.eth.get_transaction_count(sender_address)
+        # Sign and send transaction on the manufacturer's lane
+        args = registration_args(data)
+        tx_hash = send_as_manufacturer(supply_chain.register_product(*args))
+        note_registered([args])
         
-        tx = contract.functions.registerProduct(
-            data['product_id'],
-            data['manufacturer'],
-            data['batch_number'],
-            int(datetime.strptime(data['manufacture_date'], '%Y-%m-%d').timestamp()),
-            int(datetime.strptime(data['expiry_date'], '%Y-%m-%d').timestamp()),
-            data['gtin'],
-            data['serial_number']
-        ).build_transaction({
-            'from': sender_address,
-            'gas': 2000000,
-            'gasPrice': w3.eth.gas_price,
-            'nonce': nonce,
-        })
-        
-        # Sign and send transaction
-        private_key = os.getenv('PRIVATE_KEY')
-        if not private_key:
-            # Use the first account's private key from Ganache for testing
-            private_key = w3.eth.account.from_key(os.getenv('PRIVATE_KEY', '0xef704a92be65bc0102ebb7b19418dc0a9b14ca7bd2ab01ff5aa0edd72d4fbfef'))
-            
-        signed_tx = w3.eth.account.sign_transaction(tx, private_key=private_key)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        if wants_async():
+            return accepted_response(tx_hash, 'register')
         
         # Wait for transaction receipt
-        tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        tx_receipt = wait_for_receipt(tx_hash, 'register')
         
         return jsonify({
             'status': 'success',
@@ -119,6 +643,92 @@ def register_product():
         app.logger.error(f"Error in register_product: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
+@app.route('/product/register/batch', methods=['POST'])
+def register_products_batch():
+    try:
+        data = request.get_json()
+        products = data.get('products') if isinstance(data, dict) else data
+        if not isinstance(products, list) or not products:
+            return jsonify({
+                'status': 'error',
+                'message': 'Request must contain a non-empty list of products'
+            }), 400
+        args = [registration_args(product) for product in products]
+
+        # v2 registers a whole chunk in one transaction, v1 pipelines one transaction per product
+        if supply_chain.version >= 2:
+            calls = [
+                supply_chain.register_products(args[i:i + REGISTER_BATCH_SIZE])
+                for i in range(0, len(args), REGISTER_BATCH_SIZE)
+            ]
+        else:
+            calls = [supply_chain.register_product(*a) for a in args]
+
+        # Queued together so the lane signs them back to back
+        futures = [manufacturer_lane.submit(call) for call in calls]
+        tx_hashes = [future.result() for future in futures]
+        note_registered(args)
+
+        if wants_async():
+            keys = [track_transaction(h, action='register_batch') for h in tx_hashes]
+            return jsonify({
+                'status': 'pending',
+                'transaction_hashes': keys,
+                'products': len(products)
+            }), 202
+
+        receipts = [wait_for_receipt(h, 'register_batch') for h in tx_hashes]
+        return jsonify({
+            'status': 'success' if all(r['status'] == 1 for r in receipts) else 'error',
+            'products': len(products),
+            'transactions': [
+                {
+                    'transaction_hash': h.hex(),
+                    'block_number': r['blockNumber'],
+                    'gas_used': r['gasUsed'],
+                    'succeeded': r['status'] == 1
+                }
+                for h, r in zip(tx_hashes, receipts)
+            ]
+        })
+
+    except Exception as e:
+        app.logger.error(f"Error in register_products_batch: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/product/ingest', methods=['POST'])
+def ingest_products():
+    """Stream a CSV (text/csv) or NDJSON body straight into batched registrations"""
+    if request.content_length is None or request.content_length > INGEST_MAX_BYTES:
+        return jsonify({
+            'status': 'error',
+            'message': f'Request body must have a Content-Length of at most {INGEST_MAX_BYTES} bytes; '
+                       'use python ingest.py for larger files'
+        }), 413
+    try:
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        ingestor = Ingestor(
+            w3,
+            supply_chain,
+            send_as_manufacturer,
+            window=int(request.args.get('window', INGEST_WINDOW)),
+            batch_size=REGISTER_BATCH_SIZE,
+            strict_gtin=request.args.get('strict_gtin', '').lower() in ('1', 'true', 'yes'),
+            on_submit=note_registered
+        )
+        report = ingestor.run(read_rows(stream, fmt))
+        return jsonify({'status': 'success', 'report': report})
+
+    except Exception as e:
+        app.logger.error(f"Error in ingest_products: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+def request_token():
+    """Bearer token from the Authorization header, or None"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else None
+
 @app.route('/product/transfer', methods=['POST'])
 def transfer_product():
     try:
@@ -133,7 +743,20 @@ def transfer_product():
 
         # Validate required fields
         required_fields = ['product_id', 'serial_number', 'new_owner', 
-                         'transfer_type', 'sender_address', 'private_key']
+                         'transfer_type', 'sender_address']
+        # Senders held in the signer registry (by address or name) send the signer's
+        # API token instead of a key; the server key is only used once it checks out
+        signer = None
+        if 'private_key' not in data and signers.account(data.get('sender_address', '')) is not None:
+            signer = signers.authenticate(data['sender_address'], request_token())
+            if signer is None:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'A valid API token for this signer is required (Authorization: Bearer <token>)'
+                }), 401
+            data['sender_address'] = signer.address
+        else:
+            required_fields.append('private_key')
         missing_fields = [field for field in required_fields if field not in data]
         
         if missing_fields:
@@ -158,11 +781,12 @@ def transfer_product():
                 'message': 'Invalid new owner address format'
             }), 400
 
-        # Validate private key format
+        # Validate private key format, keeping the derived account for signing
         try:
-            if not data['private_key'].startswith('0x'):
-                data['private_key'] = '0x' + data['private_key']
-            w3.eth.account.from_key(data['private_key'])
+            if signer is None:
+                if not data['private_key'].startswith('0x'):
+                    data['private_key'] = '0x' + data['private_key']
+                sender_account = w3.eth.account.from_key(data['private_key'])
         except Exception as e:
             app.logger.error(f"Invalid private key format: {str(e)}")
             return jsonify({
@@ -170,12 +794,14 @@ def transfer_product():
                 'message': 'Invalid private key format'
             }), 400
 
-        # Check if product exists
+        # Check if product exists, skipping the node for serials the filter rules out
+        if known_unregistered(data['product_id'], data['serial_number']):
+            return jsonify({
+                'status': 'error',
+                'message': 'Product does not exist or error checking product'
+            }), 404
         try:
-            product_info = contract.functions.getProductInfo(
-                data['product_id'], 
-                data['serial_number']
-            ).call()
+            product_info = read_product_info(data['product_id'], data['serial_number'])
         except Exception as e:
             app.logger.error(f"Error checking product existence: {str(e)}")
             return jsonify({
@@ -193,26 +819,35 @@ def transfer_product():
 
         # Build the transaction
         try:
-            nonce = w3.eth.get_transaction_count(data['sender_address'])
-            
-            tx = contract.functions.transferProduct(
+            call = supply_chain.transfer_product(
                 data['product_id'],
                 data['serial_number'],
                 data['new_owner'],
                 data['transfer_type']
-            ).build_transaction({
-                'from': data['sender_address'],
-                'gas': 2000000,
-                'gasPrice': w3.eth.gas_price,
-                'nonce': nonce,
-            })
+            )
+            if signer is not None:
+                tx_hash = signers.send(signer.address, call)
+            else:
+                tx_hash = send_contract_transaction(
+                    call,
+                    w3.to_checksum_address(data['sender_address']),
+                    sender_account
+                )
             
-            # Sign and send the transaction
-            signed_tx = w3.eth.account.sign_transaction(tx, private_key=data['private_key'])
-            tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            cache_key = (data['product_id'], data['serial_number'])
+            verify_cache.invalidate(cache_key)
+            
+            if wants_async():
+                app.logger.info(f"Transfer submitted. Transaction hash: {tx_hash.hex()}")
+                return accepted_response(
+                    tx_hash, 'transfer',
+                    product_id=data['product_id'],
+                    serial_number=data['serial_number']
+                )
             
             # Wait for transaction receipt
-            tx_receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+            tx_receipt = wait_for_receipt(tx_hash, 'transfer')
+            verify_cache.invalidate(cache_key)
             
             app.logger.info(f"Transfer successful. Transaction hash: {tx_hash.hex()}")
             return jsonify({
@@ -235,13 +870,576 @@ def transfer_product():
             'message': f'Unexpected error: {str(e)}'
         }), 500
 
+@app.route('/tx/<tx_hash>')
+def transaction_status(tx_hash):
+    try:
+        tracked = receipt_tracker.status(tx_hash)
+        if not tracked and tx_log is not None:
+            tracked = tx_log.status(normalize_hash(tx_hash))
+        if tracked:
+            return jsonify({'status': 'success', 'transaction': tracked})
+
+        # Not submitted by this process (or already forgotten), ask the node directly
+        key = normalize_hash(tx_hash)
+        try:
+            receipt = w3.eth.get_transaction_receipt(key)
+        except TransactionNotFound:
+            try:
+                w3.eth.get_transaction(key)
+            except TransactionNotFound:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Transaction not found'
+                }), 404
+            return jsonify({
+                'status': 'success',
+                'transaction': {'transaction_hash': key, 'state': 'pending', 'block_number': None}
+            })
+
+        return jsonify({
+            'status': 'success',
+            'transaction': {
+                'transaction_hash': key,
+                'state': 'mined' if receipt['status'] == 1 else 'failed',
+                'block_number': receipt['blockNumber'],
+                'gas_used': receipt['gasUsed']
+            }
+        })
+
+    except Exception as e:
+        app.logger.error(f"Error in transaction_status: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+def indexer_unavailable():
+    return jsonify({
+        'status': 'error',
+        'message': 'Event indexer is not enabled (set INDEXER_ENABLED=true)'
+    }), 503
+
+def indexed_products_response(product_tuples):
+    """Format a list of indexed products together with the projection's staleness marker"""
+    products = [format_product_info(p) for p in product_tuples]
+    return jsonify({
+        'status': 'success',
+        'products': [p for p in products if p is not None],
+        'indexed_block': indexer.last_indexed_block
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    body = shared_metrics.render() if shared_metrics is not None else metrics.render()
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/signers')
+def signer_stats():
+    """Registered signer accounts and their submission lanes (never the keys)"""
+    return jsonify({
+        'status': 'success',
+        'manufacturer': manufacturer_lane.stats(),
+        'signers': signers.stats()
+    })
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify({
+        'status': 'success',
+        'verify_cache': verify_cache.stats(),
+        'coalesced_reads': coalesced_reads.stats(),
+        'historical_cache': historical_cache.stats() if historical_cache is not None else None,
+        'block_headers': block_times.stats()
+    })
+
+@app.route('/gas/stats')
+def gas_stats():
+    return jsonify({
+        'status': 'success',
+        'fees': fee_oracle.stats(),
+        'gas_estimates': gas_estimator.stats()
+    })
+
+@app.route('/product-filter/status')
+def product_filter_status():
+    if product_filter is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Product filter is disabled, set PRODUCT_FILTER_ENABLED=true'
+        }), 503
+    return jsonify({'status': 'success', 'product_filter': product_filter.stats()})
+
+@app.route('/indexer/status')
+def indexer_status():
+    if indexer is None:
+        return indexer_unavailable()
+    return jsonify({'status': 'success', 'indexer': indexer.status()})
+
+@app.route('/batch/<batch_number>/products')
+def batch_products(batch_number):
+    if indexer is None:
+        return indexer_unavailable()
+    try:
+        return indexed_products_response(indexer.products_in_batch(batch_number))
+    except Exception as e:
+        app.logger.error(f"Error in batch_products: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/owner/<address>/products')
+def owner_products(address):
+    if indexer is None:
+        return indexer_unavailable()
+    if not w3.is_address(address):
+        return jsonify({
+            'status': 'error',
+            'message': 'Invalid owner address format'
+        }), 400
+    try:
+        return indexed_products_response(indexer.products_owned_by(address))
+    except Exception as e:
+        app.logger.error(f"Error in owner_products: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/audit/export')
+def audit_export():
+    """Stream every registered product with its transfer history as NDJSON
+
+    Filters: from/to (registration date, YYYY-MM-DD), manufacturer,
+    batch_number. ?cursor= resumes after a record; ?gzip=true compresses.
+    """
+    try:
+        filters = {
+            'since': parse_date(request.args['from']) if request.args.get('from') else None,
+            'until': parse_date(request.args['to'], end_of_day=True) if request.args.get('to') else None,
+            'manufacturer': request.args.get('manufacturer'),
+            'batch_number': request.args.get('batch_number'),
+        }
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'from and to must be YYYY-MM-DD dates'}), 400
+    after = None
+    if request.args.get('cursor'):
+        cursor = parse_cursor(request.args['cursor'])
+        if cursor is None:
+            return jsonify({'status': 'error', 'message': 'cursor must be snapshot:block:logIndex'}), 400
+        snapshot, after = cursor[0], cursor[1:]
+    else:
+        try:
+            snapshot = w3.eth.block_number
+        except Exception as e:
+            app.logger.error(f"Error in audit_export: {e}")
+            return jsonify({'status': 'error', 'message': str(e)}), 503
+
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    headers = {'X-Export-Snapshot-Block': str(snapshot), 'X-Accel-Buffering': 'no'}
+    if compress:
+        headers['Content-Disposition'] = f'attachment; filename="audit-{snapshot}.ndjson.gz"'
+    return app.response_class(
+        audit_exporter.ndjson(snapshot, after, compress=compress, **filters),
+        mimetype='application/gzip' if compress else 'application/x-ndjson',
+        headers=headers
+    )
+
+@app.route('/product/verify/bulk', methods=['POST'])
+def verify_products_bulk():
+    try:
+        started = time.perf_counter()
+        data = request.get_json()
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                'status': 'error',
+                'message': 'Request must contain a non-empty list of items'
+            }), 400
+        if len(items) > BULK_VERIFY_MAX_ITEMS:
+            return jsonify({
+                'status': 'error',
+                'message': f'At most {BULK_VERIFY_MAX_ITEMS} items per request'
+            }), 400
+
+        follow_transfers()
+        results = [None] * len(items)
+        to_fetch = []
+        calls = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or 'product_id' not in item or 'serial_number' not in item:
+                results[index] = {'status': 'error', 'message': 'Item must have product_id and serial_number'}
+                continue
+            if not isinstance(item['product_id'], str) or not isinstance(item['serial_number'], str):
+                results[index] = {'status': 'error', 'message': 'product_id and serial_number must be strings'}
+                continue
+            key = (item['product_id'], item['serial_number'])
+            try:
+                # v2 ids are bytes32, so an over-long one is this item's error, not the request's
+                supply_chain.product_key(*key)
+            except ValueError as e:
+                results[index] = {'status': 'error', 'message': str(e)}
+                continue
+            if known_unregistered(*key):
+                results[index] = {'status': 'error', 'message': 'Product does not exist', 'source': 'filter'}
+                continue
+            cached = verify_cache.get(key)
+            if cached is not None:
+                results[index] = {
+                    'status': 'success',
+                    'product_info': cached[0],
+                    'transfer_history': cached[1]
+                }
+                continue
+            to_fetch.append((index, key))
+            calls.append(supply_chain.get_product_info(*key))
+            calls.append(supply_chain.get_transfer_history(*key))
+
+        # Both reads for every uncached item go out together in JSON-RPC batches.
+        # Raw batches bypass the web3 middleware, so time them here
+        with rpc_latency.time('eth_call_batch'):
+            call_results, rpc_requests = batch_call(w3, calls)
+
+        for position, (index, key) in enumerate(to_fetch):
+            product_info = call_results[2 * position]
+            transfer_history = call_results[2 * position + 1]
+            if isinstance(product_info, Exception):
+                results[index] = {'status': 'error', 'message': str(product_info)}
+                continue
+            if isinstance(transfer_history, Exception):
+                results[index] = {'status': 'error', 'message': str(transfer_history)}
+                continue
+            formatted_product = format_product_info(supply_chain.decode_product_info(product_info))
+            if not formatted_product:
+                results[index] = {'status': 'error', 'message': 'Error formatting product information'}
+                continue
+            transfer_history = supply_chain.decode_transfer_history(transfer_history)
+            formatted_transfers = [format_transfer(t) for t in transfer_history]
+            formatted_transfers = [t for t in formatted_transfers if t is not None]
+            verify_cache.set(key, (formatted_product, formatted_transfers, len(transfer_history)))
+            results[index] = {
+                'status': 'success',
+                'product_info': formatted_product,
+                'transfer_history': formatted_transfers
+            }
+
+        for item, result in zip(items, results):
+            if isinstance(item, dict):
+                result['product_id'] = item.get('product_id')
+                result['serial_number'] = item.get('serial_number')
+
+        return jsonify({
+            'status': 'success',
+            'results': results,
+            'summary': {
+                'total': len(items),
+                'verified': sum(1 for r in results if r['status'] == 'success'),
+                'errors': sum(1 for r in results if r['status'] == 'error'),
+                'cache_hits': len(items) - len(to_fetch),
+                'rpc_requests': rpc_requests,
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+            }
+        })
+
+    except Exception as e:
+        app.logger.error(f"Error in verify_products_bulk: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+def history_request():
+    """Parse ?latest=true or ?limit=&cursor= into 'latest', (offset, limit), or None for everything"""
+    if request.args.get('latest', '').lower() in ('1', 'true', 'yes'):
+        return 'latest'
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        return None
+    try:
+        limit = int(request.args.get('limit', VERIFY_PAGE_MAX))
+        offset = int(request.args.get('cursor') or 0)
+    except ValueError:
+        raise ValueError('limit and cursor must be integers')
+    if not 1 <= limit <= VERIFY_PAGE_MAX:
+        raise ValueError(f'limit must be between 1 and {VERIFY_PAGE_MAX}')
+    if offset < 0:
+        raise ValueError('cursor must not be negative')
+    return offset, limit
+
+def history_page_response(product_tuple, transfers, total, history_view, **extra):
+    """Verify response carrying one page (or just the latest entry) of the transfer history"""
+    formatted_product = format_product_info(product_tuple)
+    if not formatted_product:
+        return jsonify({
+            'status': 'error',
+            'message': 'Error formatting product information'
+        }), 400
+    formatted_transfers = [format_transfer(t) for t in transfers]
+    if history_view == 'latest':
+        pagination = {'total': total, 'latest_only': True}
+    else:
+        offset, limit = history_view
+        end = offset + len(transfers)
+        pagination = {
+            'total': total,
+            'limit': limit,
+            'cursor': str(offset),
+            'next_cursor': str(end) if end < total else None
+        }
+    return jsonify({
+        'status': 'success',
+        'product_info': formatted_product,
+        'transfer_history': [t for t in formatted_transfers if t is not None],
+        'pagination': pagination,
+        **extra
+    })
+
+def verify_etag(product_id, serial_number, transfer_count, history_view, source='chain', block_hash=None):
+    """ETag of a verify response, which only changes when a transfer is added
+
+    Product fields are fixed at registration and the history is append-only,
+    so the contract, product key and transfer count identify the product's
+    state. The history view and source are included because they change the body.
+    block_hash pins the ETag of a historical response to the block it was read at.
+    """
+    if history_view is None:
+        view = 'full'
+    elif history_view == 'latest':
+        view = 'latest'
+    else:
+        view = '{}+{}'.format(*history_view)
+    key = bytes(supply_chain.product_key(product_id, serial_number)).hex()
+    digest = hashlib.blake2b(
+        f'{supply_chain.contract.address}:{key}:{view}:{source}:{block_hash or "latest"}'.encode(),
+        digest_size=8
+    ).hexdigest()
+    return f'{digest}-{transfer_count}'
+
+def not_modified(etag, weak=False):
+    response = app.response_class(status=304)
+    response.set_etag(etag, weak=weak)
+    response.headers['Cache-Control'] = VERIFY_CACHE_CONTROL
+    return response
+
+def conditional_verify(response, etag, weak=False):
+    """Tag a successful verify response, or answer 304 if the client already has it
+
+    Index responses carry indexed_block, which moves with every block, so
+    their ETags are weak.
+    """
+    response = make_response(response)
+    if response.status_code != 200:
+        return response
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag, weak)
+    response.set_etag(etag, weak=weak)
+    response.headers['Cache-Control'] = VERIFY_CACHE_CONTROL
+    return response
+
+def verify_not_modified(product_id, serial_number, history_view):
+    """Answer If-None-Match from the transfer count alone, before building the response
+
+    Returns a 304 response when the client's copy is current, otherwise None.
+    """
+    if not request.if_none_match:
+        return None
+    if indexer is not None and request.args.get('source') != 'chain':
+        count = indexer.get_transfer_count(product_id, serial_number)
+        if count is not None:
+            etag = verify_etag(product_id, serial_number, count, history_view, 'index')
+            return not_modified(etag, weak=True) if request.if_none_match.contains_weak(etag) else None
+    if history_view is None:
+        cached = verify_cache.get((product_id, serial_number))
+        if cached is not None:
+            count = cached[2]
+        elif supply_chain.history_paging:
+            with verify_phase.time('transfer_count'):
+                count = read_transfer_count(product_id, serial_number)
+        else:
+            # Without getTransferCount the count costs a full history read
+            return None
+    elif supply_chain.history_paging:
+        with verify_phase.time('transfer_count'):
+            count = read_transfer_count(product_id, serial_number)
+    else:
+        return None
+    etag = verify_etag(product_id, serial_number, count, history_view)
+    return not_modified(etag) if request.if_none_match.contains_weak(etag) else None
+
+def verify_product_page(product_id, serial_number, history_view):
+    """Verify reading a bounded part of the history, so cost doesn't grow with it"""
+    if indexer is not None and request.args.get('source') != 'chain':
+        product_info = indexer.get_product_info(product_id, serial_number)
+        if product_info is not None:
+            if history_view == 'latest':
+                latest, total = indexer.get_latest_transfer(product_id, serial_number)
+                transfers = [latest] if latest else []
+            else:
+                transfers, total = indexer.get_transfer_page(product_id, serial_number, *history_view)
+            return conditional_verify(
+                history_page_response(
+                    product_info, transfers, total, history_view,
+                    source='index', indexed_block=indexer.last_indexed_block
+                ),
+                verify_etag(product_id, serial_number, total, history_view, 'index'),
+                weak=True
+            )
+
+    with verify_phase.time('product_info'):
+        product_info = read_product_info(product_id, serial_number)
+    with verify_phase.time('transfer_page'):
+        if history_view == 'latest':
+            latest, total = read_latest_transfer(product_id, serial_number)
+            transfers = [latest] if latest else []
+        else:
+            transfers, total = read_transfer_page(product_id, serial_number, *history_view)
+    return conditional_verify(
+        history_page_response(product_info, transfers, total, history_view),
+        verify_etag(product_id, serial_number, total, history_view)
+    )
+
+def historical_block():
+    """Header of the block named by ?at_block= or ?at_time=, and whether it is finalized
+
+    at_time is a unix timestamp or an ISO 8601 date/time and resolves to the
+    last block mined at or before it.
+    """
+    if 'at_block' in request.args and 'at_time' in request.args:
+        raise ValueError('Pass either at_block or at_time, not both')
+    head = read_block_number()
+    if 'at_block' in request.args:
+        try:
+            number = int(request.args['at_block'])
+        except ValueError:
+            raise ValueError('at_block must be an integer')
+        if not 0 <= number <= head:
+            raise ValueError(f'at_block must be between 0 and {head}')
+    else:
+        value = request.args['at_time']
+        try:
+            timestamp = int(value)
+        except ValueError:
+            try:
+                timestamp = int(datetime.fromisoformat(value).timestamp())
+            except ValueError:
+                raise ValueError('at_time must be a unix timestamp or an ISO 8601 date/time')
+        number = block_times.block_at(timestamp, head)
+        if number is None:
+            raise ValueError('at_time is before the first block')
+    return block_times.header(number, head), block_times.is_final(number, head)
+
+def verify_product_at(product_id, serial_number):
+    """Verify with both contract reads pinned to a past block
+
+    Results at finalized blocks are kept in historical_cache, so repeating
+    an audit query never reaches the node again.
+    """
+    if history_request() is not None:
+        raise ValueError('at_block and at_time return the full history; drop latest, limit and cursor')
+    header, finalized = historical_block()
+
+    contract_address = supply_chain.contract.address
+    cached = None
+    if finalized and historical_cache is not None:
+        cached = historical_cache.get(contract_address, header['hash'], product_id, serial_number)
+    if cached is not None:
+        formatted_product, formatted_transfers, transfer_count = cached
+        source = 'historical_cache'
+    else:
+        with verify_phase.time('product_info'):
+            product_info = supply_chain.fetch_product_info(product_id, serial_number, header['number'])
+        with verify_phase.time('transfer_history'):
+            transfer_history = supply_chain.fetch_transfer_history(product_id, serial_number, header['number'])
+        with verify_phase.time('format'):
+            formatted_product = format_product_info(product_info)
+            formatted_transfers = [format_transfer(t) for t in transfer_history]
+        if not formatted_product:
+            return jsonify({
+                'status': 'error',
+                'message': 'Error formatting product information'
+            }), 400
+        formatted_transfers = [t for t in formatted_transfers if t is not None]
+        transfer_count = len(transfer_history)
+        if finalized and historical_cache is not None:
+            historical_cache.set(
+                contract_address, header['hash'], product_id, serial_number,
+                formatted_product, formatted_transfers, transfer_count
+            )
+        source = 'chain'
+
+    response = conditional_verify(
+        jsonify({
+            'status': 'success',
+            'product_info': formatted_product,
+            'transfer_history': formatted_transfers,
+            'at_block': header['number'],
+            'block_hash': header['hash'],
+            'block_timestamp': datetime.fromtimestamp(header['timestamp']).isoformat(),
+            'finalized': finalized,
+            'source': source
+        }),
+        verify_etag(product_id, serial_number, transfer_count, None, block_hash=header['hash'])
+    )
+    if finalized:
+        response.headers['Cache-Control'] = HISTORICAL_CACHE_CONTROL
+    return response
+
 @app.route('/product/verify/<product_id>/<serial_number>')
 def verify_product(product_id, serial_number):
+    response = make_response(verify_product_response(product_id, serial_number))
+    if 'Cache-Control' not in response.headers:
+        # Errors (unknown serials, node failures) must not be reused by clients or the CDN
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def verify_product_response(product_id, serial_number):
     try:
+        # Never-registered serials (counterfeits, mistyped scans) are answered without the node
+        if known_unregistered(product_id, serial_number):
+            return jsonify({
+                'status': 'error',
+                'message': 'Product does not exist',
+                'source': 'filter'
+            }), 400
+
+        if 'at_block' in request.args or 'at_time' in request.args:
+            return verify_product_at(product_id, serial_number)
+
+        # ?latest=true or ?limit=&cursor= read only part of the history (not cached)
+        history_view = history_request()
+
+        # Repeat scans of an unchanged product cost one count lookup and an empty 304
+        unchanged = verify_not_modified(product_id, serial_number, history_view)
+        if unchanged is not None:
+            return unchanged
+
+        if history_view is not None:
+            return verify_product_page(product_id, serial_number, history_view)
+
+        # Serve from the event projection when available, ?source=chain forces a live read
+        if indexer is not None and request.args.get('source') != 'chain':
+            indexed = indexer.get_product(product_id, serial_number)
+            if indexed is not None:
+                product_info, transfer_history = indexed
+                formatted_transfers = [format_transfer(t) for t in transfer_history]
+                return conditional_verify(
+                    jsonify({
+                        'status': 'success',
+                        'product_info': format_product_info(product_info),
+                        'transfer_history': [t for t in formatted_transfers if t is not None],
+                        'source': 'index',
+                        'indexed_block': indexer.last_indexed_block
+                    }),
+                    verify_etag(product_id, serial_number, len(transfer_history), None, 'index'),
+                    weak=True
+                )
+
+        follow_transfers()
+        cache_key = (product_id, serial_number)
+        cached = verify_cache.get(cache_key)
+        if cached is not None:
+            formatted_product, formatted_transfers, transfer_count = cached
+            return conditional_verify(
+                jsonify({
+                    'status': 'success',
+                    'product_info': formatted_product,
+                    'transfer_history': formatted_transfers
+                }),
+                verify_etag(product_id, serial_number, transfer_count, None)
+            )
+
         # Get product info from contract
-        product_info = contract.functions.getProductInfo(product_id, serial_number).call()
-        print(product_info)
-        formatted_product = format_product_info(product_info)
+        with verify_phase.time('product_info'):
+            product_info = read_product_info(product_id, serial_number)
+        with verify_phase.time('format'):
+            formatted_product = format_product_info(product_info)
         
         if not formatted_product:
             return jsonify({
@@ -250,20 +1448,26 @@ def verify_product(product_id, serial_number):
             }), 400
 
         # Get transfer history from contract
-        transfer_history = contract.functions.getTransferHistory(product_id, serial_number).call()
-        print(transfer_history)
-        formatted_transfers = [
-            format_transfer(transfer) for transfer in transfer_history
-        ]
+        with verify_phase.time('transfer_history'):
+            transfer_history = read_transfer_history(product_id, serial_number)
+        with verify_phase.time('format'):
+            formatted_transfers = [
+                format_transfer(transfer) for transfer in transfer_history
+            ]
         
         # Remove any None values from failed transfer formatting
         formatted_transfers = [t for t in formatted_transfers if t is not None]
+        # ETags count transfers on chain, as getTransferCount does, not the formatted ones
+        verify_cache.set(cache_key, (formatted_product, formatted_transfers, len(transfer_history)))
         
-        return jsonify({
-            'status': 'success',
-            'product_info': formatted_product,
-            'transfer_history': formatted_transfers
-        })
+        return conditional_verify(
+            jsonify({
+                'status': 'success',
+                'product_info': formatted_product,
+                'transfer_history': formatted_transfers
+            }),
+            verify_etag(product_id, serial_number, len(transfer_history), None)
+        )
         
     except Exception as e:
         app.logger.error(f"Error in verify_product: {e}")
@@ -0,0 +1,127 @@
+# app_common.py
+"""Pieces shared by the Flask app (app.py) and the ASGI app (asgi_app.py)
+
+Importing this module has no side effects: it doesn't connect to a node,
+start threads or create files, so either app can use it without pulling
+in the other.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+
+from web3 import HTTPProvider, Web3
+
+from compile_contracts import missing_functions
+from contract_artifacts import load_contract_artifact, prebuild_functions
+from contract_versions import supply_chain_for
+
+logger = logging.getLogger(__name__)
+
+# Account used to sign product registrations (defaults to the first Ganache account)
+MANUFACTURER_PRIVATE_KEY = os.getenv('PRIVATE_KEY', '0xef704a92be65bc0102ebb7b19418dc0a9b14ca7bd2ab01ff5aa0edd72d4fbfef')
+
+
+def contract_names():
+    # Prefer the gas-optimized v2 contract when it has been migrated;
+    # CONTRACT_NAME=PharmaSupplyChain pins the original one
+    if os.getenv('CONTRACT_NAME'):
+        return [os.getenv('CONTRACT_NAME')]
+    return ['PharmaSupplyChainV2', 'PharmaSupplyChain']
+
+
+def find_contract_artifact(abi_cache_dir):
+    """Path of the first migrated truffle artifact"""
+    for name in contract_names():
+        path = Path(f'build/contracts/{name}.json')
+        if path.exists() and load_contract_artifact(path, abi_cache_dir)['networks']:
+            return path
+    raise FileNotFoundError(
+        "Contract JSON not found. Please ensure you have run 'truffle migrate' successfully"
+    )
+
+
+def find_deployable_artifact():
+    """Compiled artifact to deploy on the in-process chain; migrated or not"""
+    for name in contract_names():
+        for directory in ('build/contracts', Path(__file__).parent / 'bin/contracts'):
+            path = Path(directory) / f'{name}.json'
+            if path.exists():
+                with open(path) as f:
+                    if json.load(f).get('bytecode', '0x') in ('', '0x'):
+                        continue
+                missing = missing_functions(name, path)
+                if missing:
+                    logger.warning(
+                        f"{path} predates contracts/{name}.sol (no {', '.join(sorted(missing))}); "
+                        "rebuild it with 'python compile_contracts.py'"
+                    )
+                return path
+    raise FileNotFoundError(
+        "No compiled contract artifact with bytecode found in build/contracts or bin/contracts"
+    )
+
+
+def deployed_address(contract_json):
+    """Address of the most recent deployment in an artifact"""
+    return contract_json['networks'][list(contract_json['networks'].keys())[-1]]['address']
+
+
+def connect_supply_chain():
+    """Web3 on RPC_URL and the migrated contract, for the command-line tools
+
+    ingest.py and audit_export.py use this instead of importing app.py,
+    which would also start the API's node pool, indexer, event feed and
+    background threads.
+    """
+    abi_cache_dir = os.getenv('ABI_CACHE_DIR', 'build/abi_cache')
+    contract_json = load_contract_artifact(find_contract_artifact(abi_cache_dir), abi_cache_dir)
+    w3 = Web3(HTTPProvider(os.getenv('RPC_URL', 'http://127.0.0.1:7545')))
+    contract = w3.eth.contract(address=deployed_address(contract_json), abi=contract_json['abi'])
+    return w3, supply_chain_for(prebuild_functions(contract))
+
+
+def registration_args(data):
+    """Convert a registration request body into register_product arguments"""
+    return (
+        data['product_id'],
+        data['manufacturer'],
+        data['batch_number'],
+        int(datetime.strptime(data['manufacture_date'], '%Y-%m-%d').timestamp()),
+        int(datetime.strptime(data['expiry_date'], '%Y-%m-%d').timestamp()),
+        data['gtin'],
+        data['serial_number']
+    )
+
+
+def format_product_info(product_tuple):
+    """Format product information from contract tuple response"""
+    try:
+        return {
+            'product_id': product_tuple[0],
+            'manufacturer': product_tuple[1],
+            'batch_number': product_tuple[2],
+            'manufacture_date': datetime.fromtimestamp(product_tuple[3]).isoformat(),
+            'expiry_date': datetime.fromtimestamp(product_tuple[4]).isoformat(),
+            'current_owner': product_tuple[5],
+            'gtin': product_tuple[6],
+            'serial_number': product_tuple[7]
+        }
+    except Exception as e:
+        logger.error(f"Error formatting product info: {e}")
+        return None
+
+
+def format_transfer(transfer_tuple):
+    """Format transfer information from contract tuple response"""
+    try:
+        return {
+            'from': transfer_tuple[0],
+            'to': transfer_tuple[1],
+            'timestamp': datetime.fromtimestamp(transfer_tuple[2]).isoformat(),
+            'transfer_type': transfer_tuple[3]
+        }
+    except Exception as e:
+        logger.error(f"Error formatting transfer info: {e}")
+        return None
@@ -0,0 +1,460 @@
+# asgi_app.py
+"""ASGI variant of the API built on AsyncWeb3
+
+Serves the latency-sensitive routes (health, register, transfer, verify and
+transaction status) and the /events/stream feed without tying up a worker
+thread per in-flight node call or open stream. All requests share one
+aiohttp connection pool to the node, and an asyncio.Semaphore caps how many
+JSON-RPC calls are outstanding at once so a burst of clients can't
+overwhelm Ganache.
+
+Run with: uvicorn asgi_app:app --port 5001
+"""
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+
+import aiohttp
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from web3 import AsyncWeb3, AsyncHTTPProvider, HTTPProvider, Web3
+from web3.exceptions import TransactionNotFound
+
+from app_common import (
+    MANUFACTURER_PRIVATE_KEY, deployed_address, find_contract_artifact,
+    format_product_info, format_transfer, registration_args
+)
+from cache import TTLCache
+from contract_artifacts import load_contract_artifact
+from contract_versions import supply_chain_for
+from event_stream import AsyncSubscription, EventHub, format_sse, parse_event_id
+from fee_oracle import AsyncFeeOracle, AsyncGasEstimator
+from nonce_manager import AsyncNonceManager, is_delivery_unknown, is_nonce_error
+from tx_tracker import normalize_hash
+
+logger = logging.getLogger('asgi_app')
+
+RPC_URL = os.getenv('RPC_URL', 'http://127.0.0.1:7545')
+
+# Upper bound on concurrent JSON-RPC calls (and pooled connections) to the node
+NODE_CONCURRENCY = int(os.getenv('NODE_CONCURRENCY', '32'))
+
+# Slim ABI/address copies of the truffle artifacts, shared with app.py
+ABI_CACHE_DIR = os.getenv('ABI_CACHE_DIR', 'build/abi_cache')
+contract_json = load_contract_artifact(find_contract_artifact(ABI_CACHE_DIR), ABI_CACHE_DIR)
+
+w3 = AsyncWeb3(AsyncHTTPProvider(RPC_URL))
+contract = w3.eth.contract(address=deployed_address(contract_json), abi=contract_json['abi'])
+supply_chain = supply_chain_for(contract)
+manufacturer_account = w3.eth.account.from_key(MANUFACTURER_PRIVATE_KEY)
+
+nonce_manager = AsyncNonceManager(w3)
+fee_oracle = AsyncFeeOracle(
+    w3,
+    mode=os.getenv('FEE_MODE', 'legacy'),
+    max_age=float(os.getenv('FEE_MAX_AGE', '2.0'))
+)
+gas_estimator = AsyncGasEstimator(
+    w3,
+    margin=float(os.getenv('GAS_ESTIMATE_MARGIN', '0.2')),
+    ttl=float(os.getenv('GAS_ESTIMATE_TTL', '300'))
+)
+verify_cache = TTLCache(
+    maxsize=int(os.getenv('VERIFY_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('VERIFY_CACHE_TTL', '30'))
+)
+
+# One background thread follows the logs for every /events/stream client over
+# its own synchronous connection; an open stream is only a waiting coroutine.
+# At most STREAM_MAX_CLIENTS streams are open at once, more get a 503
+stream_w3 = Web3(HTTPProvider(RPC_URL))
+event_hub = EventHub(
+    stream_w3,
+    supply_chain_for(stream_w3.eth.contract(address=deployed_address(contract_json), abi=contract_json['abi'])),
+    buffer_size=int(os.getenv('STREAM_BUFFER_SIZE', '10000')),
+    max_replay_blocks=int(os.getenv('STREAM_MAX_REPLAY_BLOCKS', '10000')),
+    chunk_size=int(os.getenv('INDEXER_CHUNK_SIZE', '2000')),
+    poll_interval=float(os.getenv('STREAM_POLL_INTERVAL', '1.0')),
+    max_clients=int(os.getenv('STREAM_MAX_CLIENTS', '1000')),
+    client_queue_size=int(os.getenv('STREAM_CLIENT_QUEUE', '1000'))
+)
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', '15'))
+
+
+def invalidate_on_product_event(event):
+    """Drop a cached verify result when its product is registered or transferred by anyone"""
+    if event['event'] in ('ProductRegistered', 'ProductTransferred'):
+        verify_cache.invalidate((event['product_id'], event['serial_number']))
+
+
+# Transfers by other workers and clients invalidate through the hub's log
+# feed, which verify starts before it first caches a result
+event_hub.listen(invalidate_on_product_event)
+
+# Created in the lifespan handler so it is bound to the server's event loop
+node_slots = None
+_chain_id = None
+
+
+async def node_call(awaitable):
+    """Await a node request while holding one of the NODE_CONCURRENCY slots"""
+    async with node_slots:
+        return await awaitable
+
+
+async def get_chain_id():
+    global _chain_id
+    if _chain_id is None:
+        _chain_id = await node_call(w3.eth.chain_id)
+    return _chain_id
+
+
+async def send_contract_transaction(contract_function, sender_address, private_key):
+    """Async counterpart of app.send_contract_transaction"""
+    gas_limit = await node_call(gas_estimator.gas_limit(contract_function, sender_address))
+    for attempt in range(2):
+        nonce = await nonce_manager.allocate(sender_address)
+        try:
+            transaction = await node_call(contract_function.build_transaction({
+                'from': sender_address,
+                'gas': gas_limit,
+                'nonce': nonce,
+                'chainId': await get_chain_id(),
+                **(await fee_oracle.fee_params())
+            }))
+            signed_tx = w3.eth.account.sign_transaction(transaction, private_key)
+        except Exception:
+            await nonce_manager.release(sender_address, nonce)
+            raise
+        try:
+            return await node_call(w3.eth.send_raw_transaction(signed_tx.rawTransaction))
+        except Exception as e:
+            if is_delivery_unknown(e):
+                # Keep the nonce used, see app.send_contract_transaction
+                try:
+                    await nonce_manager.resync(sender_address)
+                except Exception as resync_error:
+                    logger.warning(f"Nonce resync for {sender_address} failed: {resync_error}")
+                raise
+            if attempt == 0 and is_nonce_error(e):
+                await nonce_manager.resync(sender_address)
+                continue
+            await nonce_manager.release(sender_address, nonce)
+            raise
+
+
+def error_response(message, status_code):
+    return JSONResponse({'status': 'error', 'message': message}, status_code=status_code)
+
+
+def wants_async(request):
+    return request.query_params.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+def accepted_response(request, tx_hash, action, **details):
+    tx_hash = normalize_hash(tx_hash)
+    return JSONResponse({
+        'status': 'pending',
+        'action': action,
+        'transaction_hash': tx_hash,
+        'status_url': str(request.url_for('transaction_status', tx_hash=tx_hash)),
+        **details
+    }, status_code=202)
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def health_check(request):
+    try:
+        current_block = await node_call(w3.eth.block_number)
+        connected = True
+    except Exception:
+        current_block = None
+        connected = False
+    return JSONResponse({
+        'status': 'healthy',
+        'blockchain_connected': connected,
+        'current_block': current_block,
+        'contract_address': contract.address,
+        'contract_version': supply_chain.version
+    })
+
+
+async def register_product(request):
+    data = await read_json(request)
+    if not data:
+        return error_response('Request must contain JSON data', 400)
+    try:
+        tx_hash = await send_contract_transaction(
+            supply_chain.register_product(*registration_args(data)),
+            manufacturer_account.address,
+            manufacturer_account.key
+        )
+        if wants_async(request):
+            return accepted_response(request, tx_hash, 'register')
+        # Not throttled: holding a slot for the whole wait would starve other requests
+        tx_receipt = await w3.eth.wait_for_transaction_receipt(tx_hash)
+        return JSONResponse({
+            'status': 'success',
+            'transaction_hash': tx_hash.hex(),
+            'block_number': tx_receipt['blockNumber']
+        })
+    except Exception as e:
+        logger.error(f"Error in register_product: {e}")
+        return error_response(str(e), 400)
+
+
+async def transfer_product(request):
+    data = await read_json(request)
+    if not data:
+        return error_response('Request must contain JSON data', 400)
+
+    required_fields = ['product_id', 'serial_number', 'new_owner',
+                       'transfer_type', 'sender_address', 'private_key']
+    missing_fields = [field for field in required_fields if field not in data]
+    if missing_fields:
+        return error_response(f'Missing required fields: {missing_fields}', 400)
+    if not w3.is_address(data['sender_address']):
+        return error_response('Invalid sender address format', 400)
+    if not w3.is_address(data['new_owner']):
+        return error_response('Invalid new owner address format', 400)
+    try:
+        if not data['private_key'].startswith('0x'):
+            data['private_key'] = '0x' + data['private_key']
+        w3.eth.account.from_key(data['private_key'])
+    except Exception:
+        return error_response('Invalid private key format', 400)
+
+    try:
+        product_info = supply_chain.decode_product_info(await node_call(
+            supply_chain.get_product_info(data['product_id'], data['serial_number']).call()
+        ))
+    except Exception as e:
+        logger.error(f"Error checking product existence: {e}")
+        return error_response('Product does not exist or error checking product', 404)
+
+    if product_info[5].lower() != data['sender_address'].lower():
+        return error_response('Sender is not the current owner of the product', 403)
+
+    cache_key = (data['product_id'], data['serial_number'])
+    try:
+        tx_hash = await send_contract_transaction(
+            supply_chain.transfer_product(
+                data['product_id'],
+                data['serial_number'],
+                data['new_owner'],
+                data['transfer_type']
+            ),
+            w3.to_checksum_address(data['sender_address']),
+            data['private_key']
+        )
+        verify_cache.invalidate(cache_key)
+        if wants_async(request):
+            return accepted_response(
+                request, tx_hash, 'transfer',
+                product_id=data['product_id'],
+                serial_number=data['serial_number']
+            )
+        tx_receipt = await w3.eth.wait_for_transaction_receipt(tx_hash)
+        verify_cache.invalidate(cache_key)
+        return JSONResponse({
+            'status': 'success',
+            'transaction_hash': tx_hash.hex(),
+            'block_number': tx_receipt['blockNumber']
+        })
+    except Exception as e:
+        logger.error(f"Transaction error: {e}")
+        return error_response(f'Transaction failed: {e}', 400)
+
+
+async def transaction_status(request):
+    tx_hash = normalize_hash(request.path_params['tx_hash'])
+    try:
+        receipt = await node_call(w3.eth.get_transaction_receipt(tx_hash))
+    except TransactionNotFound:
+        receipt = None
+    if receipt is not None:
+        return JSONResponse({
+            'status': 'success',
+            'transaction': {
+                'transaction_hash': tx_hash,
+                'state': 'mined' if receipt['status'] == 1 else 'failed',
+                'block_number': receipt['blockNumber'],
+                'gas_used': receipt['gasUsed']
+            }
+        })
+    try:
+        await node_call(w3.eth.get_transaction(tx_hash))
+    except TransactionNotFound:
+        return error_response('Transaction not found', 404)
+    return JSONResponse({
+        'status': 'success',
+        'transaction': {'transaction_hash': tx_hash, 'state': 'pending', 'block_number': None}
+    })
+
+
+async def follow_product_events():
+    """Start the event hub before a verify result is first cached, see app.follow_transfers"""
+    if verify_cache.ttl > 0 and event_hub.covered_from_block is None:
+        await asyncio.to_thread(event_hub.start)
+
+
+async def verify_product(request):
+    product_id = request.path_params['product_id']
+    serial_number = request.path_params['serial_number']
+    cache_key = (product_id, serial_number)
+    cached = verify_cache.get(cache_key)
+    if cached is not None:
+        formatted_product, formatted_transfers = cached
+        return JSONResponse({
+            'status': 'success',
+            'product_info': formatted_product,
+            'transfer_history': formatted_transfers
+        })
+
+    try:
+        await follow_product_events()
+        # Both reads go out together instead of back to back
+        product_info, transfer_history = await asyncio.gather(
+            node_call(supply_chain.get_product_info(product_id, serial_number).call()),
+            node_call(supply_chain.get_transfer_history(product_id, serial_number).call())
+        )
+    except Exception as e:
+        logger.error(f"Error in verify_product: {e}")
+        return error_response(str(e), 400)
+
+    formatted_product = format_product_info(supply_chain.decode_product_info(product_info))
+    if not formatted_product:
+        return error_response('Error formatting product information', 400)
+    formatted_transfers = [
+        format_transfer(t) for t in supply_chain.decode_transfer_history(transfer_history)
+    ]
+    formatted_transfers = [t for t in formatted_transfers if t is not None]
+    verify_cache.set(cache_key, (formatted_product, formatted_transfers))
+    return JSONResponse({
+        'status': 'success',
+        'product_info': formatted_product,
+        'transfer_history': formatted_transfers
+    })
+
+
+async def cache_stats(request):
+    return JSONResponse(verify_cache.stats())
+
+
+async def event_stream(request):
+    """Server-sent events of registrations and transfers, optionally filtered
+
+    Query filters: product_id, serial_number, batch_number, owner. Resumes
+    after the Last-Event-ID header (or ?last_event_id=) when given.
+    """
+    owner = request.query_params.get('owner')
+    if owner and not w3.is_address(owner):
+        return error_response('Invalid owner address format', 400)
+    last_event_id = request.headers.get('last-event-id') or request.query_params.get('last_event_id')
+    after = parse_event_id(last_event_id) if last_event_id else None
+    if last_event_id and after is None:
+        return error_response('Last-Event-ID must be block:logIndex', 400)
+
+    subscription = AsyncSubscription(
+        asyncio.get_running_loop(),
+        product_id=request.query_params.get('product_id'),
+        serial_number=request.query_params.get('serial_number'),
+        batch_number=request.query_params.get('batch_number'),
+        owner=owner,
+        max_queue=event_hub.client_queue_size
+    )
+    try:
+        # Starting the hub and replaying old events read the node synchronously
+        replay, complete = await asyncio.to_thread(event_hub.subscribe, subscription, after)
+    except OverflowError as e:
+        return error_response(str(e), 503)
+    except Exception as e:
+        event_hub.unsubscribe(subscription)
+        logger.error(f"Error in event_stream: {e}")
+        return error_response(str(e), 503)
+
+    async def generate():
+        last = after
+        try:
+            if not complete:
+                # Too far back to replay; the client should re-read current state
+                yield f"event: gap\ndata: {json.dumps({'last_event_id': last_event_id})}\n\n"
+            for event in replay:
+                yield format_sse(event)
+                last = (event['block_number'], event['log_index'])
+            while True:
+                if subscription.overflowed and subscription.drained():
+                    # Everything queued before the overflow has been sent; the
+                    # browser reconnects with Last-Event-ID and resumes from there
+                    yield 'event: overflow\ndata: {}\n\n'
+                    return
+                try:
+                    event = await subscription.get(STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                position = (event['block_number'], event['log_index'])
+                if last is not None and position <= last:
+                    continue
+                yield format_sse(event)
+                last = position
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        # Also runs when the client disconnects mid-stream
+        background=BackgroundTask(event_hub.unsubscribe, subscription)
+    )
+
+
+async def event_stream_stats(request):
+    return JSONResponse(event_hub.stats())
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global node_slots
+    node_slots = asyncio.Semaphore(NODE_CONCURRENCY)
+    # One keep-alive pool shared by every request instead of a session per call
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=NODE_CONCURRENCY),
+        timeout=aiohttp.ClientTimeout(total=30)
+    )
+    await w3.provider.cache_async_session(session)
+    try:
+        yield
+    finally:
+        await session.close()
+
+
+routes = [
+    Route('/health', health_check),
+    Route('/product/register', register_product, methods=['POST']),
+    Route('/product/transfer', transfer_product, methods=['POST']),
+    Route('/tx/{tx_hash}', transaction_status, name='transaction_status'),
+    Route('/cache/stats', cache_stats),
+    Route('/product/verify/{product_id}/{serial_number}', verify_product),
+    Route('/events/stream', event_stream),
+    Route('/events/stats', event_stream_stats),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
@@ -0,0 +1,231 @@
+# audit_export.py
+import argparse
+import gzip
+import json
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+
+from eth_utils import event_abi_to_log_topic
+
+from app_common import connect_supply_chain, format_product_info, format_transfer
+from rpc_batch import batch_call
+
+
+def parse_cursor(value):
+    """Parse a 'snapshot:block:logIndex' export cursor into a tuple of ints, or None"""
+    try:
+        snapshot, block, log_index = (int(part) for part in value.split(':'))
+        return snapshot, block, log_index
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_date(value, end_of_day=False):
+    """YYYY-MM-DD as a unix timestamp; end_of_day gives the first second of the next day"""
+    day = datetime.strptime(value, '%Y-%m-%d')
+    if end_of_day:
+        day += timedelta(days=1)
+    return int(day.timestamp())
+
+
+class AuditExporter:
+    """Every registered product joined with its transfer history, streamed in registration order
+
+    Products are found through ProductRegistered logs, which works for
+    every contract version. The logs are read in ranges of block_chunk
+    blocks and the products are grouped chunk_size at a time. Each group
+    is read with JSON-RPC batches on a thread pool. At most `concurrency`
+    groups are in flight, and finished groups are yielded in order, so
+    memory stays bounded however many products there are. All reads are
+    pinned to one snapshot block, and each record's cursor
+    (snapshot:block:logIndex) resumes the export right after it.
+    """
+
+    def __init__(self, w3, supply_chain, format_product, format_transfer, start_block=0,
+                 block_chunk=2000, chunk_size=100, concurrency=4):
+        self.w3 = w3
+        self.supply_chain = supply_chain
+        self.contract = supply_chain.contract
+        self.format_product = format_product
+        self.format_transfer = format_transfer
+        self.start_block = start_block
+        self.block_chunk = block_chunk
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self._registered = self.contract.events.ProductRegistered()
+        self._topic = self.w3.to_hex(event_abi_to_log_topic(self._registered.abi))
+
+    def _registrations(self, snapshot, after, since, until, manufacturer):
+        """Yield lists of up to chunk_size registrations after position `after`"""
+        from_block = self.start_block if after is None else after[0]
+        group = []
+        while from_block <= snapshot:
+            to_block = min(from_block + self.block_chunk - 1, snapshot)
+            logs = self.w3.eth.get_logs({
+                'address': self.contract.address,
+                'fromBlock': from_block,
+                'toBlock': to_block,
+                'topics': [self._topic],
+            })
+            for log in sorted(logs, key=lambda l: (l['blockNumber'], l['logIndex'])):
+                if after is not None and (log['blockNumber'], log['logIndex']) <= after:
+                    continue
+                args = self.supply_chain.decode_event_args(self._registered.process_log(log)['args'])
+                if until is not None and args['timestamp'] >= until:
+                    # Block timestamps only go up, nothing later can match
+                    if group:
+                        yield group
+                    return
+                if since is not None and args['timestamp'] < since:
+                    continue
+                if manufacturer is not None and args['manufacturer'] != manufacturer:
+                    continue
+                group.append({
+                    'product_id': args['productId'],
+                    'serial_number': args['serialNumber'],
+                    'registered_at': datetime.fromtimestamp(args['timestamp']).isoformat(),
+                    'block_number': log['blockNumber'],
+                    'log_index': log['logIndex'],
+                    'transaction_hash': self.w3.to_hex(log['transactionHash']),
+                })
+                if len(group) >= self.chunk_size:
+                    yield group
+                    group = []
+            from_block = to_block + 1
+        if group:
+            yield group
+
+    def _fetch(self, group, snapshot, batch_number):
+        """Product info and transfer history for one group, formatted as export records"""
+        keys = [(r['product_id'], r['serial_number']) for r in group]
+        infos, _ = batch_call(self.w3, [self.supply_chain.get_product_info(*k) for k in keys], snapshot)
+        if batch_number is not None:
+            keep = [
+                i for i, info in enumerate(infos)
+                if isinstance(info, Exception) or self.supply_chain.decode_product_info(info)[2] == batch_number
+            ]
+            group, keys, infos = [group[i] for i in keep], [keys[i] for i in keep], [infos[i] for i in keep]
+        histories, _ = batch_call(self.w3, [self.supply_chain.get_transfer_history(*k) for k in keys], snapshot)
+
+        records = []
+        for registration, info, history in zip(group, infos, histories):
+            record = {
+                'cursor': f"{snapshot}:{registration['block_number']}:{registration['log_index']}",
+                **registration,
+            }
+            if isinstance(info, Exception) or isinstance(history, Exception):
+                record['error'] = str(info if isinstance(info, Exception) else history)
+            else:
+                record['product_info'] = self.format_product(self.supply_chain.decode_product_info(info))
+                transfers = [self.format_transfer(t) for t in self.supply_chain.decode_transfer_history(history)]
+                record['transfer_history'] = [t for t in transfers if t is not None]
+            records.append(record)
+        return records
+
+    def records(self, snapshot, after=None, since=None, until=None, manufacturer=None, batch_number=None):
+        """Yield export records up to the snapshot block, starting after block/log position `after`"""
+        pending = deque()
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='audit-export')
+        try:
+            for group in self._registrations(snapshot, after, since, until, manufacturer):
+                pending.append(pool.submit(self._fetch, group, snapshot, batch_number))
+                if len(pending) >= self.concurrency:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # The client may have gone away mid-export; don't start groups nobody will read
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def ndjson(self, snapshot, after=None, compress=False, **filters):
+        """Encode records as NDJSON bytes, optionally as a gzip stream, ending with a summary line"""
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        exported = 0
+        cursor = None
+        for record in self.records(snapshot, after, **filters):
+            exported += 1
+            cursor = record['cursor']
+            line = json.dumps(record).encode() + b'\n'
+            yield compressor.compress(line) if compressor else line
+            if compressor and exported % self.chunk_size == 0:
+                # Push compressed output out now and then instead of holding it all in zlib
+                yield compressor.flush(zlib.Z_SYNC_FLUSH)
+        if cursor is None and after is not None:
+            cursor = f'{snapshot}:{after[0]}:{after[1]}'
+        summary = json.dumps({'complete': True, 'snapshot_block': snapshot, 'exported': exported, 'cursor': cursor})
+        line = summary.encode() + b'\n'
+        if compressor:
+            yield compressor.compress(line) + compressor.flush()
+        else:
+            yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export every registered product with its custody history as NDJSON')
+    parser.add_argument('output', help='Output file; a .gz name is gzip-compressed')
+    parser.add_argument('--from', dest='date_from', help='Registered on or after YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', help='Registered on or before YYYY-MM-DD')
+    parser.add_argument('--manufacturer')
+    parser.add_argument('--batch-number')
+    parser.add_argument('--checkpoint', help='Cursor file (default: <output>.checkpoint.json)')
+    parser.add_argument('--concurrency', type=int, default=4, help='Product groups read in parallel')
+    parser.add_argument('--chunk-size', type=int, default=100, help='Products per group')
+    args = parser.parse_args()
+
+    w3, supply_chain = connect_supply_chain()
+    exporter = AuditExporter(
+        w3,
+        supply_chain,
+        format_product_info,
+        format_transfer,
+        start_block=int(os.getenv('EXPORT_START_BLOCK', os.getenv('INDEXER_START_BLOCK', '0'))),
+        block_chunk=int(os.getenv('EXPORT_BLOCK_CHUNK', os.getenv('INDEXER_CHUNK_SIZE', '2000'))),
+        chunk_size=args.chunk_size,
+        concurrency=args.concurrency
+    )
+    checkpoint_path = args.checkpoint or f'{args.output}.checkpoint.json'
+    compress = args.output.endswith('.gz')
+    after, snapshot, offset = None, None, 0
+    if os.path.exists(checkpoint_path) and os.path.exists(args.output):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        snapshot, *after = parse_cursor(checkpoint['cursor'])
+        offset = checkpoint['offset']
+        print(f"Resuming after block {after[0]} log {after[1]} of snapshot {snapshot}")
+    if snapshot is None:
+        snapshot = w3.eth.block_number
+
+    records = exporter.records(
+        snapshot,
+        tuple(after) if after else None,
+        since=parse_date(args.date_from) if args.date_from else None,
+        until=parse_date(args.date_to, end_of_day=True) if args.date_to else None,
+        manufacturer=args.manufacturer,
+        batch_number=args.batch_number,
+    )
+    exported = 0
+    with open(args.output, 'r+b' if offset else 'wb') as out:
+        # Anything after the checkpoint is a chunk that was cut off; it is exported again
+        out.truncate(offset)
+        out.seek(offset)
+        while True:
+            chunk = list(islice(records, args.chunk_size))
+            if not chunk:
+                break
+            data = ''.join(json.dumps(record) + '\n' for record in chunk).encode()
+            # One gzip member per chunk, so the file is valid up to every checkpoint
+            out.write(gzip.compress(data) if compress else data)
+            out.flush()
+            exported += len(chunk)
+            with open(checkpoint_path, 'w') as f:
+                json.dump({'cursor': chunk[-1]['cursor'], 'offset': out.tell()}, f)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(json.dumps({'output': args.output, 'snapshot_block': snapshot, 'exported': exported}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+# benchmark_hot_paths.py
+"""Microbenchmarks for the CPU work app.py does per request
+
+    python benchmark_hot_paths.py                                # print results
+    python benchmark_hot_paths.py --save-baseline bench.json     # record a baseline
+    python benchmark_hot_paths.py --compare bench.json           # fail on regressions
+
+app.py is imported with the in-process chain (CHAIN_BACKEND=eth-tester) and
+its provider is then swapped for MockProvider, which answers every JSON-RPC
+call with canned, correctly ABI-encoded data. What is measured is only this
+process's work: building and ABI-encoding transactions, signing, decoding
+call results, formatting and JSON serialization. Node latency and EVM
+execution are left out.
+
+Each benchmark is calibrated to run for at least --min-time seconds per
+repeat. The best of --repeat runs is reported, in microseconds per
+operation. --compare exits with status 1 if any benchmark is more than
+--threshold (default 0.2, i.e. 20%) slower than the baseline. Baselines are
+only comparable on the same machine and Python version.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from eth_utils import keccak, to_checksum_address
+from web3.providers.base import BaseProvider
+
+from contract_artifacts import FunctionCodec
+
+SAMPLE_TIMESTAMP = 1704067200
+SAMPLE_ADDRESS = to_checksum_address('0x' + '5a' * 20)
+
+
+def sample_value(abi_output, array_length):
+    """A plausible value for one ABI output; arrays get array_length elements"""
+    abi_type = abi_output['type']
+    if abi_type.endswith('[]'):
+        element = dict(abi_output, type=abi_type[:-2])
+        return [sample_value(element, array_length) for _ in range(array_length)]
+    if abi_type == 'tuple':
+        return tuple(sample_value(c, array_length) for c in abi_output['components'])
+    if abi_type == 'address':
+        return SAMPLE_ADDRESS
+    if abi_type.startswith('uint') or abi_type.startswith('int'):
+        return SAMPLE_TIMESTAMP
+    if abi_type == 'bool':
+        return True
+    if abi_type.startswith('bytes') and abi_type != 'bytes':
+        return b'SAMPLE-0001'.ljust(int(abi_type[5:]), b'\0')
+    if abi_type == 'bytes':
+        return b'SAMPLE-0001'
+    return f"{abi_output.get('name') or 'value'}-SAMPLE-0001"
+
+
+class MockProvider(BaseProvider):
+    """Answers JSON-RPC from memory: eth_call results are encoded from the contract ABI
+
+    Array outputs (the transfer history) have history_length elements.
+    Sends return the transaction hash without doing anything else.
+    """
+
+    def __init__(self, w3, contract_abi, chain_id, history_length=10):
+        self.chain_id = chain_id
+        self.history_length = history_length
+        self.calls = {}
+        for fn_abi in contract_abi:
+            if fn_abi.get('type') == 'function' and fn_abi.get('outputs'):
+                codec = FunctionCodec(fn_abi)
+                self.calls[w3.to_hex(codec.selector)] = (codec, fn_abi)
+        self.w3 = w3
+        self._results = {}
+
+    def is_connected(self, show_traceback=False):
+        return True
+
+    def call_result(self, data):
+        selector = data[:10]
+        key = (selector, self.history_length)
+        if key not in self._results:
+            codec, fn_abi = self.calls[selector]
+            values = [sample_value(o, self.history_length) for o in fn_abi['outputs']]
+            self._results[key] = self.w3.to_hex(self.w3.codec.encode(codec.output_types, values))
+        return self._results[key]
+
+    def make_request(self, method, params):
+        if method == 'eth_call':
+            result = self.call_result(params[0]['data'])
+        elif method == 'eth_sendRawTransaction':
+            result = self.w3.to_hex(keccak(hexstr=params[0]))
+        else:
+            result = {
+                'eth_chainId': hex(self.chain_id),
+                'net_version': str(self.chain_id),
+                'eth_gasPrice': hex(10 ** 9),
+                'eth_estimateGas': hex(300000),
+                'eth_getTransactionCount': '0x0',
+                'eth_blockNumber': '0x64',
+            }[method]
+        return {'jsonrpc': '2.0', 'id': 1, 'result': result}
+
+
+def load_app():
+    """Import app.py on the in-process chain, then point its Web3 at MockProvider"""
+    os.environ.setdefault('CHAIN_BACKEND', 'eth-tester')
+    os.environ['VERIFY_CACHE_TTL'] = '0'
+    import app
+
+    provider = MockProvider(app.w3, app.CONTRACT_ABI, app.get_chain_id())
+    app.w3.provider = provider
+    app.app.logger.disabled = True
+    return app, provider
+
+
+def build_benchmarks(app, provider, history_lengths):
+    supply_chain = app.supply_chain
+    account = app.manufacturer_account
+    registration = app.registration_args({
+        'product_id': 'BENCH-PRODUCT-0001',
+        'manufacturer': 'Benchmark Pharma Ltd',
+        'manufacture_date': '2024-01-01',
+        'expiry_date': '2026-01-01',
+        'batch_number': 'BATCH-2024-0001',
+        'serial_number': 'SN-0000000001',
+        'gtin': '00012345678905',
+    })
+    tx_fields = {
+        'from': account.address,
+        'gas': 300000,
+        'nonce': 0,
+        'chainId': provider.chain_id,
+        'gasPrice': 10 ** 9,
+    }
+    register_tx = supply_chain.register_product(*registration).build_transaction(tx_fields)
+    client = app.app.test_client()
+
+    def encode_register():
+        supply_chain.register_product(*registration).build_transaction(tx_fields)
+
+    def encode_transfer():
+        supply_chain.transfer_product(
+            'BENCH-PRODUCT-0001', 'SN-0000000001', SAMPLE_ADDRESS, 'Distribution'
+        ).build_transaction(tx_fields)
+
+    def sign():
+        account.sign_transaction(register_tx)
+
+    def send_register():
+        app.send_contract_transaction(supply_chain.register_product(*registration), account.address, account)
+
+    def decode_product_info():
+        supply_chain.fetch_product_info('BENCH-PRODUCT-0001', 'SN-0000000001')
+
+    def format_product():
+        app.format_product_info(product_tuple)
+
+    provider.history_length = 1
+    product_tuple = supply_chain.fetch_product_info('BENCH-PRODUCT-0001', 'SN-0000000001')
+
+    benchmarks = [
+        ('encode_register_product', encode_register, None),
+        ('encode_transfer_product', encode_transfer, None),
+        ('sign_transaction', sign, None),
+        ('send_contract_transaction', send_register, None),
+        ('decode_product_info', decode_product_info, None),
+        ('format_product_info', format_product, None),
+    ]
+    for length in history_lengths:
+        benchmarks += history_benchmarks(app, provider, client, length)
+    return benchmarks
+
+
+def history_benchmarks(app, provider, client, length):
+    """Benchmarks whose cost grows with the transfer history length"""
+    supply_chain = app.supply_chain
+    provider.history_length = length
+    transfers = supply_chain.fetch_transfer_history('BENCH-PRODUCT-0001', 'SN-0000000001')
+    formatted = [app.format_transfer(t) for t in transfers]
+
+    def decode_history():
+        supply_chain.fetch_transfer_history('BENCH-PRODUCT-0001', 'SN-0000000001')
+
+    def format_history():
+        [app.format_transfer(t) for t in transfers]
+
+    def serialize_history():
+        with app.app.app_context():
+            app.jsonify({'status': 'success', 'transfer_history': formatted}).get_data()
+
+    def verify_endpoint():
+        response = client.get('/product/verify/BENCH-PRODUCT-0001/SN-0000000001?source=chain')
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    return [
+        (f'decode_transfer_history[{length}]', decode_history, length),
+        (f'format_transfers[{length}]', format_history, length),
+        (f'jsonify_transfer_history[{length}]', serialize_history, length),
+        (f'verify_endpoint[{length}]', verify_endpoint, length),
+    ]
+
+
+def measure(fn, repeat, min_time):
+    """Best and median seconds per call over `repeat` calibrated runs"""
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / 4:
+            break
+        loops *= 4
+    loops = max(1, int(loops * min_time / max(elapsed, 1e-9)))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - started) / loops)
+    return min(timings), statistics.median(timings), loops
+
+
+def run(app, provider, args):
+    results = {}
+    for name, fn, history_length in build_benchmarks(app, provider, args.history_lengths):
+        if args.filter and args.filter not in name:
+            continue
+        provider.history_length = history_length or 1
+        # verify_product prints the raw contract results; keep them off the report
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            best, median, loops = measure(fn, args.repeat, args.min_time)
+        results[name] = {
+            'best_us': round(best * 1e6, 2),
+            'median_us': round(median * 1e6, 2),
+            'loops': loops,
+        }
+        print(f"{name:40} {best * 1e6:12.2f} us  (median {median * 1e6:.2f} us, {loops} loops)", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Per-benchmark change against the baseline and the names that regressed"""
+    report, regressions = {}, []
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        change = result['best_us'] / before['best_us'] - 1
+        report[name] = {'baseline_us': before['best_us'], 'current_us': result['best_us'], 'change': round(change, 4)}
+        if change > threshold:
+            regressions.append(name)
+    return report, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark the per-request CPU work in app.py')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='Seconds per repeat')
+    parser.add_argument('--history-lengths', type=lambda v: [int(n) for n in v.split(',')], default=[10, 500],
+                        help='Comma-separated transfer history sizes')
+    parser.add_argument('--filter', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH', help='Baseline to check against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown, 0.2 = 20%%')
+    args = parser.parse_args()
+
+    app, provider = load_app()
+    results = run(app, provider, args)
+    output = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        output['comparison'], regressions = compare(results, baseline, args.threshold)
+        output['regressions'] = regressions
+    print(json.dumps(output, indent=2))
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) more than {args.threshold:.0%} slower than the baseline: "
+              f"{', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
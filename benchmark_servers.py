@@ -0,0 +1,94 @@
+# benchmark_servers.py
+"""Compare verify throughput and latency of the Flask and ASGI servers
+
+Start both against the same node, e.g.
+
+    gunicorn -c gunicorn.conf.py app:app         # Flask on :5000, as in production
+    uvicorn asgi_app:app --port 5001             # ASGI on :5001
+
+`python app.py` runs Flask's single-process development server, which
+would understate what the Flask app does behind gunicorn.
+
+then run
+
+    python benchmark_servers.py --product-id P1 --serial-number S1
+
+Each target gets the same number of GET /product/verify requests from a
+fixed number of concurrent clients. Start the servers with
+VERIFY_CACHE_TTL=0 to measure node round trips rather than cache hits.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from simulate_supply_chain import latency_summary
+
+
+async def run_target(name, base_url, path, requests_total, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests_total))
+
+    async def client(session):
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                async with session.get(f'{base_url}{path}', params={'source': 'chain'}) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'target': name,
+        'url': base_url,
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        **latency_summary(latencies),
+    }
+
+
+async def main_async(args):
+    path = f'/product/verify/{args.product_id}/{args.serial_number}'
+    targets = [('flask', args.flask_url), ('asgi', args.asgi_url)]
+    results = []
+    for name, url in targets:
+        if not url:
+            continue
+        # Warm up connections and lazily initialised state before measuring
+        await run_target(name, url, path, min(args.concurrency, args.requests), args.concurrency)
+        results.append(await run_target(name, url, path, args.requests, args.concurrency))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Flask and ASGI verify endpoints')
+    parser.add_argument('--flask-url', default='http://127.0.0.1:5000', help="Empty string skips Flask")
+    parser.add_argument('--asgi-url', default='http://127.0.0.1:5001', help="Empty string skips ASGI")
+    parser.add_argument('--product-id', required=True)
+    parser.add_argument('--serial-number', required=True)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
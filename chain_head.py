@@ -0,0 +1,74 @@
+# chain_head.py
+import threading
+import time
+
+from cache import SingleFlight
+
+
+class ChainHead:
+    """The latest block number, read from the node at most once per max_age seconds
+
+    Code that reads the head from the node anyway (the product filter's
+    sync, the app's read_block_number) does it through fetch(), and
+    request paths use the result through cached() without contacting the
+    node. block_number() returns a cached head that
+    is at most max_age seconds old, otherwise one eth_blockNumber call
+    shared by every caller waiting at the time.
+
+    With a SharedMarker every observation is published, and processes
+    whose own head is older than asked for read the published one.
+    """
+
+    def __init__(self, w3, max_age=1.0, shared=None):
+        self.w3 = w3
+        self.max_age = max_age
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._number = None
+        self._seen_at = None
+        self.fetches = 0
+
+    def observe(self, block_number):
+        """Record a head just read from the node"""
+        with self._lock:
+            self._number = block_number
+            self._seen_at = time.time()
+        if self.shared is not None:
+            self.shared.set(block_number)
+
+    def cached(self, max_staleness):
+        """The head seen within the last max_staleness seconds, or None; never calls the node"""
+        now = time.time()
+        with self._lock:
+            number, seen_at = self._number, self._seen_at
+        if seen_at is not None and now - seen_at <= max_staleness:
+            return number
+        if self.shared is not None:
+            number, seen_at = self.shared.get()
+            if seen_at is not None and now - seen_at <= max_staleness:
+                return number
+        return None
+
+    def block_number(self):
+        """The head, at most max_age seconds old"""
+        number = self.cached(self.max_age)
+        if number is not None:
+            return number
+        return self._flight.do(('block_number',), self.fetch)
+
+    def fetch(self):
+        """Read the head from the node and record it"""
+        number = self.w3.eth.block_number
+        self.fetches += 1
+        self.observe(number)
+        return number
+
+    def stats(self):
+        with self._lock:
+            number, seen_at = self._number, self._seen_at
+        return {
+            'block_number': number,
+            'age_seconds': None if seen_at is None else round(time.time() - seen_at, 3),
+            'fetches': self.fetches,
+        }
@@ -0,0 +1,126 @@
+# compile_contracts.py
+"""Rebuild the checked-in contract artifacts in bin/contracts
+
+The eth-tester backend deploys bin/contracts/<Name>.json when there is no
+truffle build, so those files must be regenerated whenever a .sol file
+changes. This compiles with the solc version and optimizer settings pinned
+in truffle-config.js, so a truffle build and the checked-in artifacts
+produce the same bytecode.
+
+Run with: python compile_contracts.py          (needs py-solc-x)
+          python compile_contracts.py --check  (no compiler needed)
+"""
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+CONTRACTS_DIR = ROOT / 'contracts'
+ARTIFACTS_DIR = ROOT / 'bin' / 'contracts'
+
+# Keep in step with compilers.solc in truffle-config.js
+SOLC_VERSION = '0.8.19'
+OPTIMIZER_RUNS = 200
+# getProductInfo returns eight values, too many locals for the legacy code generator
+VIA_IR = True
+
+CONTRACTS = ['PharmaSupplyChain', 'PharmaSupplyChainV2']
+
+_FUNCTION = re.compile(r'\bfunction\s+(\w+)\s*\([^)]*\)([^{;]*)', re.S)
+
+
+def declared_functions(source):
+    """Names of the public and external functions declared in a Solidity source"""
+    return {
+        name for name, modifiers in _FUNCTION.findall(source)
+        if re.search(r'\b(public|external)\b', modifiers)
+    }
+
+
+def missing_functions(name, artifact_path=None):
+    """Functions contracts/<name>.sol declares that the artifact's ABI lacks
+
+    A non-empty result means the artifact was compiled from an older source
+    and needs rebuilding with this script.
+    """
+    source_path = CONTRACTS_DIR / f'{name}.sol'
+    artifact_path = Path(artifact_path or ARTIFACTS_DIR / f'{name}.json')
+    if not source_path.exists():
+        return set()
+    with open(artifact_path) as f:
+        abi = json.load(f)['abi']
+    compiled = {item['name'] for item in abi if item.get('type') == 'function'}
+    return declared_functions(source_path.read_text()) - compiled
+
+
+def compile_contract(name, artifacts_dir=ARTIFACTS_DIR):
+    """Compile contracts/<name>.sol with the pinned solc and write its artifacts"""
+    import solcx
+
+    if SOLC_VERSION not in {str(v) for v in solcx.get_installed_solc_versions()}:
+        solcx.install_solc(SOLC_VERSION)
+    source_path = CONTRACTS_DIR / f'{name}.sol'
+    output = solcx.compile_standard({
+        'language': 'Solidity',
+        'sources': {f'contracts/{name}.sol': {'content': source_path.read_text()}},
+        'settings': {
+            'optimizer': {'enabled': True, 'runs': OPTIMIZER_RUNS},
+            'viaIR': VIA_IR,
+            'outputSelection': {'*': {'*': [
+                'abi', 'metadata', 'evm.bytecode.object', 'evm.deployedBytecode.object'
+            ]}},
+        },
+    }, solc_version=SOLC_VERSION, base_path=str(ROOT))
+    compiled = output['contracts'][f'contracts/{name}.sol'][name]
+    artifact = {
+        'contractName': name,
+        'abi': compiled['abi'],
+        'metadata': compiled['metadata'],
+        'bytecode': '0x' + compiled['evm']['bytecode']['object'],
+        'deployedBytecode': '0x' + compiled['evm']['deployedBytecode']['object'],
+        'sourcePath': f'contracts/{name}.sol',
+        'compiler': {'name': 'solc', 'version': SOLC_VERSION},
+    }
+    artifacts_dir = Path(artifacts_dir)
+    artifacts_dir.mkdir(parents=True, exist_ok=True)
+    with open(artifacts_dir / f'{name}.json', 'w') as f:
+        json.dump(artifact, f, indent=2)
+    with open(artifacts_dir / f'{name}.abi', 'w') as f:
+        json.dump(compiled['abi'], f)
+    with open(artifacts_dir / f'{name}.bin', 'w') as f:
+        f.write(compiled['evm']['bytecode']['object'])
+    return artifacts_dir / f'{name}.json'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the contracts into bin/contracts')
+    parser.add_argument('contracts', nargs='*', default=CONTRACTS, help=f'Default: {" ".join(CONTRACTS)}')
+    parser.add_argument('--check', action='store_true',
+                        help='Only report artifacts that are missing or older than their source')
+    args = parser.parse_args()
+
+    if not args.check:
+        for name in args.contracts:
+            compile_contract(name)
+            print(f'{name}: compiled with solc {SOLC_VERSION}')
+        return
+
+    stale = False
+    for name in args.contracts:
+        if not (ARTIFACTS_DIR / f'{name}.json').exists():
+            print(f'{name}: no artifact in {ARTIFACTS_DIR}')
+            stale = True
+            continue
+        missing = missing_functions(name)
+        if missing:
+            print(f'{name}: artifact lacks {", ".join(sorted(missing))}')
+            stale = True
+        else:
+            print(f'{name}: up to date')
+    sys.exit(1 if stale else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# conftest.py
+"""pytest fixtures that run app.py against an in-process eth-tester chain
+
+No Ganache and no truffle migrate: the contract is deployed from its
+compiled artifact when app.py is imported, and every transaction is mined
+as soon as it is sent.
+"""
+import http.server
+import importlib
+import json
+import threading
+import uuid
+
+import pytest
+
+from compile_contracts import ARTIFACTS_DIR, SOLC_VERSION, compile_contract, missing_functions
+from contract_versions import supply_chain_for
+
+# test_api.py drives a running server by hand, it isn't a pytest module
+collect_ignore = ['test_api.py']
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py imported once per session with CHAIN_BACKEND=eth-tester"""
+    state_dir = tmp_path_factory.mktemp('app')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('CHAIN_BACKEND', 'eth-tester')
+        mp.setenv('ABI_CACHE_DIR', str(state_dir / 'abi_cache'))
+        mp.setenv('RECEIPT_POLL_INTERVAL', '0.05')
+        mp.setenv('STREAM_POLL_INTERVAL', '0.05')
+        mp.setenv('STATE_DIR', str(state_dir))
+        for name in ('SHARED_STATE_PATH', 'INDEXER_ENABLED', 'PRODUCT_FILTER_ENABLED',
+                     'PROFILING_ENABLED', 'KEYSTORE_DIR', 'CONTRACT_NAME', 'HISTORICAL_CACHE_DB'):
+            mp.delenv(name, raising=False)
+        yield importlib.import_module('app')
+
+
+@pytest.fixture
+def chain(app_module):
+    """The InProcessChain behind the app; chain.accounts are funded test accounts"""
+    return app_module.in_process_chain
+
+
+@pytest.fixture
+def client(app_module):
+    """Flask test client for the app"""
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def product_data():
+    """Registration body for a product nobody has registered yet"""
+    suffix = uuid.uuid4().hex[:10].upper()
+    return {
+        'product_id': f'PRD-{suffix}',
+        'manufacturer': 'Test Pharma',
+        'manufacture_date': '2024-01-01',
+        'expiry_date': '2026-01-01',
+        'batch_number': f'BATCH-{suffix[:4]}',
+        'serial_number': f'SN-{suffix}',
+        'gtin': '00012345678905',
+    }
+
+
+@pytest.fixture(scope='session')
+def compiled_artifact(tmp_path_factory):
+    """Artifact path for a contract, built from its source when the checked-in one is stale
+
+    Skips the test when the artifact needs rebuilding and solc can't be
+    installed, e.g. without network access.
+    """
+    built = {}
+
+    def build(name):
+        if name not in built:
+            path = ARTIFACTS_DIR / f'{name}.json'
+            if not path.exists() or missing_functions(name, path):
+                pytest.importorskip('solcx')
+                try:
+                    path = compile_contract(name, tmp_path_factory.mktemp(name))
+                except Exception as e:
+                    pytest.skip(f'{name} needs compiling and solc {SOLC_VERSION} is unavailable: {e}')
+            built[name] = path
+        return built[name]
+    return build
+
+
+@pytest.fixture
+def deploy_supply_chain(chain, compiled_artifact):
+    """Deploy a fresh copy of a contract and return its contract_versions adapter"""
+    def deploy(name):
+        deployed = chain.deploy(compiled_artifact(name))
+        address = list(deployed['networks'].values())[0]['address']
+        return supply_chain_for(chain.w3.eth.contract(address=address, abi=deployed['abi']))
+    return deploy
+
+
+class RPCNode(http.server.ThreadingHTTPServer):
+    """A separate in-process chain served over HTTP JSON-RPC, like a real node
+
+    Batches are answered call by call. methods records every method
+    received; set fail_status to answer every request with that HTTP
+    status instead.
+    """
+
+    def __init__(self):
+        from evm_backend import InProcessChain
+
+        super().__init__(('127.0.0.1', 0), _RPCHandler)
+        self.chain = InProcessChain()
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        self.methods = []
+        self.fail_status = None
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _RPCHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        from web3 import Web3
+
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        requests = payload if isinstance(payload, list) else [payload]
+        self.server.methods.extend(request['method'] for request in requests)
+        if self.server.fail_status:
+            self.send_response(self.server.fail_status)
+            self.end_headers()
+            return
+        responses = [self._answer(request) for request in requests]
+        body = Web3.to_json(responses if isinstance(payload, list) else responses[0]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _answer(self, request):
+        response = {'jsonrpc': '2.0', 'id': request['id']}
+        try:
+            response['result'] = self.server.chain.w3.manager.request_blocking(request['method'], request['params'])
+        except Exception as e:
+            response['error'] = {'code': -32000, 'message': str(e)}
+        return response
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def rpc_nodes():
+    """rpc_nodes(n): n independent chains behind HTTP JSON-RPC servers, stopped after the test"""
+    started = []
+
+    def start(count):
+        nodes = [RPCNode() for _ in range(count)]
+        started.extend(nodes)
+        return nodes
+    yield start
+    for node in started:
+        node.stop()
+
+
+@pytest.fixture
+def migrated_node(rpc_nodes, tmp_path, monkeypatch):
+    """An RPC node with PharmaSupplyChain deployed, found the way the command-line tools look
+
+    The test runs in tmp_path, which holds the migrated build/contracts
+    artifact, with RPC_URL pointing at the node.
+    """
+    from eth_account import Account
+
+    from app_common import MANUFACTURER_PRIVATE_KEY
+
+    node = rpc_nodes(1)[0]
+    deployed = node.chain.deploy(ARTIFACTS_DIR / 'PharmaSupplyChain.json')
+    node.chain.fund(Account.from_key(MANUFACTURER_PRIVATE_KEY).address)
+    build_dir = tmp_path / 'build' / 'contracts'
+    build_dir.mkdir(parents=True)
+    (build_dir / 'PharmaSupplyChain.json').write_text(json.dumps(deployed))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('RPC_URL', node.url)
+    monkeypatch.setenv('CONTRACT_NAME', 'PharmaSupplyChain')
+    monkeypatch.setenv('ABI_CACHE_DIR', str(tmp_path / 'abi_cache'))
+    return node
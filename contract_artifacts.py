@@ -0,0 +1,104 @@
+# contract_artifacts.py
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from eth_utils import function_abi_to_4byte_selector
+from eth_utils.abi import collapse_if_tuple
+from web3._utils.abi import map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3.contract.contract import ContractFunction
+
+
+def artifact_digest(path):
+    """Content hash of an artifact file, cheaper than parsing its JSON"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_contract_artifact(path, cache_dir):
+    """Return {'contractName', 'abi', 'networks'} for a truffle artifact
+
+    Truffle artifacts also carry bytecode, sources, the AST and source maps,
+    which the API never uses. The first load writes just the ABI and the
+    deployed addresses to cache_dir, named by the artifact's hash. Later
+    loads read that small file, and a re-migrated artifact gets a new hash.
+    """
+    path = Path(path)
+    cache_path = Path(cache_dir) / f'{path.stem}-{artifact_digest(path)}.json'
+    if cache_path.exists():
+        with open(cache_path) as f:
+            return json.load(f)
+
+    with open(path) as f:
+        artifact = json.load(f)
+    slim = {
+        'contractName': artifact.get('contractName', path.stem),
+        'abi': artifact['abi'],
+        'networks': {
+            network_id: {'address': network['address']}
+            for network_id, network in artifact.get('networks', {}).items()
+        },
+    }
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale in Path(cache_dir).glob(f'{path.stem}-*.json'):
+        stale.unlink(missing_ok=True)
+    tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(slim, f)
+    os.replace(tmp_path, cache_path)
+    return slim
+
+
+class FunctionCodec:
+    """Selector and ABI types of one contract function, worked out once"""
+
+    def __init__(self, fn_abi):
+        self.abi = fn_abi
+        self.selector = function_abi_to_4byte_selector(fn_abi)
+        self.input_types = [collapse_if_tuple(i) for i in fn_abi['inputs']]
+        self.output_types = [collapse_if_tuple(o) for o in fn_abi.get('outputs', [])]
+
+    def encode(self, codec, args):
+        return self.selector + codec.encode(self.input_types, args)
+
+    def decode(self, codec, data):
+        """Decode call output the same way ContractFunction.call() returns it"""
+        values = codec.decode(self.output_types, data)
+        # Same normalizers call() applies, e.g. checksummed addresses
+        values = map_abi_data(BASE_RETURN_NORMALIZERS, self.output_types, values)
+        return values[0] if len(values) == 1 else list(values)
+
+
+def prebuild_functions(contract):
+    """Bind every non-overloaded function of a contract to its ABI entry up front
+
+    contract.functions.name(...) normally searches the whole ABI and
+    type-checks the arguments against each candidate on every call. With
+    the entry pre-set that lookup is skipped. The attached FunctionCodec
+    (contract_function.codec) lets batched calls encode and decode
+    without rebuilding selectors and types.
+    """
+    entries = {}
+    for fn_abi in contract.abi:
+        if fn_abi.get('type') == 'function':
+            entries.setdefault(fn_abi['name'], []).append(fn_abi)
+    for name, candidates in entries.items():
+        if len(candidates) != 1:
+            continue
+        factory = ContractFunction.factory(
+            name,
+            w3=contract.w3,
+            contract_abi=contract.abi,
+            address=contract.address,
+            decode_tuples=contract.decode_tuples,
+            function_identifier=name,
+            abi=candidates[0],
+        )
+        factory.codec = FunctionCodec(candidates[0])
+        setattr(contract.functions, name, factory)
+    return contract
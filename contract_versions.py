@@ -0,0 +1,214 @@
+# contract_versions.py
+from web3 import Web3
+
+
+def to_bytes32(value, field='value'):
+    """Encode a short UTF-8 string as a right-padded bytes32 value"""
+    encoded = value.encode('utf-8')
+    if len(encoded) > 32:
+        raise ValueError(f'{field} must be at most 32 bytes for contract v2')
+    return encoded.ljust(32, b'\0')
+
+
+def from_bytes32(value):
+    """Decode a right-padded bytes32 value back into a string"""
+    return bytes(value).rstrip(b'\0').decode('utf-8')
+
+
+def function_names(abi):
+    return {item.get('name') for item in abi if item.get('type') == 'function'}
+
+
+def detect_version(abi):
+    """Return 2 for the batch-capable PharmaSupplyChainV2 ABI, 1 otherwise"""
+    return 2 if 'registerProducts' in function_names(abi) else 1
+
+
+class PharmaSupplyChainV1:
+    """Builds calls for the original string-keyed contract and normalizes its results
+
+    Every version exposes the same methods and returns product and transfer
+    tuples in the v1 layout, so callers and formatters never need to know
+    which contract is deployed.
+    """
+
+    version = 1
+
+    def __init__(self, contract):
+        self.contract = contract
+        self.events = contract.events
+        # Deployments that predate getTransferHistorySlice page through the full history instead
+        self.history_paging = 'getTransferHistorySlice' in function_names(contract.abi)
+
+    @staticmethod
+    def product_key(product_id, serial_number):
+        """keccak256(abi.encodePacked(productId, serialNumber)), as the contract computes it"""
+        return Web3.solidity_keccak(['string', 'string'], [product_id, serial_number])
+
+    def register_product(self, product_id, manufacturer, batch_number, manufacture_date,
+                         expiry_date, gtin, serial_number):
+        return self.contract.functions.registerProduct(
+            product_id, manufacturer, batch_number, manufacture_date, expiry_date, gtin, serial_number
+        )
+
+    def register_products(self, products):
+        """Single-transaction batch registration, or None if the contract can't do it"""
+        return None
+
+    def transfer_product(self, product_id, serial_number, new_owner, transfer_type):
+        return self.contract.functions.transferProduct(product_id, serial_number, new_owner, transfer_type)
+
+    def product_args(self, product_id, serial_number):
+        """Arguments the view functions take to identify a product"""
+        return (product_id, serial_number)
+
+    def get_product_info(self, product_id, serial_number):
+        return self.contract.functions.getProductInfo(*self.product_args(product_id, serial_number))
+
+    def get_transfer_history(self, product_id, serial_number):
+        return self.contract.functions.getTransferHistory(*self.product_args(product_id, serial_number))
+
+    def get_transfer_count(self, product_id, serial_number):
+        return self.contract.functions.getTransferCount(*self.product_args(product_id, serial_number))
+
+    def get_transfer_history_slice(self, product_id, serial_number, offset, limit):
+        return self.contract.functions.getTransferHistorySlice(
+            *self.product_args(product_id, serial_number), offset, limit
+        )
+
+    def get_latest_transfer(self, product_id, serial_number):
+        return self.contract.functions.getLatestTransfer(*self.product_args(product_id, serial_number))
+
+    def decode_product_info(self, product_tuple):
+        return product_tuple
+
+    def decode_transfer_history(self, transfers):
+        return transfers
+
+    def decode_event_args(self, args):
+        return dict(args)
+
+    def fetch_product_info(self, product_id, serial_number, block_identifier='latest'):
+        """Call getProductInfo and return the v1-layout tuple"""
+        return self.decode_product_info(
+            self.get_product_info(product_id, serial_number).call(block_identifier=block_identifier)
+        )
+
+    def fetch_transfer_history(self, product_id, serial_number, block_identifier='latest'):
+        """Call getTransferHistory and return v1-layout transfer tuples"""
+        return self.decode_transfer_history(
+            self.get_transfer_history(product_id, serial_number).call(block_identifier=block_identifier)
+        )
+
+    def fetch_transfer_count(self, product_id, serial_number, block_identifier='latest'):
+        """Return the number of transfers recorded for a product"""
+        if self.history_paging:
+            return self.get_transfer_count(product_id, serial_number).call(block_identifier=block_identifier)
+        return len(self.fetch_transfer_history(product_id, serial_number, block_identifier))
+
+    def fetch_transfer_page(self, product_id, serial_number, offset, limit, block_identifier='latest'):
+        """Return (v1-layout transfers[offset:offset + limit], total number of transfers)"""
+        if self.history_paging:
+            page, total = self.get_transfer_history_slice(
+                product_id, serial_number, offset, limit
+            ).call(block_identifier=block_identifier)
+            return self.decode_transfer_history(page), total
+        history = self.fetch_transfer_history(product_id, serial_number, block_identifier)
+        return history[offset:offset + limit], len(history)
+
+    def fetch_latest_transfer(self, product_id, serial_number, block_identifier='latest'):
+        """Return (most recent v1-layout transfer or None, total number of transfers)"""
+        if self.history_paging:
+            latest, total = self.get_latest_transfer(product_id, serial_number).call(
+                block_identifier=block_identifier
+            )
+            return (self.decode_transfer_history([latest])[0] if total else None), total
+        history = self.fetch_transfer_history(product_id, serial_number, block_identifier)
+        return (history[-1] if history else None), len(history)
+
+
+class PharmaSupplyChainV2(PharmaSupplyChainV1):
+    """Adapter for the packed bytes32-keyed contract with batch register/transfer"""
+
+    version = 2
+
+    @staticmethod
+    def product_key(product_id, serial_number):
+        return Web3.solidity_keccak(
+            ['bytes32', 'bytes32'],
+            [to_bytes32(product_id, 'product_id'), to_bytes32(serial_number, 'serial_number')]
+        )
+
+    @staticmethod
+    def _new_product(product_id, manufacturer, batch_number, manufacture_date,
+                     expiry_date, gtin, serial_number):
+        return (
+            to_bytes32(product_id, 'product_id'),
+            to_bytes32(serial_number, 'serial_number'),
+            to_bytes32(manufacturer, 'manufacturer'),
+            to_bytes32(batch_number, 'batch_number'),
+            to_bytes32(gtin, 'gtin'),
+            manufacture_date,
+            expiry_date,
+        )
+
+    def register_product(self, *args):
+        return self.contract.functions.registerProduct(self._new_product(*args))
+
+    def register_products(self, products):
+        """products is a list of register_product argument tuples"""
+        return self.contract.functions.registerProducts([self._new_product(*p) for p in products])
+
+    def transfer_product(self, product_id, serial_number, new_owner, transfer_type):
+        return self.contract.functions.transferProduct(
+            to_bytes32(product_id, 'product_id'),
+            to_bytes32(serial_number, 'serial_number'),
+            new_owner,
+            to_bytes32(transfer_type, 'transfer_type')
+        )
+
+    def transfer_products(self, products, new_owner, transfer_type):
+        """products is a list of (product_id, serial_number) pairs"""
+        return self.contract.functions.transferProducts(
+            [to_bytes32(p, 'product_id') for p, _ in products],
+            [to_bytes32(s, 'serial_number') for _, s in products],
+            new_owner,
+            to_bytes32(transfer_type, 'transfer_type')
+        )
+
+    def product_args(self, product_id, serial_number):
+        return (self.product_key(product_id, serial_number),)
+
+    def decode_product_info(self, product_tuple):
+        product_id, manufacturer, batch_number, manufacture_date, expiry_date, owner, gtin, serial = product_tuple
+        return (
+            from_bytes32(product_id),
+            from_bytes32(manufacturer),
+            from_bytes32(batch_number),
+            manufacture_date,
+            expiry_date,
+            owner,
+            from_bytes32(gtin),
+            from_bytes32(serial),
+        )
+
+    def decode_transfer_history(self, transfers):
+        # v2 stores (from, timestamp, to, transferType) to pack from + timestamp into one slot
+        return [
+            (sender, receiver, timestamp, from_bytes32(transfer_type))
+            for sender, timestamp, receiver, transfer_type in transfers
+        ]
+
+    def decode_event_args(self, args):
+        decoded = dict(args)
+        for field in ('productId', 'serialNumber', 'manufacturer', 'transferType'):
+            if field in decoded:
+                decoded[field] = from_bytes32(decoded[field])
+        return decoded
+
+
+def supply_chain_for(contract):
+    """Wrap a web3 contract in the adapter matching its ABI"""
+    if detect_version(contract.abi) == 2:
+        return PharmaSupplyChainV2(contract)
+    return PharmaSupplyChainV1(contract)
@@ -148,4 +148,55 @@ contract PharmaSupplyChain {
         
         return transferHistory[productKey];
     }
-}
\ No newline at end of file
+    
+    function getTransferCount(string memory productId, string memory serialNumber)
+        public
+        view
+        returns (uint256)
+    {
+        bytes32 productKey = getProductKey(productId, serialNumber);
+        require(products[productKey].exists, "Product does not exist");
+        
+        return transferHistory[productKey].length;
+    }
+    
+    function getTransferHistorySlice(
+        string memory productId,
+        string memory serialNumber,
+        uint256 offset,
+        uint256 limit
+    )
+        public
+        view
+        returns (Transfer[] memory page, uint256 total)
+    {
+        bytes32 productKey = getProductKey(productId, serialNumber);
+        require(products[productKey].exists, "Product does not exist");
+        
+        Transfer[] storage history = transferHistory[productKey];
+        total = history.length;
+        uint256 count = offset < total ? total - offset : 0;
+        if (limit < count) {
+            count = limit;
+        }
+        
+        page = new Transfer[](count);
+        for (uint256 i = 0; i < count; i++) {
+            page[i] = history[offset + i];
+        }
+    }
+    
+    function getLatestTransfer(string memory productId, string memory serialNumber)
+        public
+        view
+        returns (Transfer memory latest, uint256 total)
+    {
+        bytes32 productKey = getProductKey(productId, serialNumber);
+        require(products[productKey].exists, "Product does not exist");
+        
+        total = transferHistory[productKey].length;
+        if (total > 0) {
+            latest = transferHistory[productKey][total - 1];
+        }
+    }
+}
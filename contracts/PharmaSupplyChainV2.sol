@@ -0,0 +1,233 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.0;
+
+/// Gas-optimized PharmaSupplyChain: fixed-size fields, packed storage and batch writes.
+/// Products are addressed by key = keccak256(abi.encodePacked(productId, serialNumber)),
+/// which clients can compute off-chain from the two bytes32 ids.
+contract PharmaSupplyChainV2 {
+    uint8 private constant FLAG_EXISTS = 1;
+
+    struct Product {
+        // slot 0: owner, flags and manufacture date share one word
+        address currentOwner;
+        uint8 flags;
+        uint64 manufactureDate;
+        // slot 1
+        uint64 expiryDate;
+        // slots 2-6
+        bytes32 productId;
+        bytes32 serialNumber;
+        bytes32 manufacturer;
+        bytes32 batchNumber;
+        bytes32 gtin;
+    }
+
+    struct Transfer {
+        // slot 0: sender and timestamp share one word
+        address from;
+        uint64 timestamp;
+        // slot 1
+        address to;
+        // slot 2
+        bytes32 transferType;
+    }
+
+    struct NewProduct {
+        bytes32 productId;
+        bytes32 serialNumber;
+        bytes32 manufacturer;
+        bytes32 batchNumber;
+        bytes32 gtin;
+        uint64 manufactureDate;
+        uint64 expiryDate;
+    }
+
+    mapping(bytes32 => Product) private products;
+
+    mapping(bytes32 => Transfer[]) private transferHistory;
+
+    event ProductRegistered(
+        bytes32 indexed key,
+        bytes32 productId,
+        bytes32 serialNumber,
+        bytes32 manufacturer,
+        uint256 timestamp
+    );
+
+    event ProductTransferred(
+        bytes32 indexed key,
+        bytes32 productId,
+        bytes32 serialNumber,
+        address from,
+        address to,
+        bytes32 transferType,
+        uint256 timestamp
+    );
+
+    function productKey(bytes32 productId, bytes32 serialNumber)
+        public
+        pure
+        returns (bytes32)
+    {
+        return keccak256(abi.encodePacked(productId, serialNumber));
+    }
+
+    function registerProduct(NewProduct calldata item) external {
+        _register(item);
+    }
+
+    function registerProducts(NewProduct[] calldata items) external {
+        for (uint256 i = 0; i < items.length; ) {
+            _register(items[i]);
+            unchecked { ++i; }
+        }
+    }
+
+    function transferProduct(
+        bytes32 productId,
+        bytes32 serialNumber,
+        address newOwner,
+        bytes32 transferType
+    ) external {
+        _transfer(productId, serialNumber, newOwner, transferType);
+    }
+
+    function transferProducts(
+        bytes32[] calldata productIds,
+        bytes32[] calldata serialNumbers,
+        address newOwner,
+        bytes32 transferType
+    ) external {
+        require(productIds.length == serialNumbers.length, "Length mismatch");
+        for (uint256 i = 0; i < productIds.length; ) {
+            _transfer(productIds[i], serialNumbers[i], newOwner, transferType);
+            unchecked { ++i; }
+        }
+    }
+
+    function getProductInfo(bytes32 key)
+        external
+        view
+        returns (
+            bytes32,
+            bytes32,
+            bytes32,
+            uint64,
+            uint64,
+            address,
+            bytes32,
+            bytes32
+        )
+    {
+        Product storage product = products[key];
+        require(product.flags & FLAG_EXISTS != 0, "Product does not exist");
+        return (
+            product.productId,
+            product.manufacturer,
+            product.batchNumber,
+            product.manufactureDate,
+            product.expiryDate,
+            product.currentOwner,
+            product.gtin,
+            product.serialNumber
+        );
+    }
+
+    function getTransferHistory(bytes32 key)
+        external
+        view
+        returns (Transfer[] memory)
+    {
+        require(products[key].flags & FLAG_EXISTS != 0, "Product does not exist");
+        return transferHistory[key];
+    }
+
+    function getTransferCount(bytes32 key) external view returns (uint256) {
+        require(products[key].flags & FLAG_EXISTS != 0, "Product does not exist");
+        return transferHistory[key].length;
+    }
+
+    /// Transfers [offset, offset + limit) plus the full history length, clamped to the end
+    function getTransferHistorySlice(bytes32 key, uint256 offset, uint256 limit)
+        external
+        view
+        returns (Transfer[] memory page, uint256 total)
+    {
+        require(products[key].flags & FLAG_EXISTS != 0, "Product does not exist");
+        Transfer[] storage history = transferHistory[key];
+        total = history.length;
+        uint256 count = offset < total ? total - offset : 0;
+        if (limit < count) {
+            count = limit;
+        }
+        page = new Transfer[](count);
+        for (uint256 i = 0; i < count; ) {
+            page[i] = history[offset + i];
+            unchecked { ++i; }
+        }
+    }
+
+    /// Most recent transfer (zeroed when there is none) and the history length
+    function getLatestTransfer(bytes32 key)
+        external
+        view
+        returns (Transfer memory latest, uint256 total)
+    {
+        require(products[key].flags & FLAG_EXISTS != 0, "Product does not exist");
+        total = transferHistory[key].length;
+        if (total > 0) {
+            latest = transferHistory[key][total - 1];
+        }
+    }
+
+    function _register(NewProduct calldata item) private {
+        bytes32 key = productKey(item.productId, item.serialNumber);
+        require(products[key].flags & FLAG_EXISTS == 0, "Product already registered");
+
+        products[key] = Product({
+            currentOwner: msg.sender,
+            flags: FLAG_EXISTS,
+            manufactureDate: item.manufactureDate,
+            expiryDate: item.expiryDate,
+            productId: item.productId,
+            serialNumber: item.serialNumber,
+            manufacturer: item.manufacturer,
+            batchNumber: item.batchNumber,
+            gtin: item.gtin
+        });
+
+        emit ProductRegistered(key, item.productId, item.serialNumber, item.manufacturer, block.timestamp);
+    }
+
+    function _transfer(
+        bytes32 productId,
+        bytes32 serialNumber,
+        address newOwner,
+        bytes32 transferType
+    ) private {
+        bytes32 key = productKey(productId, serialNumber);
+        Product storage product = products[key];
+        require(product.flags & FLAG_EXISTS != 0, "Product does not exist");
+
+        address previousOwner = product.currentOwner;
+        require(previousOwner == msg.sender, "Not authorized to transfer");
+        product.currentOwner = newOwner;
+
+        transferHistory[key].push(Transfer({
+            from: previousOwner,
+            timestamp: uint64(block.timestamp),
+            to: newOwner,
+            transferType: transferType
+        }));
+
+        emit ProductTransferred(
+            key,
+            productId,
+            serialNumber,
+            previousOwner,
+            newOwner,
+            transferType,
+            block.timestamp
+        );
+    }
+}
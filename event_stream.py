@@ -0,0 +1,334 @@
+# event_stream.py
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from eth_utils import event_abi_to_log_topic
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+EVENT_NAMES = ('ProductRegistered', 'ProductTransferred')
+
+
+def parse_event_id(value):
+    """Parse a 'block:logIndex' event id into a tuple, or None"""
+    try:
+        block, log_index = value.split(':')
+        return int(block), int(log_index)
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_sse(event):
+    """Render an event dict as one server-sent event frame"""
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+class Subscription:
+    """One connected client: its filters and a bounded queue of matching events
+
+    The hub never blocks on a client. When the queue is full the client is
+    marked overflowed and the stream closes; the browser reconnects with
+    Last-Event-ID and resumes from the hub's buffer.
+    """
+
+    def __init__(self, product_id=None, serial_number=None, batch_number=None, owner=None, max_queue=1000):
+        self.product_id = product_id
+        self.serial_number = serial_number
+        self.batch_number = batch_number
+        self.owner = owner.lower() if owner else None
+        self.max_queue = max_queue
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+        self.last_position = None
+
+    def matches(self, event, batch_of):
+        if self.product_id is not None and event['product_id'] != self.product_id:
+            return False
+        if self.serial_number is not None and event['serial_number'] != self.serial_number:
+            return False
+        if self.owner is not None:
+            if event['event'] != 'ProductTransferred':
+                return False
+            if self.owner not in (event['from'].lower(), event['to'].lower()):
+                return False
+        if self.batch_number is not None:
+            return batch_of(event['product_id'], event['serial_number']) == self.batch_number
+        return True
+
+    def offer(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+
+class AsyncSubscription(Subscription):
+    """Subscription read from an asyncio event loop, so a waiting client holds no thread
+
+    The hub publishes from its own thread; events are handed to the loop
+    with call_soon_threadsafe. The pending count is kept here, so an
+    overflow is still detected the moment the hub offers one event too many.
+    """
+
+    def __init__(self, loop, **filters):
+        super().__init__(**filters)
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def offer(self, event):
+        with self._pending_lock:
+            if self.overflowed:
+                return
+            if self._pending >= self.max_queue:
+                self.overflowed = True
+                return
+            self._pending += 1
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def get(self, timeout):
+        """Next event, or asyncio.TimeoutError after timeout seconds"""
+        event = await asyncio.wait_for(self.queue.get(), timeout)
+        with self._pending_lock:
+            self._pending -= 1
+        return event
+
+    def drained(self):
+        with self._pending_lock:
+            return self._pending == 0
+
+
+class EventHub:
+    """Follows ProductRegistered/ProductTransferred logs once and fans them out to subscribers
+
+    With an event indexer the hub reuses its feed (attach_indexer). In a
+    worker process that doesn't follow the chain itself, it reads the
+    events the leader process shares (follow_shared_log). Otherwise one
+    background thread polls get_logs. Either way the node sees the same
+    load however many clients are connected. The last buffer_size events
+    are kept for Last-Event-ID resumes. Older positions are replayed from
+    the chain, at most max_replay_blocks back.
+    """
+
+    def __init__(self, w3, supply_chain, buffer_size=10000, max_replay_blocks=10000,
+                 chunk_size=2000, poll_interval=1.0, max_clients=1000, client_queue_size=1000):
+        self.w3 = w3
+        self.supply_chain = supply_chain
+        self.contract = supply_chain.contract
+        self.buffer = deque(maxlen=buffer_size)
+        self.max_replay_blocks = max_replay_blocks
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.max_clients = max_clients
+        self.client_queue_size = client_queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._listeners = []
+        self._thread = None
+        self._indexer = None
+        self._shared_log = None
+        self._shared_position = None
+        self._batches = TTLCache(maxsize=100000, ttl=float('inf'))
+        # Every event from this block on is in the buffer
+        self.covered_from_block = None
+        self.last_block = None
+        self.published = 0
+        self.overflows = 0
+        self._topics = {}
+        for name in EVENT_NAMES:
+            event = getattr(self.contract.events, name)()
+            self._topics[self.w3.to_hex(event_abi_to_log_topic(event.abi))] = event
+
+    # --- feed ---------------------------------------------------------------
+
+    def attach_indexer(self, indexer):
+        """Publish the indexer's events instead of polling the node separately"""
+        self._indexer = indexer
+        indexer.subscribe(self._on_indexed)
+
+    def follow_shared_log(self, shared_log):
+        """Publish the events another process appends to a SharedEventLog instead of polling the node"""
+        self._shared_log = shared_log
+
+    def _on_indexed(self, name, args, log):
+        if self.covered_from_block is not None:
+            self.publish(self.to_event(name, args, log))
+
+    def start(self):
+        """Begin following the chain at the current head (called on first use)"""
+        with self._lock:
+            if self.covered_from_block is not None:
+                return
+            if self._indexer is not None:
+                last = self._indexer.last_indexed_block
+                self.covered_from_block = (last + 1) if last is not None else 0
+                return
+            self.last_block = self.w3.eth.block_number
+            self.covered_from_block = self.last_block + 1
+            if self._shared_log is not None:
+                self._shared_position = self._shared_log.last_position()
+            self._thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Event stream poll failed: {e}")
+            time.sleep(self.poll_interval)
+
+    def poll(self):
+        if self._shared_log is not None:
+            while True:
+                rows = self._shared_log.read_after(self._shared_position)
+                for position, event in rows:
+                    self.publish(event)
+                    self._shared_position = position
+                if not rows:
+                    return
+        head = self.w3.eth.block_number
+        while self.last_block < head:
+            to_block = min(self.last_block + self.chunk_size, head)
+            for event in self.fetch(self.last_block + 1, to_block):
+                self.publish(event)
+            self.last_block = to_block
+
+    def fetch(self, from_block, to_block):
+        """Decoded events between two blocks, read from the node"""
+        events = []
+        for start in range(from_block, to_block + 1, self.chunk_size):
+            logs = self.w3.eth.get_logs({
+                'address': self.contract.address,
+                'fromBlock': start,
+                'toBlock': min(start + self.chunk_size - 1, to_block),
+                'topics': [list(self._topics)],
+            })
+            for log in sorted(logs, key=lambda l: (l['blockNumber'], l['logIndex'])):
+                event = self._topics.get(self.w3.to_hex(log['topics'][0]))
+                if event is None:
+                    continue
+                decoded = event.process_log(log)
+                events.append(self.to_event(
+                    decoded['event'], self.supply_chain.decode_event_args(decoded['args']), log
+                ))
+        return events
+
+    def to_event(self, name, args, log):
+        event = {
+            'id': f"{log['blockNumber']}:{log['logIndex']}",
+            'event': name,
+            'block_number': log['blockNumber'],
+            'log_index': log['logIndex'],
+            'transaction_hash': self.w3.to_hex(log['transactionHash']),
+            'product_id': args['productId'],
+            'serial_number': args['serialNumber'],
+            'timestamp': datetime.fromtimestamp(args['timestamp']).isoformat(),
+        }
+        if name == 'ProductTransferred':
+            event.update({'from': args['from'], 'to': args['to'], 'transfer_type': args['transferType']})
+        else:
+            event['manufacturer'] = args['manufacturer']
+        return event
+
+    def batch_of(self, product_id, serial_number):
+        """Batch number of a product, looked up once per product for batch filters"""
+        key = (product_id, serial_number)
+        batch = self._batches.get(key)
+        if batch is None:
+            product = None
+            if self._indexer is not None:
+                product = self._indexer.get_product_info(product_id, serial_number)
+            if product is None:
+                product = self.supply_chain.fetch_product_info(product_id, serial_number)
+            batch = product[2]
+            self._batches.set(key, batch)
+        return batch
+
+    # --- fan-out ------------------------------------------------------------
+
+    def listen(self, callback):
+        """Call callback(event) for every published event, e.g. to invalidate caches"""
+        self._listeners.append(callback)
+
+    def publish(self, event):
+        with self._lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                # The oldest buffered block may lose events, resumes before it go to the chain
+                self.covered_from_block = max(self.covered_from_block, self.buffer[0]['block_number'] + 1)
+            self.buffer.append(event)
+            self.published += 1
+            subscribers = list(self._subscribers)
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Event stream listener failed for {event['id']}: {e}")
+        for subscription in subscribers:
+            try:
+                if subscription.matches(event, self.batch_of):
+                    was_overflowed = subscription.overflowed
+                    subscription.offer(event)
+                    if subscription.overflowed and not was_overflowed:
+                        self.overflows += 1
+            except Exception as e:
+                logger.error(f"Event stream filter failed for {event['id']}: {e}")
+
+    def subscribe(self, subscription, after=None):
+        """Register a client and return the events it missed since position `after`
+
+        Returns (replay, complete); complete is False when `after` is older
+        than max_replay_blocks, so the client should re-read current state.
+        """
+        self.start()
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                raise OverflowError('Too many event stream clients')
+            self._subscribers.add(subscription)
+            buffered = [e for e in self.buffer if after is None or (e['block_number'], e['log_index']) > after]
+            covered_from = self.covered_from_block
+
+        if after is None:
+            return [], True
+        replay, complete = [], True
+        if after[0] < covered_from:
+            from_block = after[0]
+            if covered_from - from_block > self.max_replay_blocks:
+                from_block = covered_from - self.max_replay_blocks
+                complete = False
+            if from_block < covered_from:
+                replay = [
+                    e for e in self.fetch(from_block, covered_from - 1)
+                    if (e['block_number'], e['log_index']) > after
+                ]
+        replay = [e for e in replay if subscription.matches(e, self.batch_of)]
+        return replay + [e for e in buffered if subscription.matches(e, self.batch_of)], complete
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._subscribers),
+                'buffered_events': len(self.buffer),
+                'covered_from_block': self.covered_from_block,
+                'published': self.published,
+                'overflows': self.overflows,
+                'source': (
+                    'shared_log' if self._shared_log is not None
+                    else 'indexer' if self._indexer is not None else 'poll'
+                ),
+            }
@@ -0,0 +1,205 @@
+# fee_oracle.py
+import asyncio
+import threading
+import time
+
+from web3.exceptions import ContractLogicError
+
+from rpc_batch import encode_call
+
+
+class FeeOracle:
+    """Shares one gas price (or EIP-1559 fee pair) across requests, refreshed once per block
+
+    With a ChainHead (head) the fees are refreshed when its block number
+    changes, so they follow the chain whether blocks come every second or
+    every minute. Without one they are refreshed every max_age seconds.
+    With mode='legacy' a refresh is a single eth_gasPrice call. With
+    mode='eip1559' it reads the latest block's base fee and the node's
+    suggested priority fee, and offers maxFeePerGas = 2 * baseFee + tip so a
+    transaction stays valid for a few blocks of rising base fees.
+    """
+
+    def __init__(self, w3, mode='legacy', max_age=2.0, head=None):
+        self.w3 = w3
+        self.mode = mode
+        self.max_age = max_age
+        self.head = head
+        self._lock = threading.Lock()
+        self._params = None
+        self._block_number = None
+        self._fetched_at = 0.0
+        self.refreshes = 0
+        self.hits = 0
+
+    def fee_params(self):
+        """Return the fee fields to merge into a transaction dict"""
+        head = self.head.block_number() if self.head is not None else None
+        with self._lock:
+            if self._expired(head):
+                self._refresh(head)
+            else:
+                self.hits += 1
+            return dict(self._params)
+
+    def _expired(self, head):
+        if self._params is None:
+            return True
+        if head is not None:
+            return head != self._block_number
+        return time.monotonic() - self._fetched_at >= self.max_age
+
+    def _refresh(self, head=None):
+        if self.mode == 'eip1559':
+            block = self.w3.eth.get_block('latest' if head is None else head)
+            base_fee = block['baseFeePerGas']
+            priority_fee = self.w3.eth.max_priority_fee
+            self._params = {
+                'maxFeePerGas': 2 * base_fee + priority_fee,
+                'maxPriorityFeePerGas': priority_fee,
+            }
+            self._block_number = block['number']
+        else:
+            self._params = {'gasPrice': self.w3.eth.gas_price}
+            self._block_number = head
+        self._fetched_at = time.monotonic()
+        self.refreshes += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'refresh_on': 'block' if self.head is not None else f'{self.max_age}s',
+                'current': dict(self._params) if self._params else None,
+                'block_number': self._block_number,
+                'age_seconds': round(time.monotonic() - self._fetched_at, 3) if self._params else None,
+                'refreshes': self.refreshes,
+                'hits': self.hits,
+            }
+
+
+class GasEstimator:
+    """Caches eth_estimateGas results per contract function and calldata size
+
+    Storage cost for these contracts grows with the length of the string
+    arguments, so the ABI-encoded calldata length is used as the size class.
+    Estimates expire after ttl seconds and are padded by margin (0.2 = +20%).
+    """
+
+    def __init__(self, w3, margin=0.2, ttl=300.0, fallback_gas=2000000):
+        self.w3 = w3
+        self.margin = margin
+        self.ttl = ttl
+        self.fallback_gas = fallback_gas
+        self._lock = threading.Lock()
+        self._estimates = {}
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def gas_limit(self, contract_function, sender_address):
+        """Return a padded gas limit for this call, estimating only on a cache miss"""
+        calldata = encode_call(self.w3, contract_function)['data']
+        key = (contract_function.fn_name, len(calldata))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._estimates.get(key)
+            if cached is not None and now - cached[1] < self.ttl:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        try:
+            estimate = contract_function.estimate_gas({'from': sender_address})
+        except ContractLogicError:
+            # The call would revert on chain, let the caller report why
+            raise
+        except Exception:
+            with self._lock:
+                self.fallbacks += 1
+            return self.fallback_gas
+
+        gas_limit = int(estimate * (1 + self.margin))
+        with self._lock:
+            self._estimates[key] = (gas_limit, now)
+        return gas_limit
+
+    def stats(self):
+        with self._lock:
+            return {
+                'margin': self.margin,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'fallbacks': self.fallbacks,
+                'estimates': {
+                    f'{fn_name}:{size}': gas_limit
+                    for (fn_name, size), (gas_limit, _) in self._estimates.items()
+                },
+            }
+
+
+class AsyncFeeOracle(FeeOracle):
+    """FeeOracle for AsyncWeb3; concurrent callers share a single refresh
+
+    ChainHead is synchronous, so this one always refreshes on the max_age timer.
+    """
+
+    def __init__(self, w3, mode='legacy', max_age=2.0):
+        super().__init__(w3, mode, max_age)
+        self._async_lock = asyncio.Lock()
+
+    async def fee_params(self):
+        async with self._async_lock:
+            if self._expired(None):
+                await self._refresh()
+            else:
+                self.hits += 1
+            return dict(self._params)
+
+    async def _refresh(self):
+        if self.mode == 'eip1559':
+            block = await self.w3.eth.get_block('latest')
+            priority_fee = await self.w3.eth.max_priority_fee
+            params = {
+                'maxFeePerGas': 2 * block['baseFeePerGas'] + priority_fee,
+                'maxPriorityFeePerGas': priority_fee,
+            }
+            block_number = block['number']
+        else:
+            params = {'gasPrice': await self.w3.eth.gas_price}
+            block_number = None
+        with self._lock:
+            self._params = params
+            self._block_number = block_number
+            self._fetched_at = time.monotonic()
+            self.refreshes += 1
+
+
+class AsyncGasEstimator(GasEstimator):
+    """GasEstimator for AsyncWeb3 contract functions"""
+
+    async def gas_limit(self, contract_function, sender_address):
+        calldata = encode_call(self.w3, contract_function)['data']
+        key = (contract_function.fn_name, len(calldata))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._estimates.get(key)
+            if cached is not None and now - cached[1] < self.ttl:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        try:
+            estimate = await contract_function.estimate_gas({'from': sender_address})
+        except ContractLogicError:
+            raise
+        except Exception:
+            with self._lock:
+                self.fallbacks += 1
+            return self.fallback_gas
+
+        gas_limit = int(estimate * (1 + self.margin))
+        with self._lock:
+            self._estimates[key] = (gas_limit, now)
+        return gas_limit
@@ -0,0 +1,42 @@
+# gunicorn.conf.py
+"""Production entry point running app.py in several worker processes
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Workers share nonce counters and async transaction state through a SQLite
+file (SHARED_STATE_PATH), so parallel writes from the same account get
+consecutive nonces no matter which worker serves them. One of them takes
+the leader lock next to that file and runs the indexer, product filter
+and event feed for all of them (see app.py).
+"""
+import multiprocessing
+import os
+import tempfile
+
+from shared_state import SharedState
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+
+# Synchronous writes block on receipts, so each worker serves requests from a thread pool
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# Every worker imports app.py itself; the background threads it starts
+# (receipt tracker, and in the leader the indexer) would not survive a fork
+# from a preloaded master
+preload_app = False
+
+# Workers inherit this from the master; /dev/shm keeps the file in memory
+state_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+os.environ.setdefault(
+    'SHARED_STATE_PATH',
+    os.path.join(state_dir, f"pharma-supply-chain-{bind.rsplit(':', 1)[-1]}.sqlite3")
+)
+
+
+def on_starting(server):
+    # Nonces left by a previous run may no longer match the chain
+    SharedState.reset(os.environ['SHARED_STATE_PATH'])
+    server.log.info(f"Shared worker state in {os.environ['SHARED_STATE_PATH']}")
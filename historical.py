@@ -0,0 +1,137 @@
+# historical.py
+import json
+import sqlite3
+import threading
+from bisect import bisect_right, insort
+
+from cache import TTLCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verify_results (
+    contract TEXT NOT NULL,
+    block_hash TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    serial_number TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (contract, block_hash, product_id, serial_number)
+);
+"""
+
+
+class BlockTimeIndex:
+    """Block headers by number, and the block that was the head at a given time
+
+    Headers at least finality_depth blocks below the head are cached for
+    good, and every cached header also narrows later timestamp searches, so
+    repeated lookups around the same dates stop reaching the node. Newer
+    headers may still be reorged and are always read fresh.
+    """
+
+    def __init__(self, w3, finality_depth=12, maxsize=100000):
+        self.w3 = w3
+        self.finality_depth = finality_depth
+        self.maxsize = maxsize
+        self._headers = TTLCache(maxsize=maxsize, ttl=float('inf'))
+        self._lock = threading.Lock()
+        # Sorted (timestamp, number) of the cached headers, used as search bounds
+        self._known = []
+
+    def is_final(self, number, head):
+        return head - number >= self.finality_depth
+
+    def header(self, number, head):
+        """{'number', 'hash', 'timestamp'} of a block, head being the current block number"""
+        header = self._headers.get(number)
+        if header is not None:
+            return header
+        block = self.w3.eth.get_block(number)
+        header = {'number': number, 'hash': self.w3.to_hex(block['hash']), 'timestamp': block['timestamp']}
+        if self.is_final(number, head):
+            self._headers.set(number, header)
+            with self._lock:
+                if len(self._known) < self.maxsize:
+                    insort(self._known, (header['timestamp'], number))
+        return header
+
+    def block_at(self, timestamp, head):
+        """Number of the last block mined at or before timestamp, or None if that is before genesis"""
+        low, high = 0, head
+        with self._lock:
+            position = bisect_right(self._known, (timestamp, float('inf')))
+            if position:
+                low = self._known[position - 1][1]
+            if position < len(self._known):
+                high = min(high, self._known[position][1] - 1)
+        if self.header(low, head)['timestamp'] > timestamp:
+            return None
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.header(middle, head)['timestamp'] <= timestamp:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def stats(self):
+        return self._headers.stats()
+
+
+class HistoricalResultCache:
+    """Verify results at finalized blocks, kept in SQLite and never expired
+
+    A product's state at a finalized block can't change, so the first
+    lookup of a (block, product) pair is the only one that reaches the node.
+    Entries are keyed by block hash rather than number, so a reset dev chain
+    or a redeployed contract never serves another chain's results.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, contract, block_hash, product_id, serial_number):
+        """The stored (product_info, transfer_history, transfer_count), or None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT result FROM verify_results '
+                'WHERE contract = ? AND block_hash = ? AND product_id = ? AND serial_number = ?',
+                (contract, block_hash, product_id, serial_number)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        result = json.loads(row[0])
+        transfer_count = result.get('transfer_count', len(result['transfer_history']))
+        return result['product_info'], result['transfer_history'], transfer_count
+
+    def set(self, contract, block_hash, product_id, serial_number, product_info, transfer_history,
+            transfer_count):
+        result = json.dumps({
+            'product_info': product_info,
+            'transfer_history': transfer_history,
+            'transfer_count': transfer_count,
+        })
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO verify_results VALUES (?, ?, ?, ?, ?)',
+                (contract, block_hash, product_id, serial_number, result)
+            )
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._db.execute('SELECT COUNT(*) FROM verify_results').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'size': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
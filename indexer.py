@@ -0,0 +1,329 @@
+# indexer.py
+import sqlite3
+import threading
+import time
+import logging
+
+from eth_utils import event_abi_to_log_topic
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT NOT NULL,
+    serial_number TEXT NOT NULL,
+    manufacturer TEXT NOT NULL,
+    batch_number TEXT NOT NULL,
+    manufacture_date INTEGER NOT NULL,
+    expiry_date INTEGER NOT NULL,
+    current_owner TEXT NOT NULL,
+    gtin TEXT NOT NULL,
+    registered_block INTEGER NOT NULL,
+    registered_at INTEGER NOT NULL,
+    PRIMARY KEY (product_id, serial_number)
+);
+CREATE INDEX IF NOT EXISTS idx_products_batch ON products (batch_number);
+CREATE INDEX IF NOT EXISTS idx_products_owner ON products (current_owner);
+CREATE TABLE IF NOT EXISTS transfers (
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    product_id TEXT NOT NULL,
+    serial_number TEXT NOT NULL,
+    from_address TEXT NOT NULL,
+    to_address TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    transfer_type TEXT NOT NULL,
+    transaction_hash TEXT NOT NULL,
+    PRIMARY KEY (block_number, log_index)
+);
+DROP INDEX IF EXISTS idx_transfers_product;
+CREATE INDEX IF NOT EXISTS idx_transfers_product_order
+    ON transfers (product_id, serial_number, block_number, log_index);
+"""
+
+PRODUCT_COLUMNS = (
+    'product_id, manufacturer, batch_number, manufacture_date, expiry_date, '
+    'current_owner, gtin, serial_number'
+)
+TRANSFER_COLUMNS = 'from_address, to_address, timestamp, transfer_type'
+
+
+class EventIndexer:
+    """Follows PharmaSupplyChain events into a local SQLite projection
+
+    Logs are fetched in block-range chunks and each chunk is applied in a
+    single SQLite transaction together with the block cursor, so a restart
+    only catches up on blocks it hasn't seen yet. The cursor also records
+    the contract address and the hash of its block. If either no longer
+    matches the node (a redeploy, a reset dev chain, a reorg past the
+    cursor), the projection is dropped and rebuilt from start_block.
+
+    The product and transfer tuples returned by the query methods have the
+    same layout as getProductInfo / getTransferHistory, so callers can pass
+    them straight to the existing formatters.
+    """
+
+    def __init__(self, w3, supply_chain, db_path, start_block=0, chunk_size=2000, confirmations=0):
+        self.w3 = w3
+        self.supply_chain = supply_chain
+        self.contract = supply_chain.contract
+        self.db_path = db_path
+        self.start_block = start_block
+        self.chunk_size = chunk_size
+        self.confirmations = confirmations
+        self.head_block = None
+        self.last_synced_at = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._topics = {}
+        for event in (self.contract.events.ProductRegistered(), self.contract.events.ProductTransferred()):
+            self._topics[self.w3.to_hex(event_abi_to_log_topic(event.abi))] = event
+
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    # --- cursor -------------------------------------------------------------
+
+    @property
+    def last_indexed_block(self):
+        """Highest block whose events are fully applied, or None before the first sync"""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'last_block'").fetchone()
+        return int(row[0]) if row else None
+
+    def _meta(self, key):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def status(self):
+        """Report how far behind the chain head the projection is"""
+        last_block = self.last_indexed_block
+        return {
+            'last_indexed_block': last_block,
+            'head_block': self.head_block,
+            'blocks_behind': (
+                self.head_block - last_block
+                if self.head_block is not None and last_block is not None else None
+            ),
+            'last_synced_at': self.last_synced_at,
+        }
+
+    # --- syncing ------------------------------------------------------------
+
+    def subscribe(self, callback):
+        """Call callback(event_name, args, log) for every event applied to the projection"""
+        self._listeners.append(callback)
+
+    def start(self, poll_interval=2.0):
+        """Keep syncing in a background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, args=(poll_interval,), name='event-indexer', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, poll_interval):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Event indexer sync failed: {e}")
+            time.sleep(poll_interval)
+
+    def sync(self):
+        """Catch up from the stored cursor to the chain head, one chunk at a time"""
+        self.head_block = self.w3.eth.block_number
+        target = self.head_block - self.confirmations
+        last_block = self.last_indexed_block
+        if last_block is not None and not self._cursor_matches(last_block):
+            last_block = None
+        from_block = self.start_block if last_block is None else last_block + 1
+
+        while from_block <= target:
+            to_block = min(from_block + self.chunk_size - 1, target)
+            # Read before the logs: a reorg in between then shows up as a
+            # mismatch on the next sync instead of going unnoticed
+            to_block_hash = self.w3.to_hex(self.w3.eth.get_block(to_block)['hash'])
+            logs = self.w3.eth.get_logs({
+                'address': self.contract.address,
+                'fromBlock': from_block,
+                'toBlock': to_block,
+                'topics': [list(self._topics)],
+            })
+            events = self._decode(logs)
+            with self._lock:
+                with self._db:
+                    for name, args, log, product in events:
+                        self._apply(name, args, log, product)
+                    self._db.executemany(
+                        'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                        [('last_block', str(to_block)), ('last_block_hash', to_block_hash),
+                         ('contract', self.contract.address)]
+                    )
+            for name, args, log, _ in events:
+                for callback in self._listeners:
+                    try:
+                        callback(name, args, log)
+                    except Exception as e:
+                        logger.error(f"Indexer listener failed on {name}: {e}")
+            from_block = to_block + 1
+
+        self.last_synced_at = time.time()
+
+    def _cursor_matches(self, last_block):
+        """Check the stored cursor against the contract and the node, resetting on a mismatch"""
+        with self._lock:
+            contract = self._meta('contract')
+            block_hash = self._meta('last_block_hash')
+        if contract != self.contract.address:
+            reason = f'contract changed from {contract} to {self.contract.address}'
+        elif last_block > self.head_block:
+            reason = f'cursor block {last_block} is past the chain head {self.head_block}'
+        elif self.w3.to_hex(self.w3.eth.get_block(last_block)['hash']) != block_hash:
+            reason = f'block {last_block} is no longer the one indexed'
+        else:
+            return True
+        logger.warning(f"Event index doesn't match the chain ({reason}), rebuilding from block {self.start_block}")
+        self.reset()
+        return False
+
+    def reset(self):
+        """Drop the projection and its cursor"""
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM transfers')
+                self._db.execute('DELETE FROM products')
+                self._db.execute('DELETE FROM meta')
+
+    def _decode(self, logs):
+        events = []
+        for log in sorted(logs, key=lambda l: (l['blockNumber'], l['logIndex'])):
+            event = self._topics.get(self.w3.to_hex(log['topics'][0]))
+            if event is None:
+                continue
+            decoded = event.process_log(log)
+            args = self.supply_chain.decode_event_args(decoded['args'])
+            product = None
+            if decoded['event'] == 'ProductRegistered':
+                # The event only carries the id fields, read the rest of the record as of that block
+                product = self.supply_chain.fetch_product_info(
+                    args['productId'], args['serialNumber'], block_identifier=log['blockNumber']
+                )
+            events.append((decoded['event'], args, log, product))
+        return events
+
+    def _apply(self, name, args, log, product):
+        if name == 'ProductRegistered':
+            self._db.execute(
+                'INSERT OR IGNORE INTO products (product_id, manufacturer, batch_number, '
+                'manufacture_date, expiry_date, current_owner, gtin, serial_number, '
+                'registered_block, registered_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (*product, log['blockNumber'], args['timestamp'])
+            )
+        elif name == 'ProductTransferred':
+            self._db.execute(
+                'INSERT OR IGNORE INTO transfers (block_number, log_index, product_id, '
+                'serial_number, from_address, to_address, timestamp, transfer_type, '
+                'transaction_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (log['blockNumber'], log['logIndex'], args['productId'], args['serialNumber'],
+                 args['from'], args['to'], args['timestamp'], args['transferType'],
+                 self.w3.to_hex(log['transactionHash']))
+            )
+            self._db.execute(
+                'UPDATE products SET current_owner = ? WHERE product_id = ? AND serial_number = ?',
+                (args['to'], args['productId'], args['serialNumber'])
+            )
+
+    # --- queries ------------------------------------------------------------
+
+    def get_product(self, product_id, serial_number):
+        """Return (product_tuple, transfer_tuples) for a product, or None if not indexed"""
+        with self._lock:
+            product = self._db.execute(
+                f'SELECT {PRODUCT_COLUMNS} FROM products WHERE product_id = ? AND serial_number = ?',
+                (product_id, serial_number)
+            ).fetchone()
+            if product is None:
+                return None
+            transfers = self._db.execute(
+                f'SELECT {TRANSFER_COLUMNS} FROM transfers WHERE product_id = ? AND serial_number = ? '
+                'ORDER BY block_number, log_index',
+                (product_id, serial_number)
+            ).fetchall()
+        return product, transfers
+
+    def get_transfer_count(self, product_id, serial_number):
+        """Return the number of indexed transfers, or None if the product is not indexed"""
+        with self._lock:
+            product = self._db.execute(
+                'SELECT 1 FROM products WHERE product_id = ? AND serial_number = ?',
+                (product_id, serial_number)
+            ).fetchone()
+            if product is None:
+                return None
+            return self._db.execute(
+                'SELECT COUNT(*) FROM transfers WHERE product_id = ? AND serial_number = ?',
+                (product_id, serial_number)
+            ).fetchone()[0]
+
+    def get_transfer_page(self, product_id, serial_number, offset, limit):
+        """Return (transfer_tuples[offset:offset + limit], total transfers) in chain order"""
+        with self._lock:
+            total = self._db.execute(
+                'SELECT COUNT(*) FROM transfers WHERE product_id = ? AND serial_number = ?',
+                (product_id, serial_number)
+            ).fetchone()[0]
+            transfers = self._db.execute(
+                f'SELECT {TRANSFER_COLUMNS} FROM transfers WHERE product_id = ? AND serial_number = ? '
+                'ORDER BY block_number, log_index LIMIT ? OFFSET ?',
+                (product_id, serial_number, limit, offset)
+            ).fetchall()
+        return transfers, total
+
+    def get_latest_transfer(self, product_id, serial_number):
+        """Return (most recent transfer tuple or None, total transfers)"""
+        with self._lock:
+            total = self._db.execute(
+                'SELECT COUNT(*) FROM transfers WHERE product_id = ? AND serial_number = ?',
+                (product_id, serial_number)
+            ).fetchone()[0]
+            latest = self._db.execute(
+                f'SELECT {TRANSFER_COLUMNS} FROM transfers WHERE product_id = ? AND serial_number = ? '
+                'ORDER BY block_number DESC, log_index DESC LIMIT 1',
+                (product_id, serial_number)
+            ).fetchone()
+        return latest, total
+
+    def get_product_info(self, product_id, serial_number):
+        """Return the indexed product tuple, or None if not indexed"""
+        with self._lock:
+            return self._db.execute(
+                f'SELECT {PRODUCT_COLUMNS} FROM products WHERE product_id = ? AND serial_number = ?',
+                (product_id, serial_number)
+            ).fetchone()
+
+    def products_in_batch(self, batch_number):
+        """Return product tuples for every indexed product in a batch"""
+        with self._lock:
+            return self._db.execute(
+                f'SELECT {PRODUCT_COLUMNS} FROM products WHERE batch_number = ? '
+                'ORDER BY product_id, serial_number',
+                (batch_number,)
+            ).fetchall()
+
+    def products_owned_by(self, owner):
+        """Return product tuples for everything an address currently holds"""
+        with self._lock:
+            return self._db.execute(
+                f'SELECT {PRODUCT_COLUMNS} FROM products WHERE current_owner = ? '
+                'ORDER BY product_id, serial_number',
+                (self.w3.to_checksum_address(owner),)
+            ).fetchall()
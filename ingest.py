@@ -0,0 +1,328 @@
+# ingest.py
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+from itertools import islice
+
+from app_common import MANUFACTURER_PRIVATE_KEY, connect_supply_chain
+from fee_oracle import FeeOracle, GasEstimator
+from nonce_manager import NonceManager, TransactionSender
+from rpc_batch import batch_call
+
+REQUIRED_FIELDS = (
+    'product_id', 'manufacturer', 'batch_number', 'manufacture_date',
+    'expiry_date', 'gtin', 'serial_number'
+)
+# Stored as bytes32 by contract v2
+BYTES32_FIELDS = ('product_id', 'serial_number', 'manufacturer', 'batch_number')
+GTIN_LENGTHS = (8, 12, 13, 14)
+MAX_REPORTED_ERRORS = 100
+
+
+class MalformedRow:
+    """Stands in for a line that couldn't be parsed, so it is reported as that row's error"""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def read_rows(stream, fmt):
+    """Yield product dicts from a CSV or NDJSON text stream, one line at a time"""
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+    else:
+        for line in stream:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    yield MalformedRow(f'Invalid JSON: {e}')
+
+
+def detect_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def gtin_check_digit_ok(gtin):
+    """Validate the GS1 mod-10 check digit"""
+    digits = [int(d) for d in gtin]
+    total = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(digits[:-1])))
+    return (10 - total % 10) % 10 == digits[-1]
+
+
+def validate_row(row, strict_gtin=False, bytes32_fields=False):
+    """Return (register_product args, None) for a valid row or (None, error message)
+
+    bytes32_fields checks the 32-byte limit contract v2 puts on ids and names.
+    """
+    if isinstance(row, MalformedRow):
+        return None, row.message
+    if not isinstance(row, dict):
+        return None, 'Row must be an object'
+    missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+    if missing:
+        return None, f'Missing required fields: {missing}'
+    not_strings = [field for field in BYTES32_FIELDS if not isinstance(row[field], str)]
+    if not_strings:
+        return None, f'Fields must be strings: {not_strings}'
+    if bytes32_fields:
+        too_long = [field for field in BYTES32_FIELDS if len(row[field].encode('utf-8')) > 32]
+        if too_long:
+            return None, f'Fields must be at most 32 bytes for contract v2: {too_long}'
+    try:
+        manufacture_date = datetime.strptime(row['manufacture_date'], '%Y-%m-%d')
+        expiry_date = datetime.strptime(row['expiry_date'], '%Y-%m-%d')
+    except ValueError:
+        return None, 'Dates must use the YYYY-MM-DD format'
+    if expiry_date <= manufacture_date:
+        return None, 'expiry_date must be after manufacture_date'
+    gtin = str(row['gtin'])
+    if not gtin.isdigit() or len(gtin) not in GTIN_LENGTHS:
+        return None, f'GTIN must be {", ".join(map(str, GTIN_LENGTHS))} digits'
+    if strict_gtin and not gtin_check_digit_ok(gtin):
+        return None, 'GTIN check digit is invalid'
+    return (
+        row['product_id'],
+        row['manufacturer'],
+        row['batch_number'],
+        int(manufacture_date.timestamp()),
+        int(expiry_date.timestamp()),
+        gtin,
+        row['serial_number']
+    ), None
+
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return None
+
+
+def write_checkpoint(path, state):
+    """Atomically replace the checkpoint file"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+class Ingestor:
+    """Registers a stream of products through a bounded window of in-flight transactions
+
+    Rows are validated and checked against the chain in chunks. Products that
+    already exist are skipped, so re-running an interrupted file never
+    registers anything twice. The checkpoint records how many leading rows
+    are fully settled (mined, skipped or rejected), letting a resumed run
+    jump straight past them. A product repeated while its first row is
+    still in flight is reported as a duplicate instead of being sent again,
+    which on v2 would revert the whole registerProducts batch.
+    """
+
+    def __init__(self, w3, supply_chain, send_transaction, window=64, chunk_size=100,
+                 batch_size=100, checkpoint_path=None, strict_gtin=False, on_submit=None):
+        self.w3 = w3
+        self.supply_chain = supply_chain
+        self.send_transaction = send_transaction
+        self.window = window
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.strict_gtin = strict_gtin
+        # Called with the register_product args of every row sent in a transaction
+        self.on_submit = on_submit
+        self._in_flight = deque()
+        # Products in transactions that haven't settled yet
+        self._pending_keys = set()
+        self._last_checkpoint_write = 0.0
+        self.rows_done = 0
+        self.stats = {
+            'rows_read': 0,
+            'rows_resumed': 0,
+            'rows_invalid': 0,
+            'rows_existing': 0,
+            'rows_duplicate': 0,
+            'rows_registered': 0,
+            'rows_failed': 0,
+            'transactions': 0,
+        }
+        self.errors = []
+
+    def run(self, rows):
+        """Ingest an iterable of row dicts and return the throughput report"""
+        started = time.perf_counter()
+        checkpoint = load_checkpoint(self.checkpoint_path)
+        skip = checkpoint['rows_done'] if checkpoint else 0
+        self.rows_done = skip
+
+        numbered = enumerate(rows, 1)
+        while True:
+            chunk = list(islice(numbered, self.chunk_size))
+            if not chunk:
+                break
+            self.stats['rows_read'] += len(chunk)
+            # Rows below the checkpoint were settled by an earlier run
+            chunk = [(index, row) for index, row in chunk if index > skip]
+            if chunk:
+                self._process_chunk(chunk)
+
+        while self._in_flight:
+            self._settle_oldest()
+        self._checkpoint(force=True)
+
+        self.stats['rows_resumed'] = min(skip, self.stats['rows_read'])
+        elapsed = time.perf_counter() - started
+        return {
+            **self.stats,
+            'rows_done': self.rows_done,
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(self.stats['rows_registered'] / elapsed, 2) if elapsed else None,
+            'errors': self.errors,
+        }
+
+    def _error(self, index, message):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': index, 'message': message})
+
+    def _process_chunk(self, chunk):
+        valid = []
+        keys = set()
+        for index, row in chunk:
+            args, error = validate_row(row, self.strict_gtin, self.supply_chain.version >= 2)
+            if error:
+                self.stats['rows_invalid'] += 1
+                self._error(index, error)
+                continue
+            key = (args[0], args[6])
+            if key in keys or key in self._pending_keys:
+                self.stats['rows_duplicate'] += 1
+                self._error(index, 'Duplicate of an earlier row for the same product')
+                continue
+            keys.add(key)
+            valid.append((index, args))
+
+        # Skip anything already on chain (e.g. registered before an interruption)
+        lookups = [self.supply_chain.get_product_info(args[0], args[6]) for _, args in valid]
+        results, _ = batch_call(self.w3, lookups)
+        new = []
+        for (index, args), result in zip(valid, results):
+            if not isinstance(result, Exception):
+                self.stats['rows_existing'] += 1
+            elif 'does not exist' in str(result):
+                new.append((index, args))
+            else:
+                # Couldn't tell whether it exists, don't risk a duplicate registration
+                self.stats['rows_failed'] += 1
+                self._error(index, f'Existence check failed: {result}')
+
+        last_index = chunk[-1][0]
+        if self.supply_chain.version >= 2:
+            for i in range(0, len(new), self.batch_size):
+                part = new[i:i + self.batch_size]
+                self._submit(self.supply_chain.register_products([a for _, a in part]), part)
+        else:
+            for index, args in new:
+                self._submit(self.supply_chain.register_product(*args), [(index, args)])
+
+        # Marker so the checkpoint can move past rows that needed no transaction
+        self._in_flight.append((None, [], last_index))
+        self._drain(self.window)
+
+    def _submit(self, call, rows):
+        try:
+            tx_hash = self.send_transaction(call)
+        except Exception as e:
+            self.stats['rows_failed'] += len(rows)
+            for index, _ in rows:
+                self._error(index, f'Send failed: {e}')
+            return
+        self.stats['transactions'] += 1
+        self._pending_keys.update((args[0], args[6]) for _, args in rows)
+        if self.on_submit is not None:
+            self.on_submit([args for _, args in rows])
+        self._in_flight.append((tx_hash, rows, rows[-1][0]))
+        self._drain(self.window)
+
+    def _drain(self, limit):
+        while sum(1 for tx_hash, _, _ in self._in_flight if tx_hash is not None) > limit:
+            self._settle_oldest()
+        while self._in_flight and self._in_flight[0][0] is None:
+            self._settle_oldest()
+
+    def _settle_oldest(self):
+        tx_hash, rows, last_index = self._in_flight.popleft()
+        if tx_hash is not None:
+            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+            # Mined rows are now found by the existence check, reverted ones may be retried
+            self._pending_keys.difference_update((args[0], args[6]) for _, args in rows)
+            if receipt['status'] == 1:
+                self.stats['rows_registered'] += len(rows)
+            else:
+                self.stats['rows_failed'] += len(rows)
+                for index, _ in rows:
+                    self._error(index, f'Transaction {self.w3.to_hex(tx_hash)} reverted')
+        self.rows_done = max(self.rows_done, last_index)
+        self._checkpoint()
+
+    def _checkpoint(self, force=False):
+        if not self.checkpoint_path:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_checkpoint_write < 1.0:
+            return
+        write_checkpoint(self.checkpoint_path, {
+            'rows_done': self.rows_done,
+            'updated_at': datetime.now().isoformat(),
+            'stats': self.stats,
+        })
+        self._last_checkpoint_write = now
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Register products from a CSV or NDJSON file')
+    parser.add_argument('path', help='CSV or NDJSON file with one product per row')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default: <path>.checkpoint.json)')
+    parser.add_argument('--window', type=int, default=64, help='Max transactions in flight')
+    parser.add_argument('--chunk-size', type=int, default=100, help='Rows validated and checked per chunk')
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('REGISTER_BATCH_SIZE', '100')),
+                        help='Products per registerProducts transaction on the v2 contract')
+    parser.add_argument('--strict-gtin', action='store_true', help='Also verify the GTIN check digit')
+    args = parser.parse_args()
+
+    w3, supply_chain = connect_supply_chain()
+    account = w3.eth.account.from_key(MANUFACTURER_PRIVATE_KEY)
+    sender = TransactionSender(
+        w3,
+        NonceManager(w3),
+        FeeOracle(w3, mode=os.getenv('FEE_MODE', 'legacy'), max_age=float(os.getenv('FEE_MAX_AGE', '2.0'))),
+        GasEstimator(
+            w3,
+            margin=float(os.getenv('GAS_ESTIMATE_MARGIN', '0.2')),
+            ttl=float(os.getenv('GAS_ESTIMATE_TTL', '300'))
+        )
+    )
+
+    ingestor = Ingestor(
+        w3,
+        supply_chain,
+        lambda call: sender.send(call, account.address, account),
+        window=args.window,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint or f'{args.path}.checkpoint.json',
+        strict_gtin=args.strict_gtin
+    )
+    with open(args.path, newline='') as f:
+        report = ingestor.run(read_rows(f, args.format or detect_format(args.path)))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
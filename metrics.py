@@ -0,0 +1,232 @@
+# metrics.py
+import bisect
+import threading
+import time
+
+# Seconds; covers cache hits (sub-millisecond) up to slow receipt waits
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labelvalues), value] for labelvalues, value in self._values.items()]
+
+    def render(self, others=()):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for samples in others:
+            for labelvalues, value in samples:
+                values[tuple(labelvalues)] = values.get(tuple(labelvalues), 0) + value
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labelvalues -> [per-bucket counts (+Inf last), sum]
+        self._series = {}
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labelvalues):
+        """Context manager observing the elapsed time of its block"""
+        return _Timer(self, labelvalues)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labelvalues), list(counts), total] for labelvalues, (counts, total) in self._series.items()]
+
+    def render(self, others=()):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            merged = {k: (list(v[0]), v[1]) for k, v in self._series.items()}
+        for samples in others:
+            for labelvalues, counts, total in samples:
+                labelvalues = tuple(labelvalues)
+                if labelvalues in merged:
+                    own_counts, own_total = merged[labelvalues]
+                    counts = [a + b for a, b in zip(own_counts, counts)]
+                    total += own_total
+                merged[labelvalues] = (counts, total)
+        for labelvalues, (counts, total) in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(round(total, 6))}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labelvalues)
+
+
+class CallbackMetric:
+    """Gauge or counter whose samples are read from a function at scrape time
+
+    The function returns a number, or a list of (labelvalues, number) pairs
+    when labelnames are given. This is how stats the services already keep
+    (cache, gas, tracker) are exported without double bookkeeping.
+
+    Counters are summed across worker processes like Counter; gauges
+    describe the process serving the scrape and are never summed.
+    """
+
+    def __init__(self, name, documentation, function, metric_type='gauge', labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.metric_type = metric_type
+        self.labelnames = tuple(labelnames)
+
+    def _samples(self):
+        value = self.function()
+        samples = value if self.labelnames else [((), value)]
+        return {tuple(labelvalues): sample for labelvalues, sample in samples if sample is not None}
+
+    def snapshot(self):
+        if self.metric_type != 'counter':
+            return None
+        return [[list(labelvalues), sample] for labelvalues, sample in self._samples().items()]
+
+    def render(self, others=()):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        samples = self._samples()
+        if self.metric_type == 'counter':
+            for other in others:
+                for labelvalues, sample in other:
+                    samples[tuple(labelvalues)] = samples.get(tuple(labelvalues), 0) + sample
+        for labelvalues, sample in samples.items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(sample)}')
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal Prometheus text-format registry
+
+    Recording a sample is a dict update under a per-metric lock, so the
+    instrumentation is cheap enough to stay on in production.
+    """
+
+    def __init__(self, namespace='pharma'):
+        self.namespace = namespace
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(f'{self.namespace}_{name}', documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(f'{self.namespace}_{name}', documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, function, metric_type='gauge', labelnames=()):
+        return self._register(
+            CallbackMetric(f'{self.namespace}_{name}', documentation, function, metric_type, labelnames)
+        )
+
+    def snapshot(self):
+        """This process's counter and histogram samples by metric name, as JSON-able lists"""
+        snapshot = {}
+        for metric in self._metrics:
+            try:
+                samples = metric.snapshot()
+            except Exception:
+                continue
+            if samples is not None:
+                snapshot[metric.name] = samples
+        return snapshot
+
+    def render(self, others=()):
+        """The text exposition, with counters and histograms summed over the snapshots in others"""
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render([other[metric.name] for other in others if metric.name in other]))
+            except Exception:
+                # A failing stats callback shouldn't take the whole scrape down
+                continue
+        return '\n'.join(lines) + '\n'
+
+
+def rpc_metrics_middleware(latency, errors):
+    """Web3 middleware recording per-method JSON-RPC latency and errors
+
+    latency is a Histogram labelled by method, errors a Counter labelled by
+    (method, type). Node-reported errors count as type 'rpc_error',
+    transport failures under their exception class name.
+    """
+    def middleware(make_request, w3):
+        def timed_request(method, params):
+            started = time.perf_counter()
+            try:
+                response = make_request(method, params)
+            except Exception as e:
+                errors.inc(method, type(e).__name__)
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started, method)
+            if isinstance(response, dict) and response.get('error'):
+                errors.inc(method, 'rpc_error')
+            return response
+        return timed_request
+    return middleware
@@ -0,0 +1,5 @@
+const PharmaSupplyChainV2 = artifacts.require("PharmaSupplyChainV2");
+
+module.exports = function(deployer) {
+  deployer.deploy(PharmaSupplyChainV2);
+};
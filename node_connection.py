@@ -0,0 +1,97 @@
+# node_connection.py
+import threading
+import time
+
+from requests.exceptions import ConnectionError as RequestsConnectionError
+
+# A dropped connection may have delivered these, so resending could submit a transaction twice
+NO_RETRY_METHODS = ('eth_sendRawTransaction', 'eth_sendTransaction')
+
+
+class NodeUnavailable(RequestsConnectionError):
+    """Raised without contacting the node while it is down and the next retry isn't due"""
+
+
+class NodeConnection:
+    """Connects to the node lazily, backing off while it is unreachable
+
+    Nothing talks to the node at import time; the first request made
+    through the middleware does. When a connection fails, further requests
+    fail fast with NodeUnavailable until the retry time, which doubles
+    from initial_backoff up to max_backoff. The next request after that
+    tries the node again. A dropped keep-alive connection on a node that
+    was up is retried once straight away, except for transaction sends
+    (NO_RETRY_METHODS), which the caller must resolve by nonce instead.
+    """
+
+    def __init__(self, initial_backoff=0.5, max_backoff=30.0):
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.state = 'unknown'
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_error = None
+        self.connected_since = None
+
+    @property
+    def ready(self):
+        return self.state == 'connected'
+
+    def _check(self):
+        with self._lock:
+            if self.state == 'down' and time.monotonic() < self.retry_at:
+                raise NodeUnavailable(
+                    f'Node unavailable ({self.last_error}), '
+                    f'retrying in {self.retry_at - time.monotonic():.1f}s'
+                )
+
+    def _succeeded(self):
+        with self._lock:
+            if self.state != 'connected':
+                self.state = 'connected'
+                self.connected_since = time.time()
+            self.failures = 0
+
+    def _failed(self, error):
+        with self._lock:
+            self.failures += 1
+            self.state = 'down'
+            self.connected_since = None
+            self.last_error = str(error)
+            backoff = min(self.max_backoff, self.initial_backoff * 2 ** (self.failures - 1))
+            self.retry_at = time.monotonic() + backoff
+
+    def middleware(self, make_request, w3):
+        def request(method, params):
+            self._check()
+            was_connected = self.ready
+            try:
+                response = make_request(method, params)
+            except RequestsConnectionError as e:
+                if not was_connected:
+                    self._failed(e)
+                    raise
+                if method in NO_RETRY_METHODS:
+                    # Likely just a stale keep-alive; the next request finds out if the node is down
+                    raise
+                try:
+                    response = make_request(method, params)
+                except RequestsConnectionError as e:
+                    self._failed(e)
+                    raise
+            self._succeeded()
+            return response
+        return request
+
+    def status(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'retry_in_seconds': (
+                    round(max(0.0, self.retry_at - time.monotonic()), 1) if self.state == 'down' else None
+                ),
+                'last_error': self.last_error,
+                'connected_since': self.connected_since,
+            }
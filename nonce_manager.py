@@ -0,0 +1,238 @@
+# nonce_manager.py
+import asyncio
+import logging
+import threading
+
+import aiohttp
+from eth_account.signers.local import LocalAccount
+from requests.exceptions import ConnectionError as RequestsConnectionError, HTTPError, Timeout
+
+from node_connection import NodeUnavailable
+from rpc_pool import not_delivered
+
+logger = logging.getLogger(__name__)
+
+# Substrings of node errors that mean our local nonce no longer matches the chain
+NONCE_ERROR_MARKERS = (
+    'nonce too low',
+    'nonce too high',
+    'invalid nonce',
+    'invalid transaction nonce',
+    "doesn't have the correct nonce",
+    # A pending transaction already holds the nonce
+    'replacement transaction underpriced',
+)
+
+# Send failures that leave it unknown whether the node got the transaction
+DELIVERY_UNKNOWN_ERRORS = (
+    RequestsConnectionError, Timeout, HTTPError, aiohttp.ClientError, asyncio.TimeoutError
+)
+# ...except these, which are raised before the request reaches the node
+NOT_SENT_ERRORS = (NodeUnavailable, aiohttp.ClientConnectorError)
+
+
+def is_nonce_error(error):
+    """Check whether a send_raw_transaction error was caused by a stale nonce"""
+    message = str(error).lower()
+    return any(marker in message for marker in NONCE_ERROR_MARKERS)
+
+
+def is_delivery_unknown(error):
+    """Check whether a failed send_raw_transaction may still have reached the node
+
+    Its nonce must then stay used: releasing it would hand the same nonce
+    to the next send while the first transaction may be pending.
+    """
+    if isinstance(error, NOT_SENT_ERRORS) or not_delivered(error):
+        return False
+    return isinstance(error, DELIVERY_UNKNOWN_ERRORS)
+
+
+def release_nonce(next_nonce, gaps, nonce):
+    """Counter and gap set after giving back nonce
+
+    Only the highest nonce handed out rolls the counter back (together with
+    any gaps right below it). Lower ones were followed by nonces other
+    senders still hold, so they become gaps to fill first.
+    """
+    if nonce >= next_nonce:
+        return next_nonce, gaps
+    if nonce == next_nonce - 1:
+        next_nonce = nonce
+        while next_nonce - 1 in gaps:
+            next_nonce -= 1
+            gaps.discard(next_nonce)
+    else:
+        gaps.add(nonce)
+    return next_nonce, gaps
+
+
+class NonceManager:
+    """Hands out sequential nonces per sending account without asking the node each time
+
+    Every address has its own lock, so a slow first sync for one sender
+    never holds up allocations for another. A released nonce below the
+    counter is kept as a gap and handed out again before any new one, so
+    nonces already given to other senders are never reused.
+    """
+
+    def __init__(self, w3):
+        self.w3 = w3
+        self._lock = threading.Lock()
+        self._address_locks = {}
+        self._next_nonce = {}
+        self._gaps = {}
+
+    def _fetch(self, address):
+        # 'pending' includes transactions already sitting in the node's pool
+        return self.w3.eth.get_transaction_count(address, 'pending')
+
+    def _lane(self, address):
+        with self._lock:
+            lock = self._address_locks.get(address)
+            if lock is None:
+                lock = self._address_locks[address] = threading.Lock()
+            return lock
+
+    def allocate(self, address):
+        """Reserve the next nonce for an address, syncing from the node on first use"""
+        with self._lane(address):
+            gaps = self._gaps.get(address)
+            if gaps:
+                nonce = min(gaps)
+                gaps.discard(nonce)
+                return nonce
+            if address not in self._next_nonce:
+                self._next_nonce[address] = self._fetch(address)
+            nonce = self._next_nonce[address]
+            self._next_nonce[address] = nonce + 1
+            return nonce
+
+    def release(self, address, nonce):
+        """Give back a nonce whose transaction never reached the node"""
+        with self._lane(address):
+            if address not in self._next_nonce:
+                return
+            self._next_nonce[address], self._gaps[address] = release_nonce(
+                self._next_nonce[address], self._gaps.get(address, set()), nonce
+            )
+
+    def resync(self, address):
+        """Reload the next nonce for an address from the node"""
+        with self._lane(address):
+            self._next_nonce[address] = self._fetch(address)
+            self._gaps.pop(address, None)
+
+    def snapshot(self):
+        """Return the locally tracked next nonce for every known address"""
+        with self._lock:
+            return dict(self._next_nonce)
+
+
+class TransactionSender:
+    """Builds, signs and sends contract calls with nonces from a NonceManager
+
+    A nonce is given back only when its transaction certainly never
+    reached the node: when building or signing fails, or the node rejects
+    the transaction. If the send fails in a way that leaves delivery
+    unknown, the nonce stays used and the counter is resynced from the
+    node's pending count. A stale nonce is resynced and retried once.
+    """
+
+    def __init__(self, w3, nonce_manager, fee_oracle, gas_estimator):
+        self.w3 = w3
+        self.nonce_manager = nonce_manager
+        self.fee_oracle = fee_oracle
+        self.gas_estimator = gas_estimator
+        self._chain_id = None
+
+    def chain_id(self):
+        """Fetch the chain id once and reuse it for every transaction"""
+        if self._chain_id is None:
+            self._chain_id = self.w3.eth.chain_id
+        return self._chain_id
+
+    def send(self, contract_function, sender_address, private_key):
+        """Send a contract call and return its hash; private_key may be a raw key or a LocalAccount"""
+        gas_limit = self.gas_estimator.gas_limit(contract_function, sender_address)
+        for attempt in range(2):
+            nonce = self.nonce_manager.allocate(sender_address)
+            try:
+                tx = contract_function.build_transaction({
+                    'from': sender_address,
+                    'gas': gas_limit,
+                    'nonce': nonce,
+                    'chainId': self.chain_id(),
+                    **self.fee_oracle.fee_params(),
+                })
+                if isinstance(private_key, LocalAccount):
+                    # Cached account, its signing key is already derived
+                    signed_tx = private_key.sign_transaction(tx)
+                else:
+                    signed_tx = self.w3.eth.account.sign_transaction(tx, private_key=private_key)
+            except Exception:
+                # Nothing was sent, the nonce is free again
+                self.nonce_manager.release(sender_address, nonce)
+                raise
+            try:
+                return self.w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+            except Exception as e:
+                if is_delivery_unknown(e):
+                    # The node may have the transaction, so the nonce stays used
+                    # until the pending count says whether it arrived
+                    logger.warning(f"Send with nonce {nonce} from {sender_address} may have reached the node: {e}")
+                    try:
+                        self.nonce_manager.resync(sender_address)
+                    except Exception as resync_error:
+                        logger.warning(f"Nonce resync for {sender_address} failed: {resync_error}")
+                    raise
+                if is_nonce_error(e) and attempt == 0:
+                    # Someone else used this account, pick up the node's view and retry once
+                    logger.warning(f"Nonce {nonce} rejected for {sender_address}, resyncing: {e}")
+                    self.nonce_manager.resync(sender_address)
+                    continue
+                # The node rejected the transaction
+                self.nonce_manager.release(sender_address, nonce)
+                raise
+
+
+class AsyncNonceManager:
+    """asyncio counterpart of NonceManager for AsyncWeb3"""
+
+    def __init__(self, w3):
+        self.w3 = w3
+        self._lock = asyncio.Lock()
+        self._next_nonce = {}
+        self._gaps = {}
+
+    async def _fetch(self, address):
+        return await self.w3.eth.get_transaction_count(address, 'pending')
+
+    async def allocate(self, address):
+        async with self._lock:
+            gaps = self._gaps.get(address)
+            if gaps:
+                nonce = min(gaps)
+                gaps.discard(nonce)
+                return nonce
+            if address not in self._next_nonce:
+                self._next_nonce[address] = await self._fetch(address)
+            nonce = self._next_nonce[address]
+            self._next_nonce[address] = nonce + 1
+            return nonce
+
+    async def release(self, address, nonce):
+        async with self._lock:
+            if address not in self._next_nonce:
+                return
+            self._next_nonce[address], self._gaps[address] = release_nonce(
+                self._next_nonce[address], self._gaps.get(address, set()), nonce
+            )
+
+    async def resync(self, address):
+        async with self._lock:
+            self._next_nonce[address] = await self._fetch(address)
+            self._gaps.pop(address, None)
+
+    def snapshot(self):
+        return dict(self._next_nonce)
@@ -0,0 +1,300 @@
+# product_filter.py
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from eth_utils import event_abi_to_log_topic
+
+from chain_head import ChainHead
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'PSBF1\n'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 32-byte product keys
+
+    Product keys are keccak256 hashes, so their bytes are already uniformly
+    distributed and the k bit positions come straight from the key by double
+    hashing, with no further hashing.
+    """
+
+    def __init__(self, capacity, error_rate, bits=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+        self.count = count
+
+    def _positions(self, key):
+        h1 = int.from_bytes(key[:8], 'big')
+        h2 = int.from_bytes(key[8:16], 'big') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RegisteredProductFilter:
+    """Scalable Bloom filter of every registered product key, fed by ProductRegistered logs
+
+    A negative answer means the product was not registered as of the last
+    synced block. It is only given when that block is the chain head, as
+    last seen by the background sync or anything else feeding head (a
+    ChainHead), and that head is at most max_staleness seconds old;
+    otherwise the caller asks the node. Lookups never contact the node.
+    Before the first sync callers fall back to the node. The hash of the
+    last synced block is kept with the filter, so a reset dev chain or a
+    reorg past it rebuilds the filter from events.
+
+    Only one process should own the file (persist=True) and run the
+    background sync. Other worker processes pass persist=False: they
+    reload the file when the owner rewrites it and never write it. The
+    owner publishes how far it has synced through shared_cursor, so the
+    others know the file is current even when no new keys made it
+    rewrite the file.
+    When the newest filter reaches its capacity a larger one with a tighter
+    error rate is chained on, so the overall false-positive rate stays
+    close to error_rate however many products are added.
+    """
+
+    def __init__(self, w3, supply_chain, path=None, start_block=0, chunk_size=2000,
+                 capacity=100000, error_rate=0.001, persist=True, head=None, max_staleness=5.0,
+                 shared_cursor=None):
+        self.w3 = w3
+        self.supply_chain = supply_chain
+        self.contract = supply_chain.contract
+        self.path = path
+        self.start_block = start_block
+        self.chunk_size = chunk_size
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.persist = persist
+        self.head = head or ChainHead(w3)
+        self.max_staleness = max_staleness
+        self.shared_cursor = shared_cursor
+        self._loaded_mtime = None
+        # mtime of the file whose contents are in memory (saved or loaded)
+        self._file_mtime = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+        self._filters = [BloomFilter(capacity, error_rate / 2)]
+        self._dirty = False
+        self.last_block = None
+        self.last_block_hash = None
+        self.last_synced_at = None
+        self.rejected = 0
+        self.passed = 0
+        self.event = self.contract.events.ProductRegistered()
+        self.topic = self.w3.to_hex(event_abi_to_log_topic(self.event.abi))
+        if path and os.path.exists(path):
+            self._load()
+
+    # --- membership ---------------------------------------------------------
+
+    def add(self, product_id, serial_number):
+        """Record a product as registered (safe to call before it is mined)"""
+        key = bytes(self.supply_chain.product_key(product_id, serial_number))
+        with self._lock:
+            self._add_key(key)
+
+    def _add_key(self, key):
+        # Products added at submit time come back later as logs; don't count them twice
+        if any(key in bloom for bloom in self._filters):
+            return
+        newest = self._filters[-1]
+        if newest.count >= newest.capacity:
+            newest = BloomFilter(newest.capacity * 2, newest.error_rate / 2)
+            self._filters.append(newest)
+        newest.add(key)
+        self._dirty = True
+
+    def definitely_absent(self, product_id, serial_number):
+        """True only when the product is certainly not registered, so the node can be skipped"""
+        published = None
+        if not self.persist:
+            # Read the owner's cursor before the file, so the file is at least as new
+            if self.shared_cursor is not None:
+                published = self.shared_cursor.get()[0]
+            self._reload_if_changed()
+        key = bytes(self.supply_chain.product_key(product_id, serial_number))
+        with self._lock:
+            present = any(key in bloom for bloom in self._filters)
+            last_block = self.last_block
+            if self.shared_cursor is not None and not self.persist:
+                # Only the file the owner last vouched for is trusted, up to its cursor
+                matches = published and published['file_mtime'] == self._file_mtime
+                last_block = published['block'] if matches else None
+        if last_block is None:
+            return False
+        if not present:
+            # Blocks past the last sync, or a head too old to tell, may hold
+            # the registration; leave those to the node
+            head = self.head.cached(self.max_staleness)
+            present = head is None or head > last_block
+        with self._lock:
+            if present:
+                self.passed += 1
+            else:
+                self.rejected += 1
+        return not present
+
+    # --- syncing ------------------------------------------------------------
+
+    def start(self, poll_interval=1.0):
+        """Keep syncing in a background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, args=(poll_interval,), name='product-filter', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, poll_interval):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Product filter sync failed: {e}")
+            time.sleep(poll_interval)
+
+    def sync(self):
+        """Add keys from ProductRegistered logs up to the chain head, then persist"""
+        with self._sync_lock:
+            head = self.head.fetch()
+            if self.last_block is not None and not self._cursor_matches(head):
+                self.reset()
+                if self.shared_cursor is not None:
+                    self.shared_cursor.set(None)
+            from_block = self.start_block if self.last_block is None else self.last_block + 1
+            while from_block <= head:
+                to_block = min(from_block + self.chunk_size - 1, head)
+                # Read before the logs, so a reorg in between is caught on the next sync
+                to_block_hash = self.w3.to_hex(self.w3.eth.get_block(to_block)['hash'])
+                logs = self.w3.eth.get_logs({
+                    'address': self.contract.address,
+                    'fromBlock': from_block,
+                    'toBlock': to_block,
+                    'topics': [self.topic],
+                })
+                keys = []
+                for log in logs:
+                    args = self.supply_chain.decode_event_args(self.event.process_log(log)['args'])
+                    keys.append(bytes(self.supply_chain.product_key(args['productId'], args['serialNumber'])))
+                with self._lock:
+                    for key in keys:
+                        self._add_key(key)
+                    self.last_block = to_block
+                    self.last_block_hash = to_block_hash
+                from_block = to_block + 1
+            self.last_synced_at = time.time()
+            if self._dirty:
+                self._save()
+            if self.shared_cursor is not None and self._file_mtime is not None:
+                self.shared_cursor.set({'block': self.last_block, 'file_mtime': self._file_mtime})
+
+    def _cursor_matches(self, head):
+        """Whether the last synced block is still part of the node's chain"""
+        if self.last_block > head:
+            reason = f'last synced block {self.last_block} is past the chain head {head}'
+        elif self.w3.to_hex(self.w3.eth.get_block(self.last_block)['hash']) != self.last_block_hash:
+            reason = f'block {self.last_block} is no longer the one synced'
+        else:
+            return True
+        logger.warning(f"Product filter doesn't match the chain ({reason}), rebuilding from block {self.start_block}")
+        return False
+
+    def reset(self):
+        """Forget every key and the sync cursor"""
+        with self._lock:
+            self._filters = [BloomFilter(self.capacity, self.error_rate / 2)]
+            self.last_block = None
+            self.last_block_hash = None
+            self._dirty = True
+
+    # --- persistence --------------------------------------------------------
+
+    def _save(self):
+        if not self.path or not self.persist:
+            return
+        with self._lock:
+            header = {
+                'contract': self.contract.address,
+                'last_block': self.last_block,
+                'last_block_hash': self.last_block_hash,
+                'filters': [
+                    {'capacity': f.capacity, 'error_rate': f.error_rate, 'count': f.count}
+                    for f in self._filters
+                ],
+            }
+            blobs = [bytes(f.bits) for f in self._filters]
+            self._dirty = False
+        # Per-process temp file, every worker process may save the same filter
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(FILE_MAGIC)
+            f.write(json.dumps(header).encode() + b'\n')
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp_path, self.path)
+        self._file_mtime = os.stat(self.path).st_mtime_ns
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except (OSError, TypeError):
+            return
+        if mtime != self._loaded_mtime:
+            with self._sync_lock:
+                self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            self._loaded_mtime = os.fstat(f.fileno()).st_mtime_ns
+            if f.readline() != FILE_MAGIC:
+                logger.warning(f"Ignoring {self.path}: not a product filter file")
+                return
+            header = json.loads(f.readline())
+            if header['contract'] != self.contract.address:
+                # Saved for another deployment, rebuild from events
+                logger.warning(f"Ignoring {self.path}: saved for contract {header['contract']}")
+                return
+            filters = []
+            for spec in header['filters']:
+                bloom = BloomFilter(spec['capacity'], spec['error_rate'], count=spec['count'])
+                bits = f.read(len(bloom.bits))
+                if len(bits) != len(bloom.bits):
+                    logger.warning(f"Ignoring {self.path}: file is truncated")
+                    return
+                bloom.bits = bytearray(bits)
+                filters.append(bloom)
+        with self._lock:
+            self._filters = filters
+            self._file_mtime = self._loaded_mtime
+            self.last_block = header['last_block']
+            # Files saved before the hash was stored are checked against nothing; rebuild them
+            self.last_block_hash = header.get('last_block_hash')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'last_block': self.last_block,
+                'last_synced_at': self.last_synced_at,
+                'head': self.head.cached(self.max_staleness),
+                'keys': sum(f.count for f in self._filters),
+                'filters': len(self._filters),
+                'size_bytes': sum(len(f.bits) for f in self._filters),
+                'rejected': self.rejected,
+                'passed': self.passed,
+            }
@@ -0,0 +1,147 @@
+# profiling.py
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+PROFILE_FORMATS = ('pstats', 'collapsed')
+
+# One profile at a time per process. cProfile refuses a second active
+# profiler, and concurrent profiles would each be skewed by the other's overhead.
+_profile_lock = threading.Lock()
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def collapse_stack(frame):
+    """Render a frame and its callers as a root-first 'a;b;c' collapsed stack"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """Samples Python stacks from a background thread
+
+    Counts are keyed by collapsed stack, the input format of flamegraph.pl
+    and speedscope. With thread_ids set only those threads are sampled,
+    otherwise every thread except the sampler itself.
+    """
+
+    def __init__(self, interval=0.005, thread_ids=None):
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids else None
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.counts
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                self.counts[collapse_stack(frame)] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+
+def write_collapsed(path, counts):
+    with open(path, 'w') as f:
+        for stack, count in counts.most_common():
+            f.write(f'{stack} {count}\n')
+
+
+def profile_path(output_dir, label, extension):
+    """Unique, sortable file name for one profile"""
+    os.makedirs(output_dir, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_') or 'root'
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+    return os.path.join(output_dir, f'{stamp}-{slug}-{uuid.uuid4().hex[:8]}.{extension}')
+
+
+class RequestProfiler:
+    """Profiles the current thread between start() and finish()
+
+    'pstats' traces every call with cProfile (exact counts, higher overhead);
+    'collapsed' samples only this thread's stack every interval seconds.
+    """
+
+    def __init__(self, output_dir, mode='pstats', interval=0.001):
+        if mode not in PROFILE_FORMATS:
+            raise ValueError(f'Profile format must be one of {PROFILE_FORMATS}')
+        self.output_dir = output_dir
+        self.mode = mode
+        self.interval = interval
+        self._profiler = None
+        self._sampler = None
+
+    def start(self):
+        """Start profiling, or return None when another profile is already running"""
+        if not _profile_lock.acquire(blocking=False):
+            return None
+        try:
+            if self.mode == 'pstats':
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+            else:
+                self._sampler = StackSampler(self.interval, [threading.get_ident()]).start()
+        except ValueError:
+            # Another tool (a debugger, coverage) already holds the interpreter's profiler
+            _profile_lock.release()
+            return None
+        return self
+
+    def finish(self, label):
+        """Stop profiling and write the result, returning the file path"""
+        try:
+            if self.mode == 'pstats':
+                self._profiler.disable()
+                path = profile_path(self.output_dir, label, 'pstats')
+                self._profiler.dump_stats(path)
+            else:
+                counts = self._sampler.stop()
+                path = profile_path(self.output_dir, label, 'collapsed')
+                write_collapsed(path, counts)
+        finally:
+            _profile_lock.release()
+        return path
+
+
+def sample_process(seconds, interval=0.005):
+    """Sample every thread for the given number of seconds and return the stack counts
+
+    Returns None without sampling when another profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        sampler = StackSampler(interval).start()
+        time.sleep(seconds)
+        return sampler.stop()
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,119 @@
+# rpc_batch.py
+import json
+import itertools
+
+from eth_abi.exceptions import DecodingError
+from web3 import HTTPProvider
+from web3._utils.request import make_post_request
+
+from contract_artifacts import FunctionCodec
+
+# Error(string) selector used by require() revert reasons
+REVERT_SELECTOR = '0x08c379a0'
+
+_request_ids = itertools.count(1)
+
+
+class RPCCallError(Exception):
+    """A single eth_call inside a batch failed (usually a contract revert)"""
+
+
+def function_codec(contract_function):
+    """The codec prebuild_functions() attached, or one built for this call"""
+    return getattr(contract_function, 'codec', None) or FunctionCodec(contract_function.abi)
+
+
+def encode_call(w3, contract_function):
+    """Encode a bound ContractFunction into eth_call parameters"""
+    data = function_codec(contract_function).encode(w3.codec, contract_function.args)
+    return {'to': contract_function.address, 'data': w3.to_hex(data)}
+
+
+def decode_result(w3, contract_function, raw):
+    """Decode eth_call output the same way ContractFunction.call() returns it"""
+    return function_codec(contract_function).decode(w3.codec, w3.to_bytes(hexstr=raw))
+
+
+def decode_error(w3, error):
+    """Turn a JSON-RPC error object into a readable revert message"""
+    message = error.get('message', 'eth_call failed')
+    data = error.get('data')
+    if isinstance(data, dict):
+        data = data.get('data') or next(
+            (v.get('return') for v in data.values() if isinstance(v, dict)), None
+        )
+    if isinstance(data, str) and data.startswith(REVERT_SELECTOR):
+        try:
+            reason = w3.codec.decode(['string'], w3.to_bytes(hexstr='0x' + data[10:]))[0]
+            return f'execution reverted: {reason}'
+        except DecodingError:
+            pass
+    return message
+
+
+def batch_call(w3, contract_functions, block_identifier='latest', max_batch_size=500):
+    """Run many read-only contract calls in as few JSON-RPC batch requests as possible
+
+    Returns (results, request_count) where results holds, for each input call
+    in order, either the decoded return value or an RPCCallError. Providers
+    that can't take JSON-RPC batches (IPC, in-process test backends) fall back
+    to one call at a time.
+    """
+    if not contract_functions:
+        return [], 0
+
+    provider = w3.provider
+    if isinstance(provider, HTTPProvider):
+        def post(data):
+            return make_post_request(provider.endpoint_uri, data, **provider.get_request_kwargs())
+    elif hasattr(provider, 'post_batch'):
+        # PooledHTTPProvider picks an in-sync node for the batch
+        post = provider.post_batch
+    else:
+        results = []
+        for fn in contract_functions:
+            try:
+                results.append(fn.call(block_identifier=block_identifier))
+            except Exception as e:
+                results.append(RPCCallError(str(e)))
+        return results, len(contract_functions)
+
+    if isinstance(block_identifier, int):
+        block_identifier = hex(block_identifier)
+
+    results = []
+    request_count = 0
+    for start in range(0, len(contract_functions), max_batch_size):
+        chunk = contract_functions[start:start + max_batch_size]
+        ids = [next(_request_ids) for _ in chunk]
+        payload = [
+            {
+                'jsonrpc': '2.0',
+                'id': request_id,
+                'method': 'eth_call',
+                'params': [encode_call(w3, fn), block_identifier],
+            }
+            for request_id, fn in zip(ids, chunk)
+        ]
+        raw_response = post(json.dumps(payload).encode())
+        request_count += 1
+
+        responses = json.loads(raw_response)
+        if isinstance(responses, dict):
+            # The whole batch was rejected (e.g. node doesn't support batching)
+            raise RPCCallError(decode_error(w3, responses.get('error', {})))
+        by_id = {r.get('id'): r for r in responses}
+
+        for request_id, fn in zip(ids, chunk):
+            response = by_id.get(request_id)
+            if response is None:
+                results.append(RPCCallError('No response for call in batch'))
+            elif 'error' in response:
+                results.append(RPCCallError(decode_error(w3, response['error'])))
+            else:
+                try:
+                    results.append(decode_result(w3, fn, response['result']))
+                except (DecodingError, ValueError) as e:
+                    results.append(RPCCallError(f'Could not decode result: {e}'))
+
+    return results, request_count
@@ -0,0 +1,265 @@
+# rpc_pool.py
+import logging
+import threading
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from web3.providers.base import JSONBaseProvider
+
+logger = logging.getLogger(__name__)
+
+# Reads any node that has caught up can answer. Everything else goes to
+# the primary: sends, pending nonces, receipts and logs have to agree with
+# the node the transactions went to.
+BALANCED_METHODS = frozenset({
+    'eth_call',
+    'eth_getCode',
+    'eth_getBalance',
+    'eth_getStorageAt',
+    'eth_chainId',
+    'net_version',
+    'web3_clientVersion',
+})
+
+# Connect-phase failures: the request never reached the node, so even a write can be resent.
+# Anything later (a reset mid-response, a read timeout, an HTTP error) may have delivered it
+NOT_DELIVERED = (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError)
+
+
+class NodeHTTPError(requests.exceptions.HTTPError):
+    """A node received the request and answered with an HTTP 5xx"""
+
+
+def not_delivered(error):
+    """Whether a failed request certainly never reached the node"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the actual failure
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, NOT_DELIVERED)
+
+
+class Endpoint:
+    """One node with its own keep-alive connection pool and health numbers"""
+
+    def __init__(self, uri, pool_size, timeout):
+        self.uri = uri
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Content-Type'] = 'application/json'
+        self.healthy = True
+        self.head = None
+        self.latency = None
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+
+    def post(self, data, timeout=None):
+        response = self.session.post(self.uri, data=data, timeout=timeout or self.timeout)
+        if response.status_code >= 500:
+            # Overloaded or broken node: mark it down, but it did get the request
+            raise NodeHTTPError(f'{self.uri} answered HTTP {response.status_code}', response=response)
+        response.raise_for_status()
+        return response.content
+
+    def observe(self, seconds, weight=0.2):
+        # Exponentially weighted, so one slow call doesn't reorder the pool
+        self.latency = seconds if self.latency is None else (1 - weight) * self.latency + weight * seconds
+
+
+class PooledHTTPProvider(JSONBaseProvider):
+    """JSON-RPC provider over several nodes of the same chain
+
+    Writes and chain-following reads are pinned to the primary: the
+    first healthy endpoint in the configured order. If it fails, the
+    next one takes over. BALANCED_METHODS go to whichever in-sync node
+    has the fewest requests in flight, then the lowest latency. A node
+    is in sync when its head is no more than max_read_lag blocks behind
+    the primary's, and not below the block of any transaction receipt
+    the pool has returned, so a read that follows a mined write sees it.
+    A node that fails a request is marked down and the request moves to
+    the next node. A write is only resent when it failed to connect;
+    after anything later it may already have reached a node. A background
+    thread probes every node with eth_blockNumber every health_interval
+    seconds. That probe is what brings failed nodes back and keeps heads
+    and latencies current.
+    """
+
+    def __init__(self, endpoint_uris, timeout=10.0, pool_size=32, health_interval=2.0,
+                 health_timeout=2.0, max_read_lag=0):
+        super().__init__()
+        if not endpoint_uris:
+            raise ValueError('At least one RPC endpoint is required')
+        self.endpoints = [Endpoint(uri, pool_size, timeout) for uri in endpoint_uris]
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.max_read_lag = max_read_lag
+        self._lock = threading.Lock()
+        self._monitor = None
+        # Highest block of any receipt returned; replicas below it would miss that write
+        self.min_read_block = 0
+
+    def __str__(self):
+        return f"RPC pool {', '.join(e.uri for e in self.endpoints)}"
+
+    @property
+    def endpoint_uri(self):
+        return self.primary().uri
+
+    def primary(self):
+        return next((e for e in self.endpoints if e.healthy), self.endpoints[0])
+
+    def is_connected(self, show_traceback=False):
+        return any(e.healthy for e in self.endpoints)
+
+    # --- routing ----------------------------------------------------------
+
+    def _in_sync(self, endpoint, primary):
+        if endpoint is primary:
+            return True
+        if endpoint.head is None or primary.head is None:
+            # Not probed yet; only the primary takes reads until it is
+            return False
+        return endpoint.head >= max(primary.head - self.max_read_lag, self.min_read_block)
+
+    def _candidates(self, balanced):
+        """Endpoints to try, in order"""
+        with self._lock:
+            healthy = [e for e in self.endpoints if e.healthy]
+            if not healthy:
+                # Everything is marked down; try them all, a probe may just be late
+                return list(self.endpoints)
+            primary = healthy[0]
+            if not balanced:
+                return healthy
+            in_sync = [e for e in healthy if self._in_sync(e, primary)]
+            first = min(in_sync, key=lambda e: (e.in_flight, e.latency or 0.0))
+            return [first] + [e for e in healthy if e is not first]
+
+    def _send(self, data, balanced, resend_safe):
+        self._ensure_monitor()
+        last_error = None
+        for endpoint in self._candidates(balanced):
+            with self._lock:
+                endpoint.in_flight += 1
+                endpoint.requests += 1
+            started = time.perf_counter()
+            try:
+                content = endpoint.post(data)
+            except requests.exceptions.RequestException as e:
+                if isinstance(e, requests.exceptions.HTTPError) and not isinstance(e, NodeHTTPError):
+                    raise
+                self._mark_down(endpoint, e)
+                last_error = e
+                if not resend_safe and not not_delivered(e):
+                    # The node may have accepted the write; resending it
+                    # elsewhere could submit it twice
+                    raise
+                continue
+            finally:
+                with self._lock:
+                    endpoint.in_flight -= 1
+            endpoint.observe(time.perf_counter() - started)
+            return content
+        raise last_error
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        raw_response = self._send(
+            request_data,
+            balanced=method in BALANCED_METHODS,
+            resend_safe=method not in ('eth_sendRawTransaction', 'eth_sendTransaction'),
+        )
+        response = self.decode_rpc_response(raw_response)
+        if method == 'eth_getTransactionReceipt':
+            self._note_receipt(response.get('result'))
+        return response
+
+    def _note_receipt(self, receipt):
+        if not receipt or receipt.get('blockNumber') is None:
+            return
+        block = receipt['blockNumber']
+        block = int(block, 16) if isinstance(block, str) else block
+        with self._lock:
+            self.min_read_block = max(self.min_read_block, block)
+
+    def post_batch(self, data):
+        """Send a JSON-RPC batch of eth_calls to one in-sync node, returning the raw response"""
+        return self._send(data, balanced=True, resend_safe=True)
+
+    # --- health -----------------------------------------------------------
+
+    def _mark_down(self, endpoint, error):
+        with self._lock:
+            was_primary = endpoint is self.primary()
+            endpoint.healthy = False
+            endpoint.failures += 1
+            endpoint.last_error = str(error)
+        if was_primary:
+            logger.warning(f"Primary RPC endpoint {endpoint.uri} failed, writes move to {self.primary().uri}: {error}")
+        else:
+            logger.warning(f"RPC endpoint {endpoint.uri} marked down: {error}")
+
+    def _ensure_monitor(self):
+        if self._monitor is not None:
+            return
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._run_monitor, name='rpc-pool-health', daemon=True)
+                self._monitor.start()
+
+    def _run_monitor(self):
+        while True:
+            self.probe()
+            time.sleep(self.health_interval)
+
+    def probe(self):
+        """Check every endpoint once, updating health, head and latency"""
+        request_data = self.encode_rpc_request('eth_blockNumber', [])
+        for endpoint in self.endpoints:
+            started = time.perf_counter()
+            try:
+                response = self.decode_rpc_response(endpoint.post(request_data, timeout=self.health_timeout))
+                head = response['result']
+                head = int(head, 16) if isinstance(head, str) else head
+            except Exception as e:
+                if endpoint.healthy:
+                    self._mark_down(endpoint, e)
+                continue
+            endpoint.observe(time.perf_counter() - started)
+            with self._lock:
+                if not endpoint.healthy:
+                    logger.info(f"RPC endpoint {endpoint.uri} is back")
+                endpoint.healthy = True
+                endpoint.head = head
+
+    def status(self):
+        with self._lock:
+            primary = self.primary()
+            return [
+                {
+                    'uri': e.uri,
+                    'role': 'primary' if e is primary else 'replica',
+                    'healthy': e.healthy,
+                    'head': e.head,
+                    'lag_blocks': (
+                        primary.head - e.head if e.head is not None and primary.head is not None else None
+                    ),
+                    'serves_reads': e.healthy and self._in_sync(e, primary),
+                    'latency_ms': round(e.latency * 1000, 2) if e.latency is not None else None,
+                    'in_flight': e.in_flight,
+                    'requests': e.requests,
+                    'failures': e.failures,
+                    'last_error': e.last_error,
+                }
+                for e in self.endpoints
+            ]
@@ -0,0 +1,360 @@
+# shared_state.py
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from nonce_manager import release_nonce
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nonces (
+    address TEXT PRIMARY KEY,
+    next_nonce INTEGER
+);
+CREATE TABLE IF NOT EXISTS nonce_gaps (
+    address TEXT NOT NULL,
+    nonce INTEGER NOT NULL,
+    PRIMARY KEY (address, nonce)
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_hash TEXT PRIMARY KEY,
+    entry TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    event TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS markers (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metric_snapshots (
+    worker TEXT PRIMARY KEY,
+    snapshot TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class SharedState:
+    """SQLite file shared by all worker processes of one deployment
+
+    SQLite's own file locking serializes writers across processes, and
+    BEGIN IMMEDIATE takes the write lock up front so read-modify-write
+    sequences (like handing out a nonce) are atomic. The file only holds
+    state that can be rebuilt from the node, so commits aren't fsynced.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self.connection() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+
+    def connection(self):
+        """This thread's connection, in autocommit mode so transactions are explicit"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute('PRAGMA synchronous=OFF')
+            self._local.db = db
+        return db
+
+    def transaction(self):
+        return _ImmediateTransaction(self.connection())
+
+    @staticmethod
+    def reset(path):
+        """Remove the state left by a previous run (call before workers start)"""
+        for suffix in ('', '-wal', '-shm', '.lock'):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
+
+
+class _ImmediateTransaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class SharedNonceManager:
+    """NonceManager whose per-address counters live in SharedState
+
+    Drop-in for NonceManager when several processes send from the same
+    accounts: each allocation is one short write transaction, so workers
+    hand out consecutive nonces without asking the node. The node is only
+    asked outside a transaction, so a slow RPC never holds the write lock
+    that every worker's allocations wait on; the answer is then applied
+    inside one if nobody got there first. Released nonces below the
+    counter are kept as gaps in nonce_gaps and handed out first, as in
+    NonceManager.
+    """
+
+    def __init__(self, w3, state):
+        self.w3 = w3
+        self.state = state
+
+    def _fetch(self, address):
+        return self.w3.eth.get_transaction_count(address, 'pending')
+
+    def _stored(self, db, address):
+        row = db.execute('SELECT next_nonce FROM nonces WHERE address = ?', (address,)).fetchone()
+        return row[0] if row else None
+
+    def _store(self, db, address, next_nonce):
+        db.execute(
+            'INSERT INTO nonces (address, next_nonce) VALUES (?, ?) '
+            'ON CONFLICT (address) DO UPDATE SET next_nonce = excluded.next_nonce',
+            (address, next_nonce)
+        )
+
+    def _gaps(self, db, address):
+        rows = db.execute('SELECT nonce FROM nonce_gaps WHERE address = ?', (address,)).fetchall()
+        return {row[0] for row in rows}
+
+    def allocate(self, address):
+        """Reserve the next nonce for an address, syncing from the node on first use"""
+        fetched = None
+        while True:
+            with self.state.transaction() as db:
+                gap = db.execute(
+                    'SELECT MIN(nonce) FROM nonce_gaps WHERE address = ?', (address,)
+                ).fetchone()[0]
+                if gap is not None:
+                    db.execute('DELETE FROM nonce_gaps WHERE address = ? AND nonce = ?', (address, gap))
+                    return gap
+                nonce = self._stored(db, address)
+                if nonce is None:
+                    nonce = fetched
+                if nonce is not None:
+                    self._store(db, address, nonce + 1)
+                    return nonce
+            # First use of this address: ask the node, then try again
+            fetched = self._fetch(address)
+
+    def release(self, address, nonce):
+        """Give back a nonce whose transaction never reached the node"""
+        with self.state.transaction() as db:
+            stored = self._stored(db, address)
+            if stored is None:
+                return
+            gaps = self._gaps(db, address)
+            next_nonce, new_gaps = release_nonce(stored, set(gaps), nonce)
+            self._store(db, address, next_nonce)
+            db.executemany(
+                'DELETE FROM nonce_gaps WHERE address = ? AND nonce = ?',
+                [(address, gap) for gap in gaps - new_gaps]
+            )
+            db.executemany(
+                'INSERT OR IGNORE INTO nonce_gaps (address, nonce) VALUES (?, ?)',
+                [(address, gap) for gap in new_gaps - gaps]
+            )
+
+    def resync(self, address):
+        """Move the counter up to the node's pending count
+
+        Unlike the single-process manager it never moves backwards: other
+        workers may hold nonces the node hasn't seen yet. Gaps the node has
+        already seen used are dropped.
+        """
+        fetched = self._fetch(address)
+        with self.state.transaction() as db:
+            stored = self._stored(db, address)
+            self._store(db, address, fetched if stored is None else max(stored, fetched))
+            db.execute('DELETE FROM nonce_gaps WHERE address = ? AND nonce < ?', (address, fetched))
+
+    def snapshot(self):
+        rows = self.state.connection().execute(
+            'SELECT address, next_nonce FROM nonces WHERE next_nonce IS NOT NULL'
+        ).fetchall()
+        return dict(rows)
+
+
+class SharedTransactionLog:
+    """Async transactions submitted by any worker, so /tx answers the same everywhere
+
+    Workers record entries when they submit and again when their tracker
+    resolves them; the entry is the ReceiptTracker status dict.
+    """
+
+    def __init__(self, state, max_entries=10000):
+        self.state = state
+        self.max_entries = max_entries
+
+    def record(self, entry):
+        with self.state.transaction() as db:
+            # A resolved entry is never overwritten by a late 'pending' one
+            db.execute(
+                'INSERT INTO transactions (transaction_hash, entry) VALUES (?, ?) '
+                'ON CONFLICT (transaction_hash) DO UPDATE SET entry = excluded.entry '
+                "WHERE json_extract(transactions.entry, '$.state') = 'pending'",
+                (entry['transaction_hash'], json.dumps(entry))
+            )
+            db.execute(
+                'DELETE FROM transactions WHERE rowid <= (SELECT MAX(rowid) FROM transactions) - ?',
+                (self.max_entries,)
+            )
+
+    def status(self, tx_hash):
+        row = self.state.connection().execute(
+            'SELECT entry FROM transactions WHERE transaction_hash = ?', (tx_hash,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pending_count(self):
+        return self.state.connection().execute(
+            "SELECT COUNT(*) FROM transactions WHERE json_extract(entry, '$.state') = 'pending'"
+        ).fetchone()[0]
+
+
+class SharedEventLog:
+    """Contract events seen by the worker that follows the chain, for the other workers
+
+    Only the leader polls the node for logs (see LeaderLock). It appends
+    every event here, and the other workers' event hubs read new rows
+    instead of polling the node themselves.
+    """
+
+    def __init__(self, state, max_entries=10000):
+        self.state = state
+        self.max_entries = max_entries
+
+    def append(self, event):
+        with self.state.transaction() as db:
+            db.execute('INSERT INTO events (event) VALUES (?)', (json.dumps(event),))
+            db.execute(
+                'DELETE FROM events WHERE position <= (SELECT MAX(position) FROM events) - ?',
+                (self.max_entries,)
+            )
+
+    def last_position(self):
+        row = self.state.connection().execute('SELECT MAX(position) FROM events').fetchone()
+        return row[0] or 0
+
+    def read_after(self, position, limit=1000):
+        """[(position, event)] appended after position, oldest first"""
+        rows = self.state.connection().execute(
+            'SELECT position, event FROM events WHERE position > ? ORDER BY position LIMIT ?',
+            (position, limit)
+        ).fetchall()
+        return [(row[0], json.loads(row[1])) for row in rows]
+
+
+class SharedMarker:
+    """One named value the leader publishes for the other workers, with its age
+
+    Used for things the background loops learn from the node, such as the
+    chain head, so other workers can use them without asking the node.
+    """
+
+    def __init__(self, state, name):
+        self.state = state
+        self.name = name
+
+    def set(self, value):
+        self.state.connection().execute(
+            'INSERT INTO markers (name, value, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at',
+            (self.name, json.dumps(value), time.time())
+        )
+
+    def get(self):
+        """(value, unix time it was set), or (None, None) if it never was"""
+        row = self.state.connection().execute(
+            'SELECT value, updated_at FROM markers WHERE name = ?', (self.name,)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, None)
+
+
+class SharedMetrics:
+    """Each worker's counters and histograms, so any worker's /metrics covers all of them
+
+    gunicorn hands a scrape to whichever worker is free, and each worker
+    only counts the requests it served. Every worker publishes its
+    MetricsRegistry snapshot here every interval seconds; the worker
+    serving /metrics renders its own live values plus the others' latest
+    snapshots. Rows of workers that have exited stay, so totals never go
+    backwards when gunicorn replaces a worker; they're cleared with the
+    rest of the state on restart.
+    """
+
+    def __init__(self, state, registry, worker=None, interval=5.0):
+        self.state = state
+        self.registry = registry
+        self.worker = worker or str(os.getpid())
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def publish(self):
+        self.state.connection().execute(
+            'INSERT INTO metric_snapshots (worker, snapshot, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (worker) DO UPDATE SET snapshot = excluded.snapshot, updated_at = excluded.updated_at',
+            (self.worker, json.dumps(self.registry.snapshot()), time.time())
+        )
+
+    def others(self):
+        """Latest snapshots of every other worker"""
+        rows = self.state.connection().execute(
+            'SELECT snapshot FROM metric_snapshots WHERE worker != ?', (self.worker,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def render(self):
+        return self.registry.render(self.others())
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='metrics-publisher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.publish()
+            except sqlite3.Error:
+                # Retried next interval; a scrape meanwhile sees the previous snapshot
+                continue
+
+
+class LeaderLock:
+    """Exclusive lock that picks the one worker process running background sync
+
+    The lock is an flock on a file next to the shared state, held until
+    the process exits. The operating system releases it when the holder
+    dies, and gunicorn's replacement worker takes it over on startup.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        """Take the lock if no other process holds it; True if this process is the leader"""
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
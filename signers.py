@@ -0,0 +1,207 @@
+# signers.py
+import argparse
+import getpass
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+
+from eth_account import Account
+
+logger = logging.getLogger(__name__)
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class SignerLane:
+    """Submission queue for one account, drained in order by its own worker thread
+
+    Transactions from one sender leave in nonce order, while each sender
+    gets its own worker, so senders never wait on each other.
+    """
+
+    def __init__(self, account, send_transaction):
+        self.account = account
+        self.send_transaction = send_transaction
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.submitted = 0
+        self.failed = 0
+
+    def submit(self, contract_function):
+        """Queue a contract call for signing and sending, returning a Future of its hash"""
+        future = Future()
+        self._queue.put((contract_function, future))
+        self._ensure_worker()
+        return future
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f'signer-{self.account.address[:10]}', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            contract_function, future = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.send_transaction(contract_function, self.account))
+                self.submitted += 1
+            except Exception as e:
+                self.failed += 1
+                future.set_exception(e)
+
+    def stats(self):
+        return {
+            'address': self.account.address,
+            'queued': self._queue.qsize(),
+            'submitted': self.submitted,
+            'failed': self.failed,
+        }
+
+
+class SignerRegistry:
+    """Decrypted participant accounts held in memory, each with its own SignerLane
+
+    Keys are decrypted once at startup, so requests only name the sender
+    and never carry a private key. Instead each signer has an API token
+    (stored as a SHA-256 hash next to its keystore file), and a request has
+    to present it before the server signs anything with that key. A signer
+    without a token can't be used at all. send_transaction(contract_function,
+    account) does the actual build/sign/send.
+    """
+
+    def __init__(self, send_transaction):
+        self.send_transaction = send_transaction
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self._names = {}
+        self._token_hashes = {}
+
+    def add(self, account, name=None, token_hash=None):
+        with self._lock:
+            if account.address not in self._lanes:
+                self._lanes[account.address] = SignerLane(account, self.send_transaction)
+            if name:
+                self._names[name.lower()] = account.address
+            if token_hash:
+                self._token_hashes[account.address] = token_hash
+        return account.address
+
+    def load_keystore(self, directory, password):
+        """Decrypt every keystore JSON file in directory; the file stem becomes its name
+
+        <name>.token holds the hash of the signer's API token (see main()).
+        """
+        loaded = 0
+        for path in sorted(Path(directory).glob('*.json')):
+            with open(path) as f:
+                keyfile = json.load(f)
+            try:
+                account = Account.from_key(Account.decrypt(keyfile, password))
+            except ValueError as e:
+                logger.error(f"Could not decrypt keystore {path.name}: {e}")
+                continue
+            token_path = path.with_suffix('.token')
+            token_hash = token_path.read_text().strip() if token_path.exists() else None
+            if token_hash is None:
+                logger.warning(f"No {token_path.name} for signer {path.stem}; requests can't use it")
+            self.add(account, path.stem, token_hash)
+            loaded += 1
+        return loaded
+
+    def authenticate(self, sender, token):
+        """The LocalAccount for sender if token is its API token, otherwise None"""
+        address = self._address(sender)
+        if address is None or not token:
+            return None
+        with self._lock:
+            expected = self._token_hashes.get(address)
+        if expected is None or not hmac.compare_digest(expected, hash_token(token)):
+            return None
+        return self._lanes[address].account
+
+    def _address(self, sender):
+        sender = str(sender)
+        with self._lock:
+            if sender.lower() in self._names:
+                return self._names[sender.lower()]
+            for address in self._lanes:
+                if address.lower() == sender.lower():
+                    return address
+        return None
+
+    def account(self, sender):
+        """Return the LocalAccount for an address or registered name, or None"""
+        address = self._address(sender)
+        return self._lanes[address].account if address else None
+
+    def submit(self, sender, contract_function):
+        address = self._address(sender)
+        if address is None:
+            raise KeyError(f'No signer registered for {sender}')
+        return self._lanes[address].submit(contract_function)
+
+    def send(self, sender, contract_function, timeout=None):
+        """Queue on the sender's lane and block until the transaction is sent"""
+        return self.submit(sender, contract_function).result(timeout)
+
+    def stats(self):
+        with self._lock:
+            names = {address: name for name, address in self._names.items()}
+            lanes = list(self._lanes.values())
+            tokens = set(self._token_hashes)
+        return [
+            {'name': names.get(lane.account.address), 'api_token': lane.account.address in tokens, **lane.stats()}
+            for lane in lanes
+        ]
+
+
+def write_token(path):
+    """Create a new API token, store its hash at path and return the token"""
+    token = secrets.token_urlsafe(32)
+    with open(path, 'w') as f:
+        f.write(hash_token(token) + '\n')
+    os.chmod(path, 0o600)
+    return token
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add a participant key to the signer keystore')
+    parser.add_argument('name', help='Participant name, e.g. distributor')
+    parser.add_argument('--keystore-dir', default=os.getenv('KEYSTORE_DIR', 'keystore'))
+    parser.add_argument('--rotate-token', action='store_true',
+                        help="Only issue a new API token for an existing signer")
+    args = parser.parse_args()
+
+    path = Path(args.keystore_dir) / f'{args.name}.json'
+    if not args.rotate_token:
+        private_key = getpass.getpass('Private key: ')
+        password = os.getenv('KEYSTORE_PASSWORD') or getpass.getpass('Keystore password: ')
+        os.makedirs(args.keystore_dir, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(Account.encrypt(private_key, password), f)
+        os.chmod(path, 0o600)
+        print(f"Wrote {path} for {Account.from_key(private_key).address}")
+    elif not path.exists():
+        parser.error(f'{path} does not exist')
+    token = write_token(path.with_suffix('.token'))
+    # Only the hash is stored, this is the one time the token is shown
+    print(f"API token for {args.name}: {token}")
+
+
+if __name__ == '__main__':
+    main()
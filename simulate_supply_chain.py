@@ -1,13 +1,25 @@
 # simulate_supply_chain.py
+import argparse
 import requests
 import json
+import os
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from pprint import pprint
-from time import sleep
+from time import sleep, time, perf_counter
 import random
 
+from eth_account import Account
+from eth_utils import to_checksum_address
+
 BASE_URL = 'http://localhost:5000'
 
+# Default Ganache account the API registers products with (same default as app.py)
+DEFAULT_PRIVATE_KEY = '0xef704a92be65bc0102ebb7b19418dc0a9b14ca7bd2ab01ff5aa0edd72d4fbfef'
+
 class SupplyChainSimulator:
     def __init__(self):
         # Simulated blockchain addresses for different parties
@@ -59,16 +71,17 @@ class SupplyChainSimulator:
 
         return batch_products
 
-    def register_batch(self, products):
-        """Register a batch of products"""
+    def register_batch(self, products, wait=True):
+        """Register a batch of products without waiting on each transaction"""
         results = []
         for product in products:
-            response = requests.post(f'{BASE_URL}/product/register', json=product)
+            response = requests.post(f'{BASE_URL}/product/register', params={'async': 'true'}, json=product)
             results.append(response.json())
-            sleep(1)  # Wait for blockchain transaction
+        if wait:
+            return self.wait_for_transactions(results)
         return results
 
-    def transfer_batch(self, products, from_party, to_party, transfer_type):
+    def transfer_batch(self, products, from_party, to_party, transfer_type, wait=True):
         """Transfer a batch of products between parties"""
         results = []
         for product in products:
@@ -78,9 +91,27 @@ class SupplyChainSimulator:
                 "new_owner": self.participants[to_party],
                 "transfer_type": transfer_type
             }
-            response = requests.post(f'{BASE_URL}/product/transfer', json=transfer_data)
+            response = requests.post(f'{BASE_URL}/product/transfer', params={'async': 'true'}, json=transfer_data)
             results.append(response.json())
-            sleep(1)
+        if wait:
+            return self.wait_for_transactions(results)
+        return results
+
+    def wait_for_transactions(self, results, poll_interval=0.5, timeout=120):
+        """Poll /tx/<hash> until every submitted transaction is mined or failed"""
+        pending = {r['transaction_hash']: i for i, r in enumerate(results) if r.get('status') == 'pending'}
+        deadline = time() + timeout
+        while pending and time() < deadline:
+            for tx_hash, index in list(pending.items()):
+                response = requests.get(f'{BASE_URL}/tx/{tx_hash}')
+                if response.status_code != 200:
+                    continue
+                tx = response.json()['transaction']
+                if tx['state'] != 'pending':
+                    results[index] = tx
+                    del pending[tx_hash]
+            if pending:
+                sleep(poll_interval)
         return results
 
     def verify_batch(self, products):
@@ -93,7 +124,308 @@ class SupplyChainSimulator:
             results.append(response.json())
         return results
 
-def main():
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None, 'max_ms': None}
+    return {
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+    }
+
+
+def parse_mix(value):
+    """Parse 'register=1,transfer=1,verify=3' into normalized operation weights"""
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in LoadGenerator.OPERATIONS:
+            raise argparse.ArgumentTypeError(f'Unknown operation {name!r}')
+        weights[name] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError('Operation mix must have a positive weight')
+    return {name: weight / total for name, weight in weights.items()}
+
+
+class LoadGenerator:
+    """Open-loop load test of the API with N concurrent virtual participants
+
+    Operations arrive as a Poisson process at a fixed rate regardless of how
+    fast the server answers, so a slow server builds a queue instead of
+    quietly lowering the offered load. Latency is measured from each
+    operation's scheduled start, which includes any time it waited for a
+    free participant. Only operations scheduled during the measurement phase
+    are reported; the warm-up phase fills caches, connection pools and the
+    product pools transfers and verifies draw from.
+    """
+
+    OPERATIONS = ('register', 'transfer', 'verify')
+
+    def __init__(self, simulator, base_url, participants=10, rate=20.0, mix=None,
+                 warmup=10.0, duration=60.0, seed_products=20, private_key=DEFAULT_PRIVATE_KEY,
+                 confirm_timeout=60.0, poll_interval=0.25):
+        self.simulator = simulator
+        self.base_url = base_url
+        self.participants = participants
+        self.rate = rate
+        self.mix = mix or {'register': 0.2, 'transfer': 0.2, 'verify': 0.6}
+        self.warmup = warmup
+        self.duration = duration
+        self.seed_products = seed_products
+        self.private_key = private_key
+        self.sender_address = Account.from_key(private_key).address
+        self.confirm_timeout = confirm_timeout
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counter = 0
+        self._run_id = uuid.uuid4().hex[:6].upper()
+        # Confirmed products still owned by the sender, and every confirmed product
+        self._transferable = []
+        self._known = []
+        # tx hash -> (operation, submitted at, measured, product)
+        self._pending = {}
+        self._stop_polling = threading.Event()
+
+        self._latencies = defaultdict(list)
+        self._errors = defaultdict(lambda: defaultdict(int))
+        self._skipped = defaultdict(int)
+        self._confirmation_lags = defaultdict(list)
+        self._confirmation_failures = defaultdict(int)
+
+    def _session(self):
+        # One keep-alive session per participant thread
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _new_product(self):
+        with self._lock:
+            self._counter += 1
+            counter = self._counter
+        template = self.simulator.product_templates[random.choice(list(self.simulator.product_templates))]
+        return {
+            'product_id': f"{template['base_id']}{self._run_id}",
+            'manufacturer': template['manufacturer'],
+            'batch_number': f'LOAD{self._run_id}',
+            'manufacture_date': datetime.now().strftime('%Y-%m-%d'),
+            'expiry_date': (datetime.now() + timedelta(days=template['shelf_life_days'])).strftime('%Y-%m-%d'),
+            'gtin': f"0590123{random.randint(1000000, 9999999)}",
+            'serial_number': f'SER{counter:08d}'
+        }
+
+    def _take_transferable(self):
+        with self._lock:
+            if not self._transferable:
+                return None
+            return self._transferable.pop(random.randrange(len(self._transferable)))
+
+    def _pick_known(self):
+        with self._lock:
+            return random.choice(self._known) if self._known else None
+
+    def _request(self, operation):
+        """Run one operation; return (response or None, tx bookkeeping or None)"""
+        session = self._session()
+        if operation == 'register':
+            product = self._new_product()
+            response = session.post(
+                f'{self.base_url}/product/register', params={'async': 'true'}, json=product
+            )
+            return response, product
+        if operation == 'transfer':
+            product = self._take_transferable()
+            if product is None:
+                return None, None
+            response = session.post(f'{self.base_url}/product/transfer', params={'async': 'true'}, json={
+                'product_id': product['product_id'],
+                'serial_number': product['serial_number'],
+                'new_owner': to_checksum_address(random.choice(list(self.simulator.participants.values()))),
+                'transfer_type': 'Manufacturer-to-Distributor',
+                'sender_address': self.sender_address,
+                'private_key': self.private_key
+            })
+            if response.status_code != 202:
+                # Still owned by the sender, keep it available
+                with self._lock:
+                    self._transferable.append(product)
+            return response, product
+        product = self._pick_known()
+        if product is None:
+            return None, None
+        response = session.get(
+            f"{self.base_url}/product/verify/{product['product_id']}/{product['serial_number']}"
+        )
+        return response, None
+
+    def _run_operation(self, operation, scheduled_at, measured):
+        try:
+            response, product = self._request(operation)
+        except requests.RequestException as e:
+            if measured:
+                with self._lock:
+                    self._latencies[operation].append(perf_counter() - scheduled_at)
+                    self._errors[operation][type(e).__name__] += 1
+            return
+        if response is None:
+            if measured:
+                with self._lock:
+                    self._skipped[operation] += 1
+            return
+
+        latency = perf_counter() - scheduled_at
+        tx_hash = None
+        if response.status_code == 202:
+            tx_hash = response.json().get('transaction_hash')
+        with self._lock:
+            if measured:
+                self._latencies[operation].append(latency)
+                if response.status_code >= 400:
+                    self._errors[operation][f'http_{response.status_code}'] += 1
+            if tx_hash:
+                self._pending[tx_hash] = (operation, perf_counter(), measured, product)
+
+    def _poll_confirmations(self):
+        session = requests.Session()
+        while not self._stop_polling.is_set() or self._pending:
+            with self._lock:
+                pending = list(self._pending.items())
+            for tx_hash, (operation, submitted_at, measured, product) in pending:
+                try:
+                    response = session.get(f'{self.base_url}/tx/{tx_hash}')
+                except requests.RequestException:
+                    continue
+                if response.status_code != 200:
+                    continue
+                state = response.json()['transaction']['state']
+                if state == 'pending':
+                    continue
+                with self._lock:
+                    del self._pending[tx_hash]
+                    if measured:
+                        if state == 'mined':
+                            self._confirmation_lags[operation].append(perf_counter() - submitted_at)
+                        else:
+                            self._confirmation_failures[operation] += 1
+                    if state == 'mined':
+                        self._known.append(product)
+                        if operation == 'register':
+                            self._transferable.append(product)
+            sleep(self.poll_interval)
+
+    def _seed(self):
+        """Register a starting pool of products so transfers and verifies have targets"""
+        products = [self._new_product() for _ in range(self.seed_products)]
+        results = self.simulator.register_batch(products)
+        for product, result in zip(products, results):
+            if result.get('state') == 'mined':
+                self._known.append(product)
+                self._transferable.append(product)
+
+    def run(self):
+        """Run warm-up and measurement phases and return the report dict"""
+        self._seed()
+        poller = threading.Thread(target=self._poll_confirmations, daemon=True)
+        poller.start()
+
+        operations = list(self.mix)
+        weights = [self.mix[name] for name in operations]
+        executor = ThreadPoolExecutor(max_workers=self.participants)
+        started = perf_counter()
+        measure_from = started + self.warmup
+        finish_at = measure_from + self.duration
+        next_arrival = started
+        offered = defaultdict(int)
+        while True:
+            next_arrival += random.expovariate(self.rate)
+            if next_arrival >= finish_at:
+                break
+            delay = next_arrival - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            operation = random.choices(operations, weights)[0]
+            measured = next_arrival >= measure_from
+            if measured:
+                offered[operation] += 1
+            executor.submit(self._run_operation, operation, next_arrival, measured)
+        executor.shutdown(wait=True)
+        drained_at = perf_counter()
+
+        # Let outstanding transactions confirm, up to confirm_timeout
+        self._stop_polling.set()
+        poller.join(self.confirm_timeout)
+        with self._lock:
+            unconfirmed = defaultdict(int)
+            for operation, _, measured, _ in self._pending.values():
+                if measured:
+                    unconfirmed[operation] += 1
+            return self._report(offered, unconfirmed, drained_at - measure_from)
+
+    def _report(self, offered, unconfirmed, measured_seconds):
+        endpoints = {}
+        for operation in self.OPERATIONS:
+            latencies = self._latencies.get(operation, [])
+            errors = dict(self._errors.get(operation, {}))
+            error_count = sum(errors.values())
+            endpoint = {
+                'offered': offered.get(operation, 0),
+                'completed': len(latencies),
+                'skipped': self._skipped.get(operation, 0),
+                'errors': error_count,
+                'error_rate': round(error_count / len(latencies), 4) if latencies else None,
+                'errors_by_type': errors,
+                'throughput_rps': round((len(latencies) - error_count) / measured_seconds, 2),
+                **latency_summary(latencies),
+            }
+            if operation != 'verify':
+                endpoint['confirmation_lag'] = {
+                    'confirmed': len(self._confirmation_lags.get(operation, [])),
+                    'failed': self._confirmation_failures.get(operation, 0),
+                    'unconfirmed': unconfirmed.get(operation, 0),
+                    **latency_summary(self._confirmation_lags.get(operation, [])),
+                }
+            endpoints[operation] = endpoint
+
+        all_latencies = [l for operation in self.OPERATIONS for l in self._latencies.get(operation, [])]
+        total_errors = sum(e['errors'] for e in endpoints.values())
+        return {
+            'generated_at': datetime.now().isoformat(),
+            'config': {
+                'base_url': self.base_url,
+                'participants': self.participants,
+                'rate_per_second': self.rate,
+                'mix': self.mix,
+                'warmup_seconds': self.warmup,
+                'duration_seconds': self.duration,
+                'seed_products': self.seed_products,
+            },
+            'overall': {
+                'completed': len(all_latencies),
+                'errors': total_errors,
+                'error_rate': round(total_errors / len(all_latencies), 4) if all_latencies else None,
+                'throughput_rps': round((len(all_latencies) - total_errors) / measured_seconds, 2),
+                **latency_summary(all_latencies),
+            },
+            'endpoints': endpoints,
+        }
+
+
+def run_walkthrough():
     # Initialize simulator
     simulator = SupplyChainSimulator()
 
@@ -124,21 +456,17 @@ def main():
     # Transfer antibiotics: Manufacturer -> Distributor -> Wholesaler -> Pharmacy
     print("\nTransferring antibiotics through supply chain...")
     simulator.transfer_batch(antibiotics, 'manufacturer', 'distributor', 'Manufacturer-to-Distributor')
-    sleep(2)
     simulator.transfer_batch(antibiotics, 'distributor', 'wholesaler', 'Distributor-to-Wholesaler')
-    sleep(2)
     simulator.transfer_batch(antibiotics, 'wholesaler', 'pharmacy_1', 'Wholesaler-to-Pharmacy')
 
     # Transfer vaccines: Manufacturer -> Distributor -> Hospital
     print("\nTransferring vaccines through supply chain...")
     simulator.transfer_batch(vaccines, 'manufacturer', 'distributor', 'Manufacturer-to-Distributor')
-    sleep(2)
     simulator.transfer_batch(vaccines, 'distributor', 'hospital', 'Distributor-to-Hospital')
 
     # Transfer controlled substances: Manufacturer -> Distributor -> Pharmacy
     print("\nTransferring controlled substances through supply chain...")
     simulator.transfer_batch(controlled, 'manufacturer', 'distributor', 'Manufacturer-to-Distributor')
-    sleep(2)
     simulator.transfer_batch(controlled, 'distributor', 'pharmacy_2', 'Distributor-to-Pharmacy')
 
     # Verify products at different stages
@@ -150,5 +478,54 @@ def main():
     print("\nVerifying controlled substances:")
     pprint(simulator.verify_batch(controlled))
 
+def main():
+    global BASE_URL
+    parser = argparse.ArgumentParser(description='Load test the supply chain API')
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--participants', type=int, default=10, help='Concurrent virtual participants')
+    parser.add_argument('--rate', type=float, default=20.0, help='Operations started per second (open loop)')
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help='Operation weights, e.g. register=1,transfer=1,verify=3')
+    parser.add_argument('--warmup', type=float, default=10.0, help='Seconds of unreported warm-up load')
+    parser.add_argument('--duration', type=float, default=60.0, help='Seconds of measured load')
+    parser.add_argument('--seed-products', type=int, default=20, help='Products registered before warm-up')
+    parser.add_argument('--private-key', default=os.getenv('PRIVATE_KEY', DEFAULT_PRIVATE_KEY),
+                        help="Key of the API's manufacturer account, used to sign transfers")
+    parser.add_argument('--confirm-timeout', type=float, default=60.0,
+                        help='Seconds to wait for outstanding transactions after the run')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--walkthrough', action='store_true',
+                        help='Run the original scripted supply chain walkthrough instead')
+    args = parser.parse_args()
+
+    BASE_URL = args.base_url
+    if args.walkthrough:
+        run_walkthrough()
+        return
+
+    response = requests.get(f'{BASE_URL}/health')
+    if not response.json()['blockchain_connected']:
+        print("Blockchain system is not connected!")
+        return
+
+    report = LoadGenerator(
+        SupplyChainSimulator(),
+        BASE_URL,
+        participants=args.participants,
+        rate=args.rate,
+        mix=args.mix,
+        warmup=args.warmup,
+        duration=args.duration,
+        seed_products=args.seed_products,
+        private_key=args.private_key,
+        confirm_timeout=args.confirm_timeout
+    ).run()
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
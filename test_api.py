@@ -2,7 +2,6 @@ import requests
 import json
 from datetime import datetime, timedelta
 from pprint import pprint
-from time import sleep
 from eth_utils import to_checksum_address
 from web3 import Web3
 import random
@@ -137,21 +136,18 @@ def main():
     reg_result = register_product(basic_med)
     if not reg_result:
         return
-    sleep(2)  # Wait for blockchain transaction
 
     # Example 2: Register a controlled substance
     controlled_med = generate_random_product_data()
     reg_result = register_product(controlled_med)
     if not reg_result:
         return
-    sleep(2)
 
     # Example 3: Register a vaccine
     vaccine = generate_random_product_data()
     reg_result = register_product(vaccine)
     if not reg_result:
         return
-    sleep(2)
 
     # Example 4: Transfer medication to distributor
     transfer_1 = {
@@ -163,7 +159,6 @@ def main():
     transfer_result = transfer_product(transfer_1)
     if not transfer_result:
         return
-    sleep(2)
 
     # Example 5: Transfer from distributor to pharmacy
     transfer_2 = {
@@ -175,7 +170,6 @@ def main():
     transfer_result = transfer_product(transfer_2)
     if not transfer_result:
         return
-    sleep(2)
 
     # Example 6: Verify products
     print("\nVerifying products...")
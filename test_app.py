@@ -0,0 +1,766 @@
+# test_app.py
+import gzip
+import json
+import os
+import time
+
+import pytest
+from eth_account import Account
+
+from app_common import MANUFACTURER_PRIVATE_KEY
+from signers import hash_token
+
+MANUFACTURER = Account.from_key(MANUFACTURER_PRIVATE_KEY)
+
+
+def register(client, product_data):
+    response = client.post('/product/register', json=product_data)
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def transfer(client, product_data, new_owner, sender=None, private_key=None, query='', token=None):
+    if sender is None:
+        sender, private_key = MANUFACTURER.address, MANUFACTURER_PRIVATE_KEY
+    body = {
+        'product_id': product_data['product_id'],
+        'serial_number': product_data['serial_number'],
+        'new_owner': new_owner,
+        'transfer_type': 'Distribution',
+        'sender_address': sender,
+    }
+    if private_key:
+        body['private_key'] = private_key
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    return client.post(f'/product/transfer{query}', json=body, headers=headers)
+
+
+def verify(client, product_data, query=''):
+    return client.get(f"/product/verify/{product_data['product_id']}/{product_data['serial_number']}{query}")
+
+
+def test_health(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.json['ready'] is True
+    assert response.json['rpc_endpoints'] == []
+
+
+def test_register_transfer_verify(client, chain, product_data):
+    register(client, product_data)
+    distributor, pharmacy = chain.accounts[1], chain.accounts[2]
+
+    response = transfer(client, product_data, distributor.address)
+    assert response.status_code == 200, response.json
+    response = transfer(client, product_data, pharmacy.address, distributor.address, distributor.key.hex())
+    assert response.status_code == 200, response.json
+
+    response = verify(client, product_data)
+    assert response.status_code == 200
+    result = response.json
+    assert result['product_info']['batch_number'] == product_data['batch_number']
+    assert result['product_info']['current_owner'] == pharmacy.address
+    assert [t['to'] for t in result['transfer_history']] == [distributor.address, pharmacy.address]
+
+
+def test_transfer_rejects_non_owner(client, chain, product_data):
+    register(client, product_data)
+    outsider = chain.accounts[3]
+    response = transfer(client, product_data, chain.accounts[1].address, outsider.address, outsider.key.hex())
+    assert response.status_code >= 400
+    assert verify(client, product_data).json['transfer_history'] == []
+
+
+def test_async_transfer_is_tracked(client, chain, product_data):
+    register(client, product_data)
+    response = transfer(client, product_data, chain.accounts[1].address, query='?async=true')
+    assert response.status_code == 202, response.json
+    tx_hash = response.json['transaction_hash']
+
+    deadline = time.monotonic() + 5
+    while True:
+        state = client.get(f'/tx/{tx_hash}').json['transaction']['state']
+        if state != 'pending' or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert state == 'mined'
+    assert verify(client, product_data).json['product_info']['current_owner'] == chain.accounts[1].address
+
+
+def test_verify_etag_round_trip(client, product_data):
+    register(client, product_data)
+    first = verify(client, product_data)
+    assert first.status_code == 200
+    again = client.get(
+        f"/product/verify/{product_data['product_id']}/{product_data['serial_number']}",
+        headers={'If-None-Match': first.headers['ETag']}
+    )
+    assert again.status_code == 304
+
+
+def test_verify_etag_counts_transfers_on_chain(app_module, client, chain, product_data, monkeypatch):
+    register(client, product_data)
+    assert transfer(client, product_data, chain.accounts[1].address).status_code == 200
+    # A transfer that can't be formatted is left out of the body but still counted
+    monkeypatch.setattr(app_module, 'format_transfer', lambda transfer_tuple: None)
+    first = verify(client, product_data)
+    assert first.json['transfer_history'] == []
+    assert first.headers['ETag'].endswith('-1"')
+    path = f"/product/verify/{product_data['product_id']}/{product_data['serial_number']}"
+    for query in ('', '?source=chain'):
+        again = client.get(path + query, headers={'If-None-Match': first.headers['ETag']})
+        assert again.status_code == 304
+
+
+def test_verify_pages_and_latest_history(client, chain, product_data):
+    register(client, product_data)
+    distributor, pharmacy = chain.accounts[1], chain.accounts[2]
+    assert transfer(client, product_data, distributor.address).status_code == 200
+    response = transfer(client, product_data, pharmacy.address, distributor.address, distributor.key.hex())
+    assert response.status_code == 200, response.json
+
+    first = verify(client, product_data, '?limit=1').json
+    assert [t['to'] for t in first['transfer_history']] == [distributor.address]
+    assert first['pagination'] == {'total': 2, 'limit': 1, 'cursor': '0', 'next_cursor': '1'}
+    second = verify(client, product_data, f"?limit=1&cursor={first['pagination']['next_cursor']}").json
+    assert [t['to'] for t in second['transfer_history']] == [pharmacy.address]
+    assert second['pagination']['next_cursor'] is None
+
+    latest = verify(client, product_data, '?latest=true').json
+    assert [t['to'] for t in latest['transfer_history']] == [pharmacy.address]
+    assert latest['pagination'] == {'total': 2, 'latest_only': True}
+
+
+def test_history_views_read_only_the_requested_transfers(chain, deploy_supply_chain):
+    supply_chain = deploy_supply_chain('PharmaSupplyChain')
+    assert supply_chain.history_paging
+    owners = [chain.deployer] + chain.accounts[7:10]
+    product = ('PRD-PAGED', 'SN-PAGED')
+    supply_chain.register_product(
+        'PRD-PAGED', 'Test Pharma', 'BATCH-P', 1704067200, 1767225600, '00012345678905', 'SN-PAGED'
+    ).transact({'from': owners[0].address})
+    assert supply_chain.fetch_latest_transfer(*product) == (None, 0)
+    for sender, receiver in zip(owners, owners[1:]):
+        supply_chain.transfer_product(*product, receiver.address, 'Distribution').transact({'from': sender.address})
+
+    history = supply_chain.fetch_transfer_history(*product)
+    assert [t[1] for t in history] == [owner.address for owner in owners[1:]]
+    assert supply_chain.fetch_transfer_count(*product) == 3
+    assert supply_chain.fetch_transfer_page(*product, 1, 1) == (history[1:2], 3)
+    assert supply_chain.fetch_transfer_page(*product, 1, 10) == (history[1:], 3)
+    assert supply_chain.fetch_transfer_page(*product, 5, 10) == ([], 3)
+    assert supply_chain.fetch_latest_transfer(*product) == (history[-1], 3)
+
+
+def test_v2_batch_register_transfer_and_verify(app_module, client, chain, deploy_supply_chain, monkeypatch):
+    from web3.exceptions import ContractLogicError
+
+    supply_chain = deploy_supply_chain('PharmaSupplyChainV2')
+    assert supply_chain.version == 2
+    manufacturer, distributor = chain.deployer, chain.accounts[7]
+    products = [
+        (f'PRD-V2-{i}', 'Test Pharma', f'BATCH-V2-{i}', 1704067200, 1767225600, '00012345678905', f'SN-V2-{i}')
+        for i in range(3)
+    ]
+    supply_chain.register_products(products).transact({'from': manufacturer.address})
+    with pytest.raises(ContractLogicError, match='already registered'):
+        supply_chain.register_products(products[:1]).transact({'from': manufacturer.address})
+
+    keys = [(p[0], p[6]) for p in products]
+    supply_chain.transfer_products(keys, distributor.address, 'Distribution').transact({'from': manufacturer.address})
+    with pytest.raises(ContractLogicError, match='Not authorized'):
+        supply_chain.transfer_products(keys, distributor.address, 'Distribution').transact(
+            {'from': manufacturer.address}
+        )
+
+    monkeypatch.setattr(app_module, 'supply_chain', supply_chain)
+    for product_id, _, batch, _, _, gtin, serial in products:
+        result = verify(client, {'product_id': product_id, 'serial_number': serial}).json
+        assert result['product_info']['batch_number'] == batch
+        assert result['product_info']['gtin'] == gtin
+        assert result['product_info']['current_owner'] == distributor.address
+        assert [(t['from'], t['to'], t['transfer_type']) for t in result['transfer_history']] == [
+            (manufacturer.address, distributor.address, 'Distribution')
+        ]
+
+
+def test_audit_export_resumes_from_cursor(client, product_data):
+    batch = product_data['batch_number'] + '-AUDIT'
+    products = [dict(product_data, serial_number=f"{product_data['serial_number']}-{i}", batch_number=batch)
+                for i in range(3)]
+    for product in products:
+        register(client, product)
+
+    response = client.get(f'/audit/export?batch_number={batch}')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    records, summary = lines[:-1], lines[-1]
+    assert [r['serial_number'] for r in records] == [p['serial_number'] for p in products]
+    assert all(r['product_info']['batch_number'] == batch for r in records)
+    assert summary == {'complete': True, 'snapshot_block': int(response.headers['X-Export-Snapshot-Block']),
+                       'exported': 3, 'cursor': records[-1]['cursor']}
+
+    response = client.get(f"/audit/export?batch_number={batch}&gzip=true&cursor={records[0]['cursor']}")
+    resumed = [json.loads(line) for line in gzip.decompress(response.get_data()).splitlines()]
+    assert [r['serial_number'] for r in resumed[:-1]] == [p['serial_number'] for p in products[1:]]
+
+
+def test_audit_export_rejects_bad_parameters(client):
+    assert client.get('/audit/export?from=01/02/2024').status_code == 400
+    assert client.get('/audit/export?cursor=nope').status_code == 400
+
+
+def test_verify_at_past_block_is_cached_once_final(app_module, client, chain, product_data):
+    # On by default, in the state directory
+    assert app_module.historical_cache.db_path == os.path.join(app_module.STATE_DIR, 'historical_cache.sqlite3')
+    register(client, product_data)
+    registered_block = chain.w3.eth.block_number
+    registered_at = chain.w3.eth.get_block(registered_block)['timestamp']
+    assert transfer(client, product_data, chain.accounts[1].address).status_code == 200
+    path = f"/product/verify/{product_data['product_id']}/{product_data['serial_number']}"
+
+    response = client.get(f'{path}?at_block={registered_block}')
+    assert response.status_code == 200, response.json
+    assert response.json['transfer_history'] == []
+    assert response.json['finalized'] is False
+    assert response.json['source'] == 'chain'
+
+    chain.mine(app_module.HISTORICAL_FINALITY_DEPTH)
+    first = client.get(f'{path}?at_block={registered_block}')
+    assert first.json['finalized'] is True
+    assert first.json['source'] == 'chain'
+    assert first.json['product_info']['current_owner'] == app_module.manufacturer_account.address
+    assert first.headers['Cache-Control'] == app_module.HISTORICAL_CACHE_CONTROL
+    again = client.get(f'{path}?at_block={registered_block}')
+    assert again.json['source'] == 'historical_cache'
+    assert again.json['product_info'] == first.json['product_info']
+
+    # Several blocks can share a second; at_time picks the last of them
+    at_time = client.get(f'{path}?at_time={registered_at}').json
+    assert at_time['at_block'] >= registered_block
+    assert chain.w3.eth.get_block(at_time['at_block'])['timestamp'] == registered_at
+    at_time_again = client.get(f'{path}?at_time={registered_at}').json
+    assert at_time_again['source'] == 'historical_cache'
+    assert at_time_again['product_info'] == at_time['product_info']
+    assert app_module.historical_cache.stats()['hits'] >= 2
+
+    assert len(verify(client, product_data).json['transfer_history']) == 1
+    assert client.get(f'{path}?at_block=nope').status_code == 400
+    assert client.get(f'{path}?at_time=1').status_code == 400
+
+
+def test_indexer_rebuilds_when_cursor_no_longer_matches(app_module, client, product_data, tmp_path):
+    from indexer import EventIndexer
+
+    register(client, product_data)
+    indexer = EventIndexer(app_module.w3, app_module.supply_chain, str(tmp_path / 'index.sqlite3'))
+    indexer.sync()
+    key = (product_data['product_id'], product_data['serial_number'])
+    assert indexer.get_product_info(*key) is not None
+
+    # A reset chain or reorg leaves a cursor whose block hash the node no longer has
+    with indexer._db:
+        indexer._db.execute("UPDATE meta SET value = ? WHERE key = 'last_block_hash'", ('0x' + '00' * 32,))
+        indexer._db.execute('DELETE FROM products')
+    indexer.sync()
+    assert indexer.get_product_info(*key) is not None
+
+
+def test_product_filter_never_rejects_a_registered_product(app_module, client, chain, product_data, tmp_path):
+    from chain_head import ChainHead
+    from product_filter import RegisteredProductFilter
+    from shared_state import SharedMarker, SharedState
+
+    state = SharedState(str(tmp_path / 'state.sqlite3'))
+
+    def load_filter(persist=True):
+        return RegisteredProductFilter(
+            app_module.w3, app_module.supply_chain, str(tmp_path / 'filter.bloom'), persist=persist,
+            head=ChainHead(app_module.w3, shared=SharedMarker(state, 'chain_head')),
+            shared_cursor=SharedMarker(state, 'product_filter')
+        )
+
+    product_filter = load_filter()
+    product_filter.sync()
+    follower = load_filter(persist=False)
+    key = (product_data['product_id'], product_data['serial_number'])
+    assert product_filter.definitely_absent(*key)
+    assert follower.definitely_absent(*key)
+    # The leader syncs empty blocks without rewriting the file; the follower still trusts it
+    chain.mine()
+    product_filter.sync()
+    assert follower.definitely_absent(*key)
+
+    # Saved with a cursor past the head, as a filter from before a chain reset would be
+    synced_block = product_filter.last_block
+    product_filter.last_block = synced_block + 100
+    product_filter._dirty = True
+    product_filter._save()
+    product_filter.last_block = synced_block
+
+    # Mined after the last sync, as if through another worker process. Lookups
+    # never call the node: a stale head or one past the last sync goes to the node
+    register(client, product_data)
+    fetches = product_filter.head.fetches
+    product_filter.max_staleness = 0
+    assert not product_filter.definitely_absent(*key)
+    product_filter.max_staleness = 5.0
+    product_filter.head.observe(chain.w3.eth.block_number)
+    assert not product_filter.definitely_absent(*key)
+    assert not follower.definitely_absent(*key)
+    assert (product_filter.head.fetches, product_filter.last_block) == (fetches, synced_block)
+
+    reloaded = load_filter()
+    reloaded.sync()
+    assert reloaded.last_block == app_module.w3.eth.block_number
+    assert not reloaded.definitely_absent(*key)
+    assert not follower.definitely_absent(*key)
+
+
+def test_transfer_by_another_client_invalidates_cached_verify(app_module, client, chain, product_data):
+    register(client, product_data)
+    assert verify(client, product_data).json['transfer_history'] == []
+
+    # Sent straight to the chain, so only the log feed can tell this process about it
+    manufacturer = app_module.manufacturer_account
+    tx_hash = app_module.send_contract_transaction(
+        app_module.supply_chain.transfer_product(
+            product_data['product_id'], product_data['serial_number'], chain.accounts[1].address, 'Distribution'
+        ),
+        manufacturer.address,
+        manufacturer
+    )
+    chain.w3.eth.wait_for_transaction_receipt(tx_hash)
+
+    deadline = time.monotonic() + 5
+    while not verify(client, product_data).json['transfer_history'] and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert verify(client, product_data).json['product_info']['current_owner'] == chain.accounts[1].address
+
+
+def test_bulk_verify_reports_bad_items_individually(client, product_data):
+    register(client, product_data)
+    response = client.post('/product/verify/bulk', json={'items': [
+        {'product_id': product_data['product_id'], 'serial_number': product_data['serial_number']},
+        {'product_id': ['not', 'a', 'string'], 'serial_number': {'a': 1}},
+        {'product_id': 'only-an-id'},
+    ]})
+    assert response.status_code == 200, response.json
+    assert [r['status'] for r in response.json['results']] == ['success', 'error', 'error']
+
+
+def test_ingest_reports_bad_rows_without_aborting(client, product_data):
+    rows = [
+        product_data,
+        '{not json',
+        product_data,
+        dict(product_data, serial_number=product_data['serial_number'] + '-2'),
+    ]
+    body = '\n'.join(row if isinstance(row, str) else json.dumps(row) for row in rows)
+    response = client.post('/product/ingest', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200, response.json
+    report = response.json['report']
+    assert report['rows_registered'] == 2
+    assert report['rows_invalid'] == 1
+    assert report['rows_duplicate'] == 1
+    assert [e['row'] for e in report['errors']] == [2, 3]
+
+
+def test_ingest_cli_registers_without_importing_app(migrated_node, product_data, monkeypatch, capsys):
+    import sys
+
+    import ingest
+    from app_common import connect_supply_chain, format_product_info
+
+    # Importing app.py would start the API's node pool and background threads
+    monkeypatch.delitem(sys.modules, 'app', raising=False)
+    with open('products.ndjson', 'w') as f:
+        f.write(json.dumps(product_data) + '\n')
+        f.write(json.dumps({**product_data, 'serial_number': '', 'product_id': 'NO-SERIAL'}) + '\n')
+    monkeypatch.setattr(sys, 'argv', ['ingest.py', 'products.ndjson'])
+    ingest.main()
+
+    report = json.loads(capsys.readouterr().out)
+    assert (report['rows_registered'], report['rows_invalid']) == (1, 1)
+    assert 'app' not in sys.modules
+    assert 'eth_sendRawTransaction' in migrated_node.methods
+    _, supply_chain = connect_supply_chain()
+    product = supply_chain.fetch_product_info(product_data['product_id'], product_data['serial_number'])
+    assert format_product_info(product)['batch_number'] == product_data['batch_number']
+
+
+def test_audit_export_cli_exports_without_importing_app(migrated_node, product_data, monkeypatch, capsys):
+    import sys
+
+    import audit_export
+    import ingest
+
+    monkeypatch.delitem(sys.modules, 'app', raising=False)
+    with open('products.ndjson', 'w') as f:
+        f.write(json.dumps(product_data) + '\n')
+    monkeypatch.setattr(sys, 'argv', ['ingest.py', 'products.ndjson'])
+    ingest.main()
+    capsys.readouterr()
+
+    monkeypatch.setattr(sys, 'argv', ['audit_export.py', 'audit.ndjson.gz'])
+    audit_export.main()
+    assert json.loads(capsys.readouterr().out)['exported'] == 1
+    assert 'app' not in sys.modules
+    with gzip.open('audit.ndjson.gz', 'rt') as f:
+        record = json.loads(f.readline())
+    assert record['product_info']['serial_number'] == product_data['serial_number']
+
+
+def test_server_signer_requires_its_token(app_module, client, chain, product_data):
+    register(client, product_data)
+    distributor = chain.accounts[4]
+    app_module.signers.add(distributor, 'test-distributor', hash_token('distributor-secret'))
+    assert transfer(client, product_data, distributor.address).status_code == 200
+
+    # The manufacturer key is never lent out by name
+    response = transfer(client, product_data, chain.accounts[5].address, sender='manufacturer')
+    assert response.status_code == 400
+    for token in (None, 'wrong'):
+        response = transfer(client, product_data, chain.accounts[5].address, sender='test-distributor', token=token)
+        assert response.status_code == 401
+    response = transfer(client, product_data, chain.accounts[5].address, sender='test-distributor',
+                        token='distributor-secret')
+    assert response.status_code == 200, response.json
+    assert verify(client, product_data).json['product_info']['current_owner'] == chain.accounts[5].address
+
+
+def test_node_connection_never_resends_a_transaction():
+    from requests.exceptions import ConnectionError as RequestsConnectionError
+
+    from node_connection import NodeConnection
+
+    calls = []
+
+    def make_request(method, params):
+        calls.append(method)
+        if len(calls) % 2:
+            raise RequestsConnectionError('connection reset')
+        return {'result': '0x1'}
+
+    node = NodeConnection()
+    request = node.middleware(make_request, None)
+    node.state = 'connected'
+    assert request('eth_blockNumber', []) == {'result': '0x1'}
+    with pytest.raises(RequestsConnectionError):
+        request('eth_sendRawTransaction', ['0x00'])
+    assert calls == ['eth_blockNumber', 'eth_blockNumber', 'eth_sendRawTransaction']
+
+
+def test_nonce_manager_allocates_releases_and_resyncs(chain):
+    from nonce_manager import NonceManager, is_nonce_error
+
+    account = Account.create()
+    chain.fund(account.address)
+    manager = NonceManager(chain.w3)
+    assert [manager.allocate(account.address) for _ in range(3)] == [0, 1, 2]
+    # The highest nonce rolls the counter back; a lower one becomes a gap that is filled first
+    manager.release(account.address, 2)
+    manager.release(account.address, 0)
+    assert [manager.allocate(account.address) for _ in range(3)] == [0, 2, 3]
+
+    def payment(nonce):
+        tx = {'to': account.address, 'value': 0, 'gas': 21000, 'gasPrice': chain.w3.eth.gas_price,
+              'nonce': nonce, 'chainId': chain.w3.eth.chain_id}
+        return account.sign_transaction(tx).rawTransaction
+
+    # Another client sends from the same account behind the manager's back
+    manager = NonceManager(chain.w3)
+    nonce = manager.allocate(account.address)
+    chain.w3.eth.send_raw_transaction(payment(nonce))
+    with pytest.raises(Exception) as rejected:
+        chain.w3.eth.send_raw_transaction(payment(nonce))
+    assert is_nonce_error(rejected.value)
+    manager.resync(account.address)
+    assert manager.allocate(account.address) == nonce + 1
+
+
+def test_fee_oracle_refreshes_per_block_and_gas_estimates_are_cached(app_module, chain, product_data):
+    from app_common import registration_args
+    from chain_head import ChainHead
+    from fee_oracle import FeeOracle, GasEstimator
+
+    oracle = FeeOracle(chain.w3, head=ChainHead(chain.w3, max_age=0))
+    assert oracle.fee_params() == oracle.fee_params() == {'gasPrice': chain.w3.eth.gas_price}
+    assert (oracle.refreshes, oracle.hits) == (1, 1)
+    chain.mine()
+    oracle.fee_params()
+    assert (oracle.refreshes, oracle.hits) == (2, 1)
+
+    estimator = GasEstimator(chain.w3)
+    same_size = {**product_data, 'serial_number': product_data['serial_number'][::-1]}
+    longer = {**product_data, 'manufacturer': 'Test Pharma' * 10}
+    limits = [
+        estimator.gas_limit(app_module.supply_chain.register_product(*registration_args(data)), chain.deployer.address)
+        for data in (product_data, same_size, longer)
+    ]
+    assert (estimator.misses, estimator.hits) == (2, 1)
+    assert limits[0] == limits[1] < limits[2]
+
+
+def test_single_flight_coalesces_concurrent_reads_into_one_node_call(chain):
+    import threading
+
+    from cache import SingleFlight
+
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def read_head():
+        calls.append(1)
+        release.wait(5)
+        return chain.w3.eth.block_number
+
+    results = []
+    readers = [
+        threading.Thread(target=lambda: results.append(flight.do(('block_number',), read_head)))
+        for _ in range(8)
+    ]
+    for reader in readers:
+        reader.start()
+    # Every reader is waiting on the first one's call before it finishes
+    deadline = time.time() + 5
+    while flight.stats()['reads'].get('block_number', {}).get('coalesced', 0) < 7 and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for reader in readers:
+        reader.join()
+    assert len(calls) == 1
+    assert results == [chain.w3.eth.block_number] * 8
+    assert flight.stats()['reads']['block_number'] == {'executed': 1, 'coalesced': 7}
+
+
+def test_metrics_renders_prometheus_text(client):
+    from metrics import MetricsRegistry
+
+    registry = MetricsRegistry(namespace='test')
+    registry.counter('hits_total', 'Hits', ('route',)).inc('/a "b"')
+    registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0)).observe(0.5)
+    registry.callback('entries', 'Entries', lambda: 3)
+    registry.callback('broken', 'Raises at scrape time', lambda: 1 / 0)
+    assert registry.render().splitlines() == [
+        '# HELP test_hits_total Hits',
+        '# TYPE test_hits_total counter',
+        'test_hits_total{route="/a \\"b\\""} 1',
+        '# HELP test_latency_seconds Latency',
+        '# TYPE test_latency_seconds histogram',
+        'test_latency_seconds_bucket{le="0.1"} 0',
+        'test_latency_seconds_bucket{le="1"} 1',
+        'test_latency_seconds_bucket{le="+Inf"} 1',
+        'test_latency_seconds_sum 0.5',
+        'test_latency_seconds_count 1',
+        '# HELP test_entries Entries',
+        '# TYPE test_entries gauge',
+        'test_entries 3',
+    ]
+
+    client.get('/health')
+    response = client.get('/metrics')
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert '# TYPE pharma_http_requests_total counter' in text
+    assert 'pharma_http_requests_total{route="/health",method="GET",status="200"}' in text
+    assert 'pharma_http_request_duration_seconds_bucket{route="/health",method="GET",le="+Inf"}' in text
+    assert 'pharma_rpc_request_duration_seconds_count{method="eth_blockNumber"}' in text
+
+
+def test_metrics_sums_counters_and_histograms_across_workers(tmp_path):
+    from metrics import MetricsRegistry
+    from shared_state import SharedMetrics, SharedState
+
+    state = SharedState(str(tmp_path / 'state.sqlite3'))
+    workers = []
+    for name, hits, latency, pending in (('1', 2, 0.05, 7), ('2', 3, 0.5, 9)):
+        registry = MetricsRegistry(namespace='test')
+        registry.counter('hits_total', 'Hits', ('route',)).inc('/a', amount=hits)
+        registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0)).observe(latency)
+        registry.callback('lookups_total', 'Lookups', lambda hits=hits: hits, metric_type='counter')
+        registry.callback('pending', 'Pending', lambda pending=pending: pending)
+        workers.append(SharedMetrics(state, registry, worker=name))
+    for worker in workers:
+        worker.publish()
+
+    # Worker 1 renders its own live values plus worker 2's snapshot
+    text = workers[0].render()
+    assert 'test_hits_total{route="/a"} 5' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{le="1"} 2' in text
+    assert 'test_latency_seconds_count 2' in text
+    assert 'test_lookups_total 5' in text
+    # Gauges describe the worker serving the scrape
+    assert 'test_pending 7' in text
+
+
+def test_x_profile_writes_a_profile_only_when_enabled_and_allowed(app_module, client, monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'PROFILE_DIR', str(tmp_path))
+    # conftest leaves PROFILING_ENABLED unset, so the hooks are not registered
+    response = client.get('/health', headers={'X-Profile': 'pstats'})
+    assert 'X-Profile-File' not in response.headers
+    assert client.get('/debug/profile?seconds=0.01').status_code == 404
+    assert list(tmp_path.iterdir()) == []
+
+    def profiled(headers, remote_addr='127.0.0.1'):
+        with app_module.app.test_request_context('/health', headers=headers,
+                                                 environ_base={'REMOTE_ADDR': remote_addr}):
+            app_module.start_request_profile()
+            return app_module.finish_request_profile(app_module.app.response_class('ok'))
+
+    response = profiled({'X-Profile': 'pstats'})
+    assert (tmp_path / response.headers['X-Profile-File'].rsplit('/', 1)[-1]).exists()
+    assert profiled({'X-Profile': 'pstats'}, remote_addr='10.0.0.5').headers['X-Profile-Skipped'] == 'forbidden'
+
+    monkeypatch.setattr(app_module, 'PROFILE_TOKEN', 'profile-secret')
+    headers = {'X-Profile': 'collapsed', 'X-Profile-Token': 'profile-secret'}
+    assert profiled({'X-Profile': 'collapsed', 'X-Profile-Token': 'wrong'}).headers['X-Profile-Skipped'] == 'forbidden'
+    assert 'X-Profile-File' in profiled(headers, remote_addr='10.0.0.5').headers
+
+    # A second profile while one is running is skipped, not stacked
+    with app_module.app.test_request_context('/health', headers=headers):
+        app_module.start_request_profile()
+        assert profiled(headers).headers['X-Profile-Skipped'] == 'busy'
+        app_module.finish_request_profile(app_module.app.response_class('ok'))
+    assert 'X-Profile-File' in profiled(headers).headers
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+def test_rpc_pool_fails_over_without_resending_writes_and_reads_its_writes(rpc_nodes):
+    from web3 import Web3
+
+    from rpc_pool import NodeHTTPError, PooledHTTPProvider
+
+    primary, replica = rpc_nodes(2)
+    pool = PooledHTTPProvider([primary.url, replica.url], health_interval=3600)
+    pool._monitor = 'disabled'  # probes run by hand below
+    w3 = Web3(pool)
+    sender, receiver = primary.chain.accounts[1], primary.chain.accounts[2].address
+
+    def signed_payment(node=primary):
+        # The chains are independent, so the nonce comes from the node meant to take the payment
+        tx = {'to': receiver, 'value': 1, 'gas': 21000, 'gasPrice': w3.eth.gas_price,
+              'nonce': node.chain.w3.eth.get_transaction_count(sender.address), 'chainId': w3.eth.chain_id}
+        return sender.sign_transaction(tx).rawTransaction
+
+    def balance_read_by():
+        primary.methods.clear()
+        replica.methods.clear()
+        w3.eth.get_balance(receiver)
+        return primary if 'eth_getBalance' in primary.methods else replica
+
+    # Lag: a replica behind the primary gets no reads, one that caught up does
+    primary.chain.mine(3)
+    pool.probe()
+    pool.endpoints[0].latency, pool.endpoints[1].latency = 1.0, 0.001
+    assert balance_read_by() is primary
+    replica.chain.mine(3)
+    pool.probe()
+    pool.endpoints[0].latency, pool.endpoints[1].latency = 1.0, 0.001
+    assert balance_read_by() is replica
+
+    # Read-your-writes: once a receipt is seen, a replica whose last known head
+    # is below its block gets no reads until a probe shows it caught up
+    receipt = w3.eth.wait_for_transaction_receipt(w3.eth.send_raw_transaction(signed_payment()), poll_latency=0.05)
+    assert pool.min_read_block == receipt['blockNumber'] > pool.endpoints[1].head
+    assert balance_read_by() is primary
+
+    # A 5xx means the node got the request: a read moves on, a write is not resent
+    payment = signed_payment()
+    primary.fail_status = 502
+    with pytest.raises(NodeHTTPError):
+        w3.eth.send_raw_transaction(payment)
+    assert 'eth_sendRawTransaction' not in replica.methods
+    assert pool.status()[0]['healthy'] is False
+    assert w3.eth.block_number == replica.chain.w3.eth.block_number
+
+    # A refused connection never reached the node, so even a write fails over
+    primary.fail_status = None
+    pool.probe()
+    assert pool.primary() is pool.endpoints[0]
+    payment = signed_payment(replica)
+    primary.stop()
+    replica.methods.clear()
+    tx_hash = w3.eth.send_raw_transaction(payment)
+    assert 'eth_sendRawTransaction' in replica.methods
+    assert replica.chain.w3.eth.wait_for_transaction_receipt(tx_hash)['status'] == 1
+
+
+def test_send_keeps_its_nonce_when_delivery_is_unknown(app_module, client, chain, product_data, monkeypatch):
+    import requests
+
+    from app_common import registration_args
+
+    sender = chain.accounts[6]
+    real_send = app_module.w3.eth.send_raw_transaction
+
+    def dropped_after_delivery(raw_transaction):
+        real_send(raw_transaction)
+        raise requests.exceptions.ConnectionError('Connection reset by peer')
+
+    monkeypatch.setattr(app_module.w3.eth, 'send_raw_transaction', dropped_after_delivery)
+    register_call = app_module.supply_chain.register_product(*registration_args(product_data))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        app_module.send_contract_transaction(register_call, sender.address, sender.key)
+    monkeypatch.undo()
+
+    # The transaction landed, so its nonce must not be handed out again
+    assert verify(client, product_data).status_code == 200
+    next_nonce = app_module.nonce_manager.allocate(sender.address)
+    app_module.nonce_manager.release(sender.address, next_nonce)
+    assert next_nonce == chain.w3.eth.get_transaction_count(sender.address)
+
+
+def test_workers_share_nonce_gaps_and_one_leader(app_module, chain, tmp_path):
+    from event_stream import EventHub
+    from shared_state import LeaderLock, SharedEventLog, SharedNonceManager, SharedState
+
+    state = SharedState(str(tmp_path / 'state.sqlite3'))
+    nonces = SharedNonceManager(app_module.w3, state)
+    sender = chain.accounts[2].address
+    first, second, third = (nonces.allocate(sender) for _ in range(3))
+    # Released out of order, the middle nonce is handed out again before a new one
+    nonces.release(sender, second)
+    assert nonces.allocate(sender) == second
+    assert nonces.allocate(sender) == third + 1
+
+    leader = LeaderLock(str(tmp_path / 'state.lock'))
+    assert leader.acquire()
+    assert not LeaderLock(str(tmp_path / 'state.lock')).acquire()
+
+    # A follower's hub publishes what the leader appends, without polling the node
+    shared_events = SharedEventLog(state)
+    follower = EventHub(app_module.w3, app_module.supply_chain)
+    follower.follow_shared_log(shared_events)
+    seen = []
+    follower.listen(seen.append)
+    follower.start()
+    event = {'id': '1:0', 'event': 'ProductTransferred', 'block_number': 1, 'log_index': 0}
+    shared_events.append(event)
+    follower.poll()
+    assert seen == [event]
+
+
+def test_async_subscription_waits_without_a_thread_and_overflows():
+    import asyncio
+    import threading
+
+    from event_stream import AsyncSubscription
+
+    async def run():
+        subscription = AsyncSubscription(asyncio.get_running_loop(), max_queue=2)
+        events = [{'id': f'1:{i}', 'block_number': 1, 'log_index': i} for i in range(3)]
+        # The hub publishes from its own thread
+        publisher = threading.Thread(target=lambda: [subscription.offer(e) for e in events])
+        publisher.start()
+        publisher.join()
+        assert subscription.overflowed
+        received = [await subscription.get(1), await subscription.get(1)]
+        assert received == events[:2]
+        assert subscription.drained()
+        with pytest.raises(asyncio.TimeoutError):
+            await subscription.get(0.01)
+
+    asyncio.run(run())
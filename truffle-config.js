@@ -13,7 +13,8 @@ module.exports = {
           optimizer: {
             enabled: true,
             runs: 200
-          }
+          },
+          viaIR: true
         }
       }
     }
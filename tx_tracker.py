@@ -0,0 +1,189 @@
+# tx_tracker.py
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from web3.exceptions import TransactionNotFound
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_hash(tx_hash):
+    """Return a transaction hash as a lowercase 0x-prefixed hex string"""
+    if isinstance(tx_hash, (bytes, bytearray)):
+        tx_hash = tx_hash.hex()
+    tx_hash = tx_hash.lower()
+    return tx_hash if tx_hash.startswith('0x') else '0x' + tx_hash
+
+
+class ReceiptTracker:
+    """Resolves submitted transactions in a background thread, once per new block
+
+    Instead of every request blocking on wait_for_transaction_receipt, the
+    tracker reads each new block's transaction hashes once, matches them
+    against everything still pending and only then fetches receipts for the
+    transactions that were actually mined.
+    """
+
+    def __init__(self, w3, poll_interval=1.0, recent_blocks=16, drop_after_blocks=50, max_resolved=10000):
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.drop_after_blocks = drop_after_blocks
+        self.max_resolved = max_resolved
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._resolved = OrderedDict()
+        # Hashes seen in the last few scanned blocks, so a transaction that was
+        # mined before it was tracked (instant-mining nodes) is still resolved
+        self._recent_blocks = deque(maxlen=recent_blocks)
+        self._recent_hashes = {}
+        self._last_block = None
+        self._thread = None
+        self._listeners = []
+
+    def start(self):
+        """Start the background polling thread if it isn't running yet"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='receipt-tracker', daemon=True)
+            self._thread.start()
+
+    def subscribe(self, callback):
+        """Call callback(entry) whenever a tracked transaction is mined or fails"""
+        self._listeners.append(callback)
+
+    def track(self, tx_hash, **details):
+        """Register a submitted transaction and return its hash key"""
+        key = normalize_hash(tx_hash)
+        with self._lock:
+            self._pending[key] = {
+                'transaction_hash': key,
+                'state': 'pending',
+                'submitted_at': datetime.now().isoformat(),
+                'submitted_block': self._last_block,
+                **details,
+            }
+        self.start()
+        return key
+
+    def status(self, tx_hash):
+        """Return the known state of a transaction, or None if it isn't tracked"""
+        key = normalize_hash(tx_hash)
+        with self._lock:
+            entry = self._pending.get(key) or self._resolved.get(key)
+            return dict(entry) if entry else None
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Receipt tracker poll failed: {e}")
+            time.sleep(self.poll_interval)
+
+    def poll(self):
+        """Scan new blocks and resolve any pending transactions found in them"""
+        with self._lock:
+            if not self._pending:
+                # Nothing to resolve, don't spend RPC calls on idle blocks
+                self._last_block = None
+                return
+            last_block = self._last_block
+
+        latest = self.w3.eth.block_number
+        if last_block is None:
+            # Nothing was scanned while idle, and a burst can be mined in more
+            # blocks than the recent window holds, so look up what is pending
+            # directly once and follow new blocks from here on
+            with self._lock:
+                self._last_block = latest
+                for entry in self._pending.values():
+                    if entry['submitted_block'] is None:
+                        entry['submitted_block'] = latest
+                keys = list(self._pending)
+            for key in keys:
+                try:
+                    receipt = self.w3.eth.get_transaction_receipt(key)
+                except TransactionNotFound:
+                    continue
+                self._resolve_receipt(key, receipt)
+            return
+        if latest <= last_block:
+            return
+
+        # Everything scanned in this poll, which may be more blocks than the recent window keeps
+        scanned = set()
+        for number in range(last_block + 1, latest + 1):
+            block = self.w3.eth.get_block(number)
+            hashes = [normalize_hash(h) for h in block['transactions']]
+            scanned.update(hashes)
+            with self._lock:
+                if len(self._recent_blocks) == self._recent_blocks.maxlen:
+                    for old_hash in self._recent_blocks[0][1]:
+                        self._recent_hashes.pop(old_hash, None)
+                self._recent_blocks.append((number, hashes))
+                for h in hashes:
+                    self._recent_hashes[h] = number
+                self._last_block = number
+
+        with self._lock:
+            for entry in self._pending.values():
+                if entry['submitted_block'] is None:
+                    entry['submitted_block'] = latest
+            mined = [key for key in self._pending if key in self._recent_hashes or key in scanned]
+            stale = [
+                key for key, entry in self._pending.items()
+                if key not in self._recent_hashes and key not in scanned
+                and entry['submitted_block'] is not None
+                and latest - entry['submitted_block'] > self.drop_after_blocks
+            ]
+
+        for key in mined:
+            self._resolve_receipt(key, self.w3.eth.get_transaction_receipt(key))
+
+        for key in stale:
+            try:
+                # Mined in a block that was never scanned (tracked mid-poll)
+                self._resolve_receipt(key, self.w3.eth.get_transaction_receipt(key))
+                continue
+            except TransactionNotFound:
+                pass
+            try:
+                self.w3.eth.get_transaction(key)
+            except TransactionNotFound:
+                self._resolve(key, {
+                    'state': 'failed',
+                    'block_number': None,
+                    'error': 'Transaction dropped from the node pool',
+                })
+
+    def _resolve_receipt(self, key, receipt):
+        self._resolve(key, {
+            'state': 'mined' if receipt['status'] == 1 else 'failed',
+            'block_number': receipt['blockNumber'],
+            'gas_used': receipt['gasUsed'],
+        })
+
+    def _resolve(self, key, outcome):
+        with self._lock:
+            entry = self._pending.pop(key, None)
+            if entry is None:
+                return
+            entry.update(outcome)
+            entry['resolved_at'] = datetime.now().isoformat()
+            self._resolved[key] = entry
+            while len(self._resolved) > self.max_resolved:
+                self._resolved.popitem(last=False)
+            resolved = dict(entry)
+        for callback in self._listeners:
+            try:
+                callback(resolved)
+            except Exception as e:
+                logger.error(f"Receipt tracker listener failed for {key}: {e}")